@@ -12,5 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'irrigation_app.settings')
+os.environ.setdefault('DJANGO_ASYNC_VIEWS', '1')  # see ASYNC_VIEWS in settings.py
 
 application = get_asgi_application()
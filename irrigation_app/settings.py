@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'scheduler.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -122,3 +123,79 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Weather / ET data (see scheduler/weather.py)
+# Use 'scheduler.weather.StubBackend' to work offline.
+
+WEATHER_BACKEND = 'scheduler.weather.DavisBackend'
+WEATHER_OPTIONS = {
+    'api_key': os.environ.get('DAVIS_API_KEY', ''),
+    'timeout': 5,
+    'retries': 3,
+    'pool_size': 10,
+}
+WEATHER_CACHE_TTL = 6 * 60 * 60  # seconds
+
+# Background PDF reports (see scheduler/reports.py)
+# 'thread' builds on a small in-process pool; 'sync' builds inline.
+# A report still pending after REPORT_BUILD_TIMEOUT seconds is queued again.
+
+REPORT_WORKER = 'thread'
+REPORT_WORKERS = 2
+REPORT_BUILD_TIMEOUT = 10 * 60
+
+# Flow meter telemetry (see scheduler/telemetry.py)
+# Samples are buffered in memory and written once the buffer holds
+# TELEMETRY_FLUSH_SIZE points or TELEMETRY_FLUSH_INTERVAL seconds have passed.
+
+TELEMETRY_TOKEN = os.environ.get('TELEMETRY_TOKEN', '')
+TELEMETRY_FLUSH_SIZE = 5000
+TELEMETRY_FLUSH_INTERVAL = 5.0  # seconds
+
+# Request metrics (see scheduler/middleware.py), scraped from /metrics by staff
+# users or with "Authorization: Bearer <METRICS_TOKEN>"
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_LOG = False  # log one JSON line per request to the scheduler.metrics logger
+METRICS_REPEATED_QUERY_THRESHOLD = 10  # warn when a request repeats one query this often
+
+# Cache (see scheduler/dashboard.py). The per-process locmem cache is fine for a
+# single worker; with several workers use a shared backend such as
+# 'django.core.cache.backends.db.DatabaseCache' or '...filebased.FileBasedCache'
+# so invalidations reach every process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'irrigation',
+    }
+}
+DASHBOARD_CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+# Longest a worker serves its in-process ranch topology (scheduler/topology.py)
+# without rebuilding; bounds how stale it gets when the cache is not shared.
+TOPOLOGY_MAX_AGE = 60  # seconds
+
+# Allocation forecast (see scheduler/forecast.py). Trajectories run in
+# FORECAST_WORKERS processes when several ranches are forecast at once.
+
+ALLOCATION_SEASON_END = '12-31'  # month-day the allocation resets
+FORECAST_TRIALS = 5000
+FORECAST_WORKERS = 1
+FORECAST_CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+
+# Time-of-use electricity tariff for the off-peak pump schedule (see
+# scheduler/energy.py). 'base' is the $/kWh outside every window; windows are
+# matched in order, with hours as numbers (16.5 is 4:30pm) and days 0 = Monday.
+
+ENERGY_TARIFF = {
+    'base': 0.14,
+    'windows': [
+        {'name': 'peak', 'days': [0, 1, 2, 3, 4], 'start': 16, 'end': 21, 'price': 0.48},
+        {'name': 'part-peak', 'days': [0, 1, 2, 3, 4], 'start': 12, 'end': 16, 'price': 0.27},
+    ],
+}
+
+# Serve the read-only pages with their async versions (scheduler/async_views.py).
+# irrigation_app/asgi.py turns this on; WSGI deployments keep the sync views.
+
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
@@ -15,16 +15,18 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 # irrigation_app/urls.py
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
-from scheduler import views as scheduler_views
+from scheduler import async_views, views as scheduler_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/login/', auth_views.LoginView.as_view(), name='login'),
     path('accounts/logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('accounts/register/', scheduler_views.register, name='register'),
-    path('', scheduler_views.home, name='home'),
+    path('', (async_views if settings.ASYNC_VIEWS else scheduler_views).home, name='home'),
     path('scheduler/', include('scheduler.urls')),
+    path('metrics', scheduler_views.metrics, name='metrics'),
 ]
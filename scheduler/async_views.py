@@ -0,0 +1,102 @@
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponseBadRequest
+from django.shortcuts import render
+from django.utils import timezone
+from .dashboard import aget_dashboard, aget_dashboards, aget_ranch_index
+from .forecast import forecast_ranch
+from .forms import DateRangeForm
+from .models import Block, Ranch, WaterMeterReading
+from .reports import abuild_ranch_report
+from .topology import get_topology
+from .utils import aget_history_page, aget_metered_usage, aget_season_summaries, aget_weekly_water_usage
+from .views import RECENT_READINGS, well_rows
+
+# Async versions of the read-only pages, served in place of the views in
+# views.py when ASYNC_VIEWS is on (irrigation_app/asgi.py turns it on). Data
+# is loaded with the async ORM; templates still render in a worker thread,
+# since the template engine and its context processors are synchronous.
+
+arender = sync_to_async(render)
+
+async def _ranch(ranch_id):
+    try:
+        return await Ranch.objects.aget(id=ranch_id)
+    except Ranch.DoesNotExist:
+        raise Http404('Ranch not found')
+
+@login_required
+async def home(request):
+    ranches = await aget_ranch_index()
+    dashboards = await aget_dashboards([ranch_id for ranch_id, _ in ranches])
+    return await arender(request, 'scheduler/home.html', {
+        'ranches': [dashboards[ranch_id] for ranch_id, _ in ranches if ranch_id in dashboards],
+    })
+
+@login_required
+async def ranch_detail(request, ranch_id):
+    ranch = await aget_dashboard(ranch_id)
+    if ranch is None:
+        raise Http404('Ranch not found')
+    return await arender(request, 'scheduler/ranch_detail.html', {'ranch': ranch, 'blocks': ranch['blocks']})
+
+@login_required
+async def block_history(request, block_id):
+    try:
+        block = await Block.objects.with_relations().aget(id=block_id)
+    except Block.DoesNotExist:
+        raise Http404('Block not found')
+    try:
+        histories, next_cursor = await aget_history_page(block, request.GET.get('before'))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    weekly_gallons, weekly_acre_feet = await aget_weekly_water_usage(block)
+    return await arender(request, 'scheduler/block_history.html', {
+        'irrigation_block': block,
+        'histories': histories,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('before'),
+        'seasons': await aget_season_summaries(block),
+        'weekly_gallons': weekly_gallons,
+        'weekly_acre_feet': weekly_acre_feet,
+    })
+
+@login_required
+async def ranch_allocation_status(request, ranch_id):
+    ranch = await _ranch(ranch_id)
+    readings = WaterMeterReading.objects.for_ranch(ranch).with_relations().order_by('-date')[:RECENT_READINGS]
+    usage = await aget_metered_usage(ranch=ranch)
+    return await arender(request, 'scheduler/ranch_allocation_status.html', {
+        'ranch': ranch,
+        'readings': [reading async for reading in readings],
+        'total_gallons': usage['gallons'],
+        'total_acre_feet': usage['acre_feet'],
+        'allocation_remaining': ranch.allocation - usage['acre_feet'],
+        # CPU-bound simulation on a cache miss; keep it off the event loop
+        'forecast': await sync_to_async(forecast_ranch)(ranch),
+    })
+
+@login_required
+async def well_list(request, ranch_id):
+    # The topology index is in-process and mostly answers from memory
+    topology = await sync_to_async(get_topology)(ranch_id)
+    return await arender(request, 'scheduler/well_list.html', {'ranch': topology.ranch, 'wells': well_rows(topology)})
+
+@login_required
+async def ranch_report(request, ranch_id):
+    ranch = await _ranch(ranch_id)
+    from_date = timezone.now().date() - timedelta(days=7)
+    to_date = timezone.now().date()
+    if request.method == 'POST':
+        form = DateRangeForm(request.POST)
+        if form.is_valid():
+            from_date = form.cleaned_data['from_date']
+            to_date = form.cleaned_data['to_date']
+    else:
+        form = DateRangeForm(initial={'from_date': from_date, 'to_date': to_date})
+
+    return await arender(request, 'scheduler/ranch_report.html', {
+        'ranch': ranch, 'report_data': await abuild_ranch_report(ranch, from_date, to_date), 'form': form,
+        'from_date': from_date, 'to_date': to_date,
+    })
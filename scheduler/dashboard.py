@@ -0,0 +1,138 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Block, DailyWaterUsage, Ranch, Well
+
+# Per-ranch dashboard summaries (blocks, wells, allocation remaining and this
+# week's usage) kept in Django's cache as plain dicts, so any backend can hold
+# them. Keys carry today's date, which rolls the week over by itself; model
+# signals and refresh_daily_usage delete them whenever the underlying rows change.
+
+RANCH_INDEX_KEY = 'scheduler:ranches'
+
+def dashboard_key(ranch_id, day=None):
+    return f'scheduler:dashboard:{ranch_id}:{(day or timezone.localdate()).isoformat()}'
+
+def _timeout():
+    return getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 24 * 60 * 60)
+
+def _sum(field, **filters):
+    return Coalesce(Sum(field, filter=Q(**filters)), Value(Decimal('0')), output_field=DecimalField())
+
+def build_dashboards(ranch_ids, day=None):
+    # Summaries for several ranches in a fixed number of queries
+    day = day or timezone.localdate()
+    start_of_week = day - timedelta(days=day.weekday())
+    week = [start_of_week, start_of_week + timedelta(days=6)]
+
+    dashboards = {}
+    for ranch in Ranch.objects.filter(id__in=ranch_ids):
+        dashboards[ranch.id] = {
+            'id': ranch.id,
+            'name': ranch.name,
+            'allocation': ranch.allocation,
+            'week': week,
+            'blocks': [],
+            'wells': [],
+        }
+    if not dashboards:
+        return dashboards
+
+    blocks = Block.objects.filter(set__ranch__in=dashboards).select_related('set', 'well').order_by('set__number', 'name')
+    for block in blocks:
+        dashboards[block.set.ranch_id]['blocks'].append({
+            'id': block.id,
+            'name': block.name,
+            'variety': block.variety,
+            'acreage': block.acreage,
+            'gpm': block.gpm,
+            'set': block.set.number,
+            'well': block.well.name if block.well else '',
+        })
+    for well in Well.objects.filter(ranch__in=dashboards).order_by('name'):
+        dashboards[well.ranch_id]['wells'].append({'id': well.id, 'name': well.name, 'gpm': well.gpm})
+
+    usage = defaultdict(dict)
+    for row in DailyWaterUsage.objects.filter(ranch__in=dashboards).values('ranch').annotate(
+        week_gallons=_sum('gallons', block__isnull=False, date__range=week),
+        week_acre_feet=_sum('acre_feet', block__isnull=False, date__range=week),
+        week_metered_gallons=_sum('gallons', block__isnull=True, date__range=week),
+        week_metered_acre_feet=_sum('acre_feet', block__isnull=True, date__range=week),
+        metered_acre_feet=_sum('acre_feet', block__isnull=True),
+    ).order_by():
+        usage[row['ranch']] = row
+
+    for ranch_id, dashboard in dashboards.items():
+        row = usage[ranch_id]
+        for name in ('week_gallons', 'week_acre_feet', 'week_metered_gallons', 'week_metered_acre_feet', 'metered_acre_feet'):
+            dashboard[name] = row.get(name, Decimal('0'))
+        dashboard['allocation_remaining'] = dashboard['allocation'] - dashboard['metered_acre_feet']
+    return dashboards
+
+def get_dashboards(ranch_ids):
+    # Cached summaries by ranch id; missing ones are built together and cached
+    day = timezone.localdate()
+    keys = {ranch_id: dashboard_key(ranch_id, day) for ranch_id in ranch_ids}
+    cached = cache.get_many(keys.values())
+    dashboards = {ranch_id: cached[key] for ranch_id, key in keys.items() if key in cached}
+    missing = [ranch_id for ranch_id in ranch_ids if ranch_id not in dashboards]
+    if missing:
+        built = build_dashboards(missing, day)
+        cache.set_many({keys[ranch_id]: dashboard for ranch_id, dashboard in built.items()}, _timeout())
+        dashboards.update(built)
+    return dashboards
+
+async def aget_dashboards(ranch_ids):
+    day = timezone.localdate()
+    keys = {ranch_id: dashboard_key(ranch_id, day) for ranch_id in ranch_ids}
+    cached = await cache.aget_many(keys.values())
+    dashboards = {ranch_id: cached[key] for ranch_id, key in keys.items() if key in cached}
+    missing = [ranch_id for ranch_id in ranch_ids if ranch_id not in dashboards]
+    if missing:
+        built = await sync_to_async(build_dashboards)(missing, day)
+        await cache.aset_many({keys[ranch_id]: dashboard for ranch_id, dashboard in built.items()}, _timeout())
+        dashboards.update(built)
+    return dashboards
+
+def get_dashboard(ranch_id):
+    return get_dashboards([ranch_id]).get(ranch_id)
+
+async def aget_dashboard(ranch_id):
+    return (await aget_dashboards([ranch_id])).get(ranch_id)
+
+def get_ranch_index():
+    # (id, name) of every ranch, for the home page
+    ranches = cache.get(RANCH_INDEX_KEY)
+    if ranches is None:
+        ranches = list(Ranch.objects.order_by('name', 'id').values_list('id', 'name'))
+        cache.set(RANCH_INDEX_KEY, ranches, _timeout())
+    return ranches
+
+async def aget_ranch_index():
+    ranches = await cache.aget(RANCH_INDEX_KEY)
+    if ranches is None:
+        ranches = [ranch async for ranch in Ranch.objects.order_by('name', 'id').values_list('id', 'name')]
+        await cache.aset(RANCH_INDEX_KEY, ranches, _timeout())
+    return ranches
+
+def invalidate_dashboards(ranch_ids=None, index=False):
+    # Drop cached summaries now, and again once the surrounding transaction
+    # commits, so a read that races the write cannot leave stale data behind.
+    # ranch_ids=None means every ranch.
+    if ranch_ids is None:
+        ranch_ids = list(Ranch.objects.values_list('id', flat=True))
+        index = True
+    day = timezone.localdate()
+    keys = [dashboard_key(ranch_id, day) for ranch_id in set(ranch_ids) if ranch_id is not None]
+    if index:
+        keys.append(RANCH_INDEX_KEY)
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,143 @@
+import calendar
+import math
+
+import numpy as np
+from django.conf import settings
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .optimizer import ranch_jobs
+from .scheduler import irrigations_per_week
+
+# Energy-aware weekly pump timetable. The week (Monday 00:00 to Sunday 24:00)
+# is cut into STEP_MINUTES steps priced from the ENERGY_TARIFF time-of-use
+# windows. Each block runs irrigations_per_week times, the i-th run starting
+# within the i-th stretch of its irrigation interval and no closer than the
+# interval less MIN_GAP_SLACK to the run before it, and a well's running
+# blocks may never draw more than its gpm. A run's energy is its share of the
+# well's flow times the pump's kW, so its cheapest start does not depend on the
+# kW; runs are placed greedily, biggest energy first, at the cheapest start that
+# still fits under the well's capacity.
+
+STEP_MINUTES = 15
+STEPS_PER_DAY = 24 * 60 // STEP_MINUTES
+WEEK_STEPS = 7 * STEPS_PER_DAY
+
+MIN_GAP_SLACK = STEPS_PER_DAY // 2
+DEFAULT_TARIFF = {'base': 0.15, 'windows': []}
+
+def tariff_prices(tariff=None):
+    # $/kWh for every step of the week. Windows are matched in order, the first
+    # one covering a step wins; a window may run past midnight (start > end).
+    tariff = tariff or getattr(settings, 'ENERGY_TARIFF', DEFAULT_TARIFF)
+    prices = np.full(WEEK_STEPS, float(tariff.get('base', 0)))
+    assigned = np.zeros(WEEK_STEPS, dtype=bool)
+    hours = (np.arange(WEEK_STEPS) % STEPS_PER_DAY) * STEP_MINUTES / 60
+    weekdays = np.arange(WEEK_STEPS) // STEPS_PER_DAY
+    for window in tariff.get('windows', []):
+        start, end = float(window['start']), float(window['end'])
+        in_hours = (hours >= start) & (hours < end) if start <= end else (hours >= start) | (hours < end)
+        covered = in_hours & np.isin(weekdays, window.get('days', range(7))) & ~assigned
+        prices[covered] = float(window['price'])
+        assigned |= covered
+    return prices
+
+def _interval_days(block):
+    days = block.interval_between_irrigations if block.has_crop_x else block.days_between_irrigations
+    return days if days and days > 0 else 7
+
+def _runs(jobs, capacity, kw):
+    # One entry per irrigation of the week:
+    # (block, minutes, steps, gpm, kWh, earliest start, latest start, interval in steps)
+    runs = []
+    for block, minutes, gpm in jobs:
+        steps = max(1, math.ceil(minutes / STEP_MINUTES))
+        kwh = kw * min(gpm / capacity, 1) * minutes / 60 if capacity else 0.0
+        interval = _interval_days(block)
+        for i in range(irrigations_per_week(block)):
+            earliest = min(i * interval, 6) * STEPS_PER_DAY
+            latest = min((i + 1) * interval * STEPS_PER_DAY, WEEK_STEPS) - 1
+            runs.append((block, minutes, steps, gpm, kwh, earliest, latest, interval * STEPS_PER_DAY))
+    # Stable sort, so each block's runs stay together and in order
+    runs.sort(key=lambda run: (-run[4], -run[2], -run[3]))
+    return runs
+
+def _place(runs, capacity, prices):
+    # Greedy placement against the well's running flow; returns (run, start, over_capacity)
+    usage = np.zeros(WEEK_STEPS)
+    cost = np.concatenate([[0.0], np.cumsum(prices)])
+    placed = []
+    previous = {}  # block id -> start of its last placed run
+    for run in runs:
+        block, _, steps, gpm, _, earliest, latest, interval = run
+        if block.id in previous:
+            earliest = max(earliest, previous[block.id] + interval - MIN_GAP_SLACK)
+        steps = min(steps, WEEK_STEPS)
+        latest = min(latest, WEEK_STEPS - steps)
+        earliest = min(earliest, latest)
+        starts = np.arange(earliest, latest + 1)
+        window_cost = cost[starts + steps] - cost[starts]
+        peak = sliding_window_view(usage[earliest:latest + steps], steps).max(axis=1)
+        fits = peak + gpm <= capacity
+        over = not fits.any()
+        if over:
+            # Nothing fits: take the least loaded start, then the cheapest
+            candidates = np.flatnonzero(peak == peak.min())
+        else:
+            candidates = np.flatnonzero(fits)
+        start = int(starts[candidates[np.argmin(window_cost[candidates])]])
+        usage[start:start + steps] += gpm
+        previous[block.id] = start
+        placed.append((run, start, over))
+    return placed
+
+def _label(step):
+    minutes = step * STEP_MINUTES
+    return f'{calendar.day_abbr[minutes // (24 * 60) % 7]} {minutes // 60 % 24:02d}:{minutes % 60:02d}'
+
+def energy_schedule(ranch, tariff=None):
+    # Weekly run times per well at the lowest energy cost the greedy finds, next
+    # to the cost of starting every run as early as its interval allows.
+    prices = tariff_prices(tariff)
+    flat = np.zeros(WEEK_STEPS)
+    jobs_by_well, wells, unassigned = ranch_jobs(ranch)
+
+    timetable = []
+    for well_id, jobs in jobs_by_well.items():
+        well = wells[well_id]
+        capacity = float(well.gpm)
+        kw = float(well.pump_kw or 0)
+        runs = _runs(jobs, capacity, kw)
+
+        entries = []
+        for run, start, over in sorted(_place(runs, capacity, prices), key=lambda placed: placed[1]):
+            block, minutes, steps, gpm, kwh = run[:5]
+            price = float(prices[start:start + steps].mean())  # over the steps the run occupies
+            entries.append({
+                'block': block,
+                'start': start * STEP_MINUTES,
+                'end': start * STEP_MINUTES + minutes,
+                'start_label': _label(start),
+                'minutes': minutes,
+                'gpm': gpm,
+                'kwh': kwh,
+                'cost': kwh * price,
+                'over_capacity': over,
+            })
+        baseline = sum(run[4] * float(prices[start:start + run[2]].mean()) for run, start, _ in _place(runs, capacity, flat))
+        timetable.append({
+            'well': well,
+            'runs': entries,
+            'kwh': sum(entry['kwh'] for entry in entries),
+            'cost': sum(entry['cost'] for entry in entries),
+            'baseline_cost': baseline,
+            'missing_kw': well.pump_kw is None,
+        })
+
+    timetable.sort(key=lambda entry: entry['well'].name)
+    return {
+        'wells': timetable,
+        'kwh': sum(entry['kwh'] for entry in timetable),
+        'cost': sum(entry['cost'] for entry in timetable),
+        'baseline_cost': sum(entry['baseline_cost'] for entry in timetable),
+        'unassigned': unassigned,
+    }
@@ -0,0 +1,142 @@
+import csv
+import re
+import tempfile
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from .models import IrrigationHistory, WaterMeterReading
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX export is optional
+    Workbook = None
+
+try:
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+except ImportError:  # PDF export is optional
+    canvas = None
+
+CHUNK_SIZE = 2000
+PDF_MAX_ROWS = 5000  # about 80 pages
+
+# Every export walks a queryset with .iterator(). CSV streams straight to the
+# client and XLSX is written row by row to a temporary file, so neither grows
+# with the number of rows. A reportlab canvas keeps every page in memory until
+# it is saved, so PDFs stop at the PDF_EXPORT_MAX_ROWS setting (PDF_MAX_ROWS
+# by default); larger exports must use CSV or XLSX.
+
+def pdf_max_rows():
+    return getattr(settings, 'PDF_EXPORT_MAX_ROWS', PDF_MAX_ROWS)
+
+def ranch_report_rows(ranch, from_date, to_date):
+    histories = (
+        IrrigationHistory.objects
+        .for_ranch(ranch)
+        .filter(date__range=[from_date, to_date])
+        .with_relations()
+        .order_by('date', 'block__set', 'block')
+    )
+    yield ['Date', 'Day', 'Well', 'Set', 'Block', 'Acres', 'Minutes', 'Gallons', 'Acre-Feet']
+    for history in histories.iterator(chunk_size=CHUNK_SIZE):
+        yield [
+            history.date.isoformat(), history.date.strftime('%A'), history.well.name if history.well else '',
+            history.block.set.number, history.block.name, history.block.acreage,
+            history.minutes_irrigated, history.gallons_used, history.acre_feet_used,
+        ]
+
+def block_history_rows(block):
+    histories = IrrigationHistory.objects.filter(block=block).select_related('well').order_by('-date', '-id')
+    yield ['Date', 'Minutes Irrigated', 'Gallons Used', 'Acre-Feet Used', 'Well']
+    for history in histories.iterator(chunk_size=CHUNK_SIZE):
+        yield [
+            history.date.isoformat(), history.minutes_irrigated, history.gallons_used, history.acre_feet_used,
+            history.well.name if history.well else '',
+        ]
+
+def meter_reading_rows(ranch, from_date=None, to_date=None):
+    readings = WaterMeterReading.objects.for_ranch(ranch).with_relations().order_by('-date', '-id')
+    if from_date is not None:
+        readings = readings.filter(date__gte=from_date)
+    if to_date is not None:
+        readings = readings.filter(date__lte=to_date)
+    yield ['Date', 'Well', 'Gallons', 'Acre-Feet']
+    for reading in readings.iterator(chunk_size=CHUNK_SIZE):
+        yield [reading.date.isoformat(), reading.well.name if reading.well else '', reading.gallons, reading.acre_feet]
+
+class Echo:
+    # csv.writer target that hands each formatted line back instead of buffering it
+    def write(self, value):
+        return value
+
+def csv_response(rows, filename):
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+def xlsx_response(rows, filename, title):
+    if Workbook is None:
+        return HttpResponse('XLSX export requires openpyxl.', status=501)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(re.sub(r'[\\/?*\[\]:]', '', title)[:31])
+    for row in rows:
+        sheet.append(row)
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(
+        output, as_attachment=True, filename=f'{filename}.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+def write_pdf(rows, output, title):
+    # Draws the rows as a plain table, one page at a time. Raises ValueError
+    # past pdf_max_rows() rows, before anything is written to `output`.
+    limit = pdf_max_rows()
+    pdf = canvas.Canvas(output, pagesize=letter)
+    width, height = letter
+    rows = iter(rows)
+    header = next(rows)
+    column_width = (width - 72) / len(header)
+
+    def start_page():
+        pdf.setFont('Helvetica-Bold', 12)
+        pdf.drawString(36, height - 40, title)
+        pdf.setFont('Helvetica-Bold', 8)
+        for i, value in enumerate(header):
+            pdf.drawString(36 + i * column_width, height - 60, str(value))
+        pdf.setFont('Helvetica', 8)
+        return height - 74
+
+    y = start_page()
+    for count, row in enumerate(rows, 1):
+        if count > limit:
+            raise ValueError(f'PDF exports are limited to {limit} rows; export CSV or XLSX instead.')
+        if y < 40:
+            pdf.showPage()
+            y = start_page()
+        for i, value in enumerate(row):
+            pdf.drawString(36 + i * column_width, y, str(value)[:24])
+        y -= 11
+    pdf.save()
+
+def pdf_response(rows, filename, title):
+    if canvas is None:
+        return HttpResponse('PDF export requires reportlab.', status=501)
+    output = tempfile.TemporaryFile()
+    try:
+        write_pdf(rows, output, title)
+    except ValueError as e:
+        output.close()
+        return HttpResponse(str(e), status=413)
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=f'{filename}.pdf', content_type='application/pdf')
+
+EXPORT_FORMATS = {
+    'csv': lambda rows, filename, title: csv_response(rows, filename),
+    'xlsx': xlsx_response,
+    'pdf': pdf_response,
+}
+
+def export_response(rows, fmt, filename, title):
+    return EXPORT_FORMATS[fmt](rows, filename, title)
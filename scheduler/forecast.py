@@ -0,0 +1,203 @@
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Block, DailyWaterUsage, IrrigationSchedule, WeatherObservation
+from .scheduler import GALLONS_PER_ACRE_FOOT, calculate_irrigation_time, irrigations_per_week
+from .soil import APPLICATION_EFFICIENCY, DEFAULT_CROP_COEFFICIENT
+
+# End-of-season allocation forecast per ranch. Metered use so far this season is
+# projected to the end of the season over Monte Carlo ETo trajectories: each
+# trajectory scales a monthly ETo climatology of the ranch's location by a
+# season-wide anomaly and day-to-day noise. Blocks with a schedule use its weekly
+# volume, scaled by how far the trajectory's ETo departs from normal; blocks
+# without one use ETo x Kc over their acreage. Results are cached under a stamp
+# of the season's usage rollup (refresh_daily_usage rebuilds it with new ids
+# whenever history or meter data changes), a digest of the ranch's block
+# settings and latest schedules, and its allocation, so any of those changing
+# starts a fresh forecast.
+
+DEFAULT_TRIALS = 5000
+DEFAULT_ETO = 0.2  # inches per day, when a location has no weather history
+SEASON_VARIABILITY = 0.12  # spread of the season-wide ETo anomaly (log scale)
+DAILY_VARIABILITY = 0.25  # day-to-day spread used when history is too short to measure it
+CLIMATOLOGY_YEARS = 3
+
+def season_end(day):
+    # ALLOCATION_SEASON_END is the month and day the allocation resets ('MM-DD')
+    month, day_of_month = map(int, getattr(settings, 'ALLOCATION_SEASON_END', '12-31').split('-'))
+    end = date(day.year, month, day_of_month)
+    return end if end >= day else date(day.year + 1, month, day_of_month)
+
+def season_start(day):
+    end = season_end(day)
+    return end.replace(year=end.year - 1) + timedelta(days=1)
+
+def forecast_key(ranch_id, day, stamp, trials):
+    return f'scheduler:forecast:{ranch_id}:{day.isoformat()}:{stamp}:{trials}'
+
+def _usage_stamps(ranch_ids, day):
+    # Metered acre-feet so far this season and the rollup stamp of each ranch, in one query
+    stamps = {ranch_id: {'used': Decimal('0'), 'stamp': '0-0'} for ranch_id in ranch_ids}
+    rows = DailyWaterUsage.objects.filter(ranch__in=ranch_ids, date__range=[season_start(day), day]).values('ranch').annotate(
+        latest=Max('id'), rows=Count('id'),
+        used=Coalesce(Sum('acre_feet', filter=Q(block__isnull=True)), Value(Decimal('0')), output_field=DecimalField()),
+    ).order_by()
+    for row in rows:
+        stamps[row['ranch']] = {'used': row['used'], 'stamp': f"{row['latest']}-{row['rows']}"}
+    return stamps
+
+def _plan_stamps(ranch_ids):
+    # Digest of each ranch's block settings and latest schedule ids, in one query
+    digests = {ranch_id: hashlib.sha256() for ranch_id in ranch_ids}
+    fields = [field.attname for field in Block._meta.concrete_fields]
+    rows = (
+        Block.objects.filter(set__ranch__in=ranch_ids).annotate(latest_schedule=Max('irrigationschedule'))
+        .order_by('id').values_list('set__ranch', 'latest_schedule', *fields)
+    )
+    for ranch_id, *values in rows:
+        digests[ranch_id].update(repr(values).encode())
+    return {ranch_id: digest.hexdigest()[:16] for ranch_id, digest in digests.items()}
+
+def _climatology(locations, day):
+    # Mean ETo per location and month, plus the day-to-day spread around it
+    monthly = defaultdict(lambda: defaultdict(list))
+    observations = WeatherObservation.objects.filter(
+        location__in=locations, date__gte=day - timedelta(days=365 * CLIMATOLOGY_YEARS), date__lte=day,
+        reference_evapotranspiration__isnull=False,
+    ).values_list('location', 'date', 'reference_evapotranspiration')
+    for location, observed, eto in observations:
+        monthly[location][observed.month].append(float(eto))
+
+    climatology = {}
+    for location in locations:
+        months = {month: np.mean(values) for month, values in monthly[location].items()}
+        overall = np.mean([value for values in monthly[location].values() for value in values]) if months else DEFAULT_ETO
+        spreads = [np.std(np.log(np.maximum(values, 0.01))) for values in monthly[location].values() if len(values) > 7]
+        climatology[location] = {
+            'months': [months.get(month, overall) for month in range(1, 13)],
+            'variability': float(np.mean(spreads)) if spreads else DAILY_VARIABILITY,
+        }
+    return climatology
+
+def _inputs(ranches, day, trials):
+    # Everything the simulation needs, as plain numbers, for each ranch
+    ranches = {ranch.id: ranch for ranch in ranches}
+    latest_ids = (
+        IrrigationSchedule.objects.filter(block__set__ranch__in=ranches)
+        .values('block').annotate(latest_id=Max('id')).values_list('latest_id', flat=True)
+    )
+    schedules = {schedule.block_id: schedule for schedule in IrrigationSchedule.objects.filter(id__in=latest_ids)}
+    scheduled = defaultdict(float)  # acre-feet per day at normal ETo
+    unscheduled = defaultdict(float)  # acre-feet per inch of ETo
+    for block in Block.objects.filter(set__ranch__in=ranches).select_related('set'):
+        schedule = schedules.get(block.id)
+        if schedule is not None:
+            schedule.block = block
+            minutes = calculate_irrigation_time(schedule) or 0
+            weekly = float(minutes) * float(block.gpm) * irrigations_per_week(block) / GALLONS_PER_ACRE_FOOT
+            scheduled[block.set.ranch_id] += weekly / 7
+        else:
+            kc = float(block.et_crop_coefficient or DEFAULT_CROP_COEFFICIENT)
+            unscheduled[block.set.ranch_id] += kc * float(block.acreage) / 12 / APPLICATION_EFFICIENCY
+
+    end = season_end(day)
+    remaining = [day + timedelta(days=offset) for offset in range(1, (end - day).days + 1)]
+    climatology = _climatology({ranch.location for ranch in ranches.values()}, day)
+    inputs = {}
+    for ranch_id, ranch in ranches.items():
+        normal = climatology[ranch.location]
+        inputs[ranch_id] = {
+            'seed': [ranch_id, day.toordinal()],
+            'trials': trials,
+            'baseline': np.array([normal['months'][d.month - 1] for d in remaining], dtype=float),
+            'variability': normal['variability'],
+            'scheduled': scheduled[ranch_id],
+            'unscheduled': unscheduled[ranch_id],
+            'season_end': end,
+        }
+    return inputs
+
+def simulate(inputs):
+    # Projected acre-feet still to be used by the end of the season, one value
+    # per trajectory. Pure numpy, so it can run in a worker process.
+    rng = np.random.default_rng(inputs['seed'])
+    baseline = inputs['baseline']
+    trials = inputs['trials']
+    if not len(baseline):
+        return np.zeros(trials)
+    sigma = inputs['variability']
+    # Lognormal factors with a mean of 1, so the expected ETo is the climatology
+    season = rng.lognormal(-SEASON_VARIABILITY ** 2 / 2, SEASON_VARIABILITY, size=(trials, 1))
+    daily = rng.lognormal(-sigma ** 2 / 2, sigma, size=(trials, len(baseline)))
+    ratio = season * daily
+    return inputs['scheduled'] * ratio.sum(axis=1) + inputs['unscheduled'] * (ratio @ baseline)
+
+def _summary(ranch, used, remaining, inputs):
+    used = float(used)
+    total = used + remaining
+    allocation = float(ranch.allocation)
+    p10, p50, p90 = np.percentile(total, [10, 50, 90])
+    return {
+        'ranch_id': ranch.id,
+        'season_end': inputs['season_end'],
+        'days_remaining': len(inputs['baseline']),
+        'trials': inputs['trials'],
+        'used': round(used, 2),
+        'expected': round(float(total.mean()), 2),
+        'p10': round(float(p10), 2),
+        'p50': round(float(p50), 2),
+        'p90': round(float(p90), 2),
+        'allocation': allocation,
+        'exceed_probability': float((total > allocation).mean()),
+    }
+
+def _workers():
+    return getattr(settings, 'FORECAST_WORKERS', 1)
+
+def forecast_ranches(ranches, day=None, trials=None):
+    # Forecasts by ranch id. Cached ones cost two stamp queries; the rest are
+    # simulated together, across FORECAST_WORKERS processes when there are several.
+    day = day or timezone.localdate()
+    trials = trials or getattr(settings, 'FORECAST_TRIALS', DEFAULT_TRIALS)
+    ranches = {ranch.id: ranch for ranch in ranches}
+    stamps = _usage_stamps(list(ranches), day)
+    plans = _plan_stamps(list(ranches))
+    keys = {
+        ranch_id: forecast_key(ranch_id, day, f"{stamps[ranch_id]['stamp']}-{plans[ranch_id]}-{ranch.allocation}", trials)
+        for ranch_id, ranch in ranches.items()
+    }
+    cached = cache.get_many(keys.values())
+    forecasts = {ranch_id: cached[key] for ranch_id, key in keys.items() if key in cached}
+    missing = [ranch for ranch_id, ranch in ranches.items() if ranch_id not in forecasts]
+    if not missing:
+        return forecasts
+
+    inputs = _inputs(missing, day, trials)
+    order = list(inputs)
+    if _workers() > 1 and len(order) > 1:
+        with ProcessPoolExecutor(max_workers=min(_workers(), len(order))) as pool:
+            results = list(pool.map(simulate, [inputs[ranch_id] for ranch_id in order]))
+    else:
+        results = [simulate(inputs[ranch_id]) for ranch_id in order]
+
+    built = {
+        ranch_id: _summary(ranches[ranch_id], stamps[ranch_id]['used'], remaining, inputs[ranch_id])
+        for ranch_id, remaining in zip(order, results)
+    }
+    timeout = getattr(settings, 'FORECAST_CACHE_TIMEOUT', 24 * 60 * 60)
+    cache.set_many({keys[ranch_id]: forecast for ranch_id, forecast in built.items()}, timeout)
+    forecasts.update(built)
+    return forecasts
+
+def forecast_ranch(ranch, day=None, trials=None):
+    return forecast_ranches([ranch], day, trials).get(ranch.id)
@@ -3,10 +3,27 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from .models import *
+from .utils import fill_volume
 from django.utils import timezone
 from datetime import timedelta
 
 
+class RelatedChoicesMixin:
+    # Choice labels come from __str__, which follows set and ranch; load those
+    # relations with the choices instead of once per option. Given a ranch, the
+    # choices are limited to that ranch's rows.
+    def __init__(self, *args, ranch=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ranch = ranch
+        for field in self.fields.values():
+            queryset = getattr(field, 'queryset', None)
+            if isinstance(queryset, RanchScopedQuerySet):
+                if ranch is not None:
+                    queryset = queryset.for_ranch(ranch)
+                field.queryset = queryset.with_relations()
+            elif ranch is not None and queryset is not None and queryset.model is Ranch:
+                field.queryset = queryset.filter(pk=ranch.pk)
+
 class RegisterForm(UserCreationForm):
     email = forms.EmailField(required=True)
 
@@ -17,20 +34,21 @@ class RegisterForm(UserCreationForm):
 class RanchForm(forms.ModelForm):
     class Meta:
         model = Ranch
-        fields = ['name', 'allocation']
+        fields = ['name', 'allocation', 'location']
 
-class WellForm(forms.ModelForm):
+class WellForm(RelatedChoicesMixin, forms.ModelForm):
     class Meta:
         model = Well
-        fields = ['name', 'ranch', 'gpm']
+        fields = ['name', 'ranch', 'gpm', 'pump_kw']
 
 
-class BlockForm(forms.ModelForm):
+class BlockForm(RelatedChoicesMixin, forms.ModelForm):
     class Meta:
         model = Block
         fields = [
             'name', 'set', 'variety', 'acreage', 'gpm', 'water_quality', 'tree_spacing', 'emitter_output',
-            'has_crop_x', 'et_crop_coefficient', 'days_between_irrigations', 'interval_between_irrigations', 'well'
+            'has_crop_x', 'et_crop_coefficient', 'days_between_irrigations', 'interval_between_irrigations', 'well',
+            'root_zone_depth', 'available_water_capacity', 'allowable_depletion',
         ]
         widgets = {
             'et_crop_coefficient': forms.NumberInput(attrs={'step': '0.01'}),
@@ -39,14 +57,17 @@ class BlockForm(forms.ModelForm):
             'tree_spacing': forms.NumberInput(attrs={'step': '0.01'}),
             'emitter_output': forms.NumberInput(attrs={'step': '0.01'}),
             'water_quality': forms.NumberInput(attrs={'step': '0.01'}),
+            'root_zone_depth': forms.NumberInput(attrs={'step': '0.01'}),
+            'available_water_capacity': forms.NumberInput(attrs={'step': '0.01'}),
+            'allowable_depletion': forms.NumberInput(attrs={'step': '1'}),
         }
 
-class IrrigationSetForm(forms.ModelForm):
+class IrrigationSetForm(RelatedChoicesMixin, forms.ModelForm):
     class Meta:
         model = IrrigationSet
         fields = ['number', 'ranch']
 
-class IrrigationScheduleForm(forms.ModelForm):
+class IrrigationScheduleForm(RelatedChoicesMixin, forms.ModelForm):
     blocks = forms.ModelMultipleChoiceField(queryset=Block.objects.all(), widget=forms.CheckboxSelectMultiple)
 
     class Meta:
@@ -62,7 +83,7 @@ class IrrigationScheduleForm(forms.ModelForm):
             'distribution_uniformity': forms.NumberInput(attrs={'step': '0.01'}),
         }
 
-class WaterMeterReadingForm(forms.ModelForm):
+class WaterMeterReadingForm(RelatedChoicesMixin, forms.ModelForm):
     class Meta:
         model = WaterMeterReading
         fields = ['ranch', 'well', 'date', 'gallons', 'acre_feet']
@@ -78,13 +99,14 @@ class WaterMeterReadingForm(forms.ModelForm):
         if not gallons and not acre_feet:
             raise forms.ValidationError("Either gallons or acre-feet must be provided.")
 
-        if gallons and not acre_feet:
-            cleaned_data['acre_feet'] = gallons / 27154  # Convert gallons to acre-feet
-        if acre_feet and not gallons:
-            cleaned_data['gallons'] = acre_feet * 27154  # Convert acre-feet to gallons
+        cleaned_data['gallons'], cleaned_data['acre_feet'] = fill_volume(gallons, acre_feet)
 
         return cleaned_data
       
 class DateRangeForm(forms.Form):
     from_date = forms.DateField(initial=timezone.now().date() - timedelta(days=7), widget=forms.DateInput(attrs={'type': 'date'}))
     to_date = forms.DateField(initial=timezone.now().date(), widget=forms.DateInput(attrs={'type': 'date'}))
+
+class ImportForm(forms.Form):
+    kind = forms.ChoiceField(choices=[('readings', 'Water meter readings'), ('history', 'Irrigation history')])
+    file = forms.FileField(help_text='CSV with a header row.')
@@ -0,0 +1,231 @@
+import csv
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.db import connection, transaction
+from .models import Block, IrrigationHistory, ReportArtifact, WaterMeterReading, Well
+from .rollups import refresh_daily_usage
+from .soil import rewind_soil_water
+from .utils import GALLONS_PER_ACRE_FOOT, fill_volume
+
+CHUNK_SIZE = 5000
+BATCH_SIZE = 500
+
+# Bulk CSV import for one ranch. Rows are parsed and validated a chunk at a time
+# (no per-row form or query), then upserted: meter readings that match an
+# existing record on (well, date) are updated in place, the rest are inserted
+# with bulk_create. A block can be irrigated more than once a day, so history
+# rows only match a record with the same block, date, well and minutes, the
+# n-th such row in the file pairing with the n-th record; re-importing a file
+# updates its rows rather than doubling them. Bad rows are skipped and reported
+# by line number. The DailyWaterUsage rollup is refreshed once at the end, also
+# when a later chunk fails after earlier ones were committed.
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.errors = []  # (line number, message)
+        self.first_date = None
+        self.last_date = None
+
+    def add_dates(self, dates):
+        low, high = min(dates), max(dates)
+        self.first_date = low if self.first_date is None else min(self.first_date, low)
+        self.last_date = high if self.last_date is None else max(self.last_date, high)
+
+def _decimal(row, column, required=False):
+    value = (row.get(column) or '').strip().replace(',', '')
+    if not value:
+        if required:
+            raise ValueError(f'{column} is required')
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'{column} is not a number: {value!r}')
+    if not number.is_finite() or number < 0:
+        raise ValueError(f'{column} must be a non-negative number: {value!r}')
+    return number
+
+def _date(row):
+    value = (row.get('date') or '').strip()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'date must be YYYY-MM-DD: {value!r}')
+
+def _lookup(names, value, label):
+    # Match by id or by (case-insensitive) name
+    value = (value or '').strip()
+    if value.isdigit() and int(value) in names['ids']:
+        return names['ids'][int(value)]
+    obj = names['names'].get(value.lower())
+    if obj is None:
+        raise ValueError(f'unknown {label}: {value!r}')
+    return obj
+
+def _index(objects):
+    return {
+        'ids': {obj.id: obj for obj in objects},
+        'names': {obj.name.strip().lower(): obj for obj in objects},
+    }
+
+def _chunks(reader, size):
+    rows = enumerate(reader, start=2)  # line 1 is the header
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _check_columns(reader, required):
+    missing = [column for column in required if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+def _update(model, objects, fields):
+    # QuerySet.bulk_update builds a CASE expression per row, which dominates large
+    # imports. A parameterised UPDATE per row through executemany is far cheaper.
+    if not objects:
+        return
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in fields]
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote(model._meta.db_table),
+        ', '.join(f'{quote(field.column)} = %s' for field in fields),
+        quote(model._meta.pk.column),
+    )
+    params = [
+        [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] + [obj.pk]
+        for obj in objects
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+def _upsert(model, existing, parsed, update_fields, result):
+    # existing maps key -> id for records already in the database
+    updates, creates = [], []
+    for key, obj in parsed.items():
+        if key in existing:
+            obj.id = existing[key]
+            updates.append(obj)
+        else:
+            creates.append(obj)
+    _update(model, updates, update_fields)
+    model.objects.bulk_create(creates, batch_size=BATCH_SIZE)
+    result.updated += len(updates)
+    result.created += len(creates)
+
+def _import(reader, required, parse, save, chunk_size, result):
+    _check_columns(reader, required)
+    for chunk in _chunks(reader, chunk_size):
+        parsed = {}
+        for line, row in chunk:
+            try:
+                key, obj = parse(line, row)
+            except ValueError as e:
+                result.errors.append((line, str(e)))
+                continue
+            parsed[key] = obj  # a later row for the same key wins
+        if parsed:
+            with transaction.atomic():
+                save(parsed, result)
+            result.add_dates([obj.date for obj in parsed.values()])
+    return result
+
+def _finish(ranch, result):
+    # Bulk writes skip the signals that keep the rollup current
+    if result.first_date is not None:
+        refresh_daily_usage(result.first_date, result.last_date, [ranch.id])
+
+def import_meter_readings(ranch, file, chunk_size=CHUNK_SIZE):
+    # Columns: date, well (name or id, may be blank), gallons and/or acre_feet
+    wells = _index(list(Well.objects.for_ranch(ranch)))
+
+    def parse(line, row):
+        day = _date(row)
+        well = _lookup(wells, row.get('well'), 'well') if (row.get('well') or '').strip() else None
+        gallons, acre_feet = fill_volume(_decimal(row, 'gallons'), _decimal(row, 'acre_feet'))
+        if not gallons and not acre_feet:
+            raise ValueError('Either gallons or acre-feet must be provided.')
+        reading = WaterMeterReading(
+            ranch_id=ranch.id, well_id=well.id if well else None, date=day, gallons=gallons, acre_feet=acre_feet,
+        )
+        return (well.id if well else None, day), reading
+
+    def save(parsed, result):
+        dates = [key[1] for key in parsed]
+        existing = {}
+        for reading_id, well_id, day in WaterMeterReading.objects.filter(
+            ranch=ranch, date__range=[min(dates), max(dates)],
+        ).order_by('id').values_list('id', 'well_id', 'date'):
+            existing.setdefault((well_id, day), reading_id)
+        _upsert(WaterMeterReading, existing, parsed, ['gallons', 'acre_feet'], result)
+
+    result = ImportResult()
+    try:
+        return _import(csv.DictReader(file), ['date'], parse, save, chunk_size, result)
+    finally:
+        _finish(ranch, result)
+
+def import_irrigation_history(ranch, file, chunk_size=CHUNK_SIZE):
+    # Columns: date, block (name or id), minutes, optional gallons / acre_feet /
+    # well. Missing volumes are derived from minutes and the block's gpm.
+    blocks = _index(list(Block.objects.for_ranch(ranch).select_related('well')))
+    wells = _index(list(Well.objects.for_ranch(ranch)))
+
+    def parse(line, row):
+        day = _date(row)
+        block = _lookup(blocks, row.get('block'), 'block')
+        well = _lookup(wells, row.get('well'), 'well') if (row.get('well') or '').strip() else block.well
+        minutes = _decimal(row, 'minutes', required=True)
+        gallons, acre_feet = fill_volume(_decimal(row, 'gallons'), _decimal(row, 'acre_feet'))
+        if not gallons and not acre_feet:
+            gallons = (minutes * block.gpm).quantize(Decimal('0.01'))
+            acre_feet = (gallons / GALLONS_PER_ACRE_FOOT).quantize(Decimal('0.0001'))
+        history = IrrigationHistory(
+            block_id=block.id, well_id=well.id if well else None, date=day, minutes_irrigated=minutes,
+            gallons_used=gallons or Decimal('0'), acre_feet_used=acre_feet or Decimal('0'),
+            days_between_irrigations=block.days_between_irrigations if not block.has_crop_x else None,
+            interval_between_irrigations=block.interval_between_irrigations if block.has_crop_x else None,
+        )
+        # The line number keeps every row; save() pairs them with existing records
+        return (block.id, day, history.well_id, minutes, line), history
+
+    written = set()  # ids from earlier chunks, which later rows must not pair with again
+
+    def save(parsed, result):
+        dates = [key[1] for key in parsed]
+        records = defaultdict(list)
+        for history_id, *identity in IrrigationHistory.objects.filter(
+            block__set__ranch=ranch, date__range=[min(dates), max(dates)],
+        ).order_by('id').values_list('id', 'block_id', 'date', 'well_id', 'minutes_irrigated'):
+            if history_id not in written:
+                records[tuple(identity)].append(history_id)
+        existing = {}
+        for key in sorted(parsed, key=lambda key: key[-1]):
+            if records[key[:-1]]:
+                existing[key] = records[key[:-1]].pop(0)
+        _upsert(IrrigationHistory, existing, parsed, [
+            'gallons_used', 'acre_feet_used', 'days_between_irrigations', 'interval_between_irrigations',
+        ], result)
+        written.update(history.id for history in parsed.values())
+
+    result = ImportResult()
+    try:
+        return _import(csv.DictReader(file), ['date', 'block', 'minutes'], parse, save, chunk_size, result)
+    finally:
+        if result.first_date is not None:
+            # Updated rows keep their ids, so cached PDF reports would not notice them
+            ReportArtifact.objects.filter(
+                ranch=ranch, from_date__lte=result.last_date, to_date__gte=result.first_date,
+            ).delete()
+            rewind_soil_water(Block.objects.for_ranch(ranch), result.first_date)
+        _finish(ranch, result)
+
+IMPORTERS = {
+    'readings': import_meter_readings,
+    'history': import_irrigation_history,
+}
@@ -0,0 +1,90 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from scheduler.models import Block, IrrigationHistory, Ranch, WaterMeterReading
+from scheduler.reports import _report_rows
+from scheduler.utils import HISTORY_PAGE_SIZE, _history_page_rows, _season_rows, get_metered_usage
+from scheduler.views import RECENT_READINGS
+
+
+class Command(BaseCommand):
+    help = (
+        'Print query plans and latency for the block_history, ranch_report and ranch_allocation_status '
+        'hot queries. Run it against a seeded database to compare index changes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ranch', type=int, help='Ranch id. Defaults to the ranch with the most blocks.')
+        parser.add_argument('--days', type=int, default=30, help='Report range in days (default 30).')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query (default 20).')
+        parser.add_argument('--json', action='store_true', help='Write results as JSON instead of text.')
+
+    def handle(self, *args, **options):
+        if options['ranch']:
+            ranch = Ranch.objects.filter(id=options['ranch']).first()
+        else:
+            ranch = Ranch.objects.annotate(block_count=Count('irrigation_sets__blocks')).order_by('-block_count').first()
+        if ranch is None:
+            raise CommandError('No ranch to benchmark; run seed_farm first.')
+
+        block = (
+            Block.objects.filter(set__ranch=ranch)
+            .annotate(history_count=Count('irrigation_histories'))
+            .order_by('-history_count').first()
+        )
+        latest = IrrigationHistory.objects.filter(block__set__ranch=ranch).order_by('-date').values_list('date', flat=True).first()
+        if block is None or latest is None:
+            raise CommandError(f'Ranch {ranch.id} has no irrigation history to benchmark.')
+        from_date = latest - timedelta(days=options['days'])
+
+        # Built by the same helpers the views use, so the plans follow any change to them
+        report_histories, report_totals = _report_rows(ranch, from_date, latest)
+        queries = {
+            'block_history': _history_page_rows(block, None, HISTORY_PAGE_SIZE),
+            'block_history_seasons': _season_rows(block),
+            'ranch_report': report_histories,
+            'ranch_report_totals': report_totals,
+            'ranch_allocation_status': (
+                WaterMeterReading.objects.for_ranch(ranch).with_relations().order_by('-date')[:RECENT_READINGS]
+            ),
+        }
+
+        results = {}
+        for name, queryset in queries.items():
+            results[name] = {
+                'plan': queryset.explain(),
+                **self.time(lambda: list(queryset.all()), options['repeat']),
+            }
+        results['ranch_allocation_status_totals'] = {
+            'plan': None,
+            **self.time(lambda: get_metered_usage(ranch=ranch), options['repeat']),
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps({'ranch': ranch.id, 'block': block.id, 'queries': results}, indent=2))
+            return
+
+        self.stdout.write(f'Ranch {ranch.id} ({ranch.name}), block {block.id}, report {from_date} to {latest}')
+        for name, result in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{name}'))
+            if result['plan']:
+                self.stdout.write(result['plan'])
+            self.stdout.write(f"rows={result['rows']} median={result['median_ms']:.2f}ms p95={result['p95_ms']:.2f}ms")
+
+    def time(self, run, repeat):
+        timings = []
+        rows = 0
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            result = run()
+            timings.append((time.perf_counter() - start) * 1000)
+            rows = len(result)
+        timings.sort()
+        return {
+            'rows': rows,
+            'median_ms': statistics.median(timings),
+            'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        }
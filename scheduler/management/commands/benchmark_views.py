@@ -0,0 +1,159 @@
+import json
+import logging
+import platform
+import statistics
+import time
+import tracemalloc
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from scheduler import urls as scheduler_urls
+from scheduler.models import Block, IrrigationHistory, Ranch, WaterMeterReading
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Request every view in scheduler/urls.py (plus home) through the test client and record latency '
+        'percentiles, query counts and peak memory. Results are written as JSON so releases can be compared.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per view (default 20).')
+        parser.add_argument('--ranch', type=int, help='Ranch id. Defaults to the ranch with the most blocks.')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+        parser.add_argument('--compare', help='Earlier results file; report views that got slower or run more queries.')
+        parser.add_argument('--threshold', type=float, default=20.0, help='Allowed p95 slowdown in percent (default 20).')
+
+    def handle(self, *args, **options):
+        if options['ranch']:
+            ranch = Ranch.objects.filter(id=options['ranch']).first()
+        else:
+            ranch = Ranch.objects.annotate(block_count=Count('irrigation_sets__blocks')).order_by('-block_count').first()
+        block = Block.objects.filter(set__ranch=ranch).annotate(
+            history_count=Count('irrigation_histories'),
+        ).order_by('-history_count').first() if ranch else None
+        if block is None:
+            raise CommandError('Nothing to benchmark; run seed_farm first.')
+
+        kwargs = {'ranch_id': ranch.id, 'block_id': block.id, 'fmt': 'csv'}
+        urls = {'home': reverse('home')}
+        for pattern in scheduler_urls.urlpatterns:
+            urls[pattern.name] = reverse(pattern.name, kwargs={
+                name: kwargs[name] for name in pattern.pattern.converters
+            })
+
+        # Expected 4xx responses (e.g. GET on POST-only views) would otherwise log on every request
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+
+        user, created = User.objects.get_or_create(username='benchmark')
+        client = Client()
+        client.force_login(user)
+        results = {}
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for name, url in urls.items():
+                    results[name] = self.benchmark(client, url, options['iterations'])
+                    self.stderr.write(
+                        f"{name:32} p50={results[name]['p50_ms']:8.2f}ms p95={results[name]['p95_ms']:8.2f}ms "
+                        f"queries={results[name]['queries']:4} peak={results[name]['peak_memory_kb']:8.1f}KB"
+                    )
+        finally:
+            # Leave no login behind in the database
+            client.logout()
+            if created:
+                user.delete()
+
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'ranch': ranch.id,
+                'block': block.id,
+                'rows': {
+                    'blocks': Block.objects.count(),
+                    'irrigation_histories': IrrigationHistory.objects.count(),
+                    'water_meter_readings': WaterMeterReading.objects.count(),
+                },
+            },
+            'views': results,
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'])
+
+    def request(self, client, url):
+        response = client.get(url)
+        if response.streaming:
+            return response, sum(len(chunk) for chunk in response.streaming_content)
+        return response, len(response.content)
+
+    def benchmark(self, client, url, iterations):
+        self.request(client, url)  # warm up caches and connections
+
+        timings = []
+        query_counts = []
+        for _ in range(max(1, iterations)):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response, size = self.request(client, url)
+                timings.append((time.perf_counter() - start) * 1000)
+            query_counts.append(len(queries))
+
+        # Measure memory separately, tracemalloc slows everything down
+        tracemalloc.start()
+        self.request(client, url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'url': url,
+            'status': response.status_code,
+            'response_bytes': size,
+            'p50_ms': percentile(timings, 0.50),
+            'p90_ms': percentile(timings, 0.90),
+            'p95_ms': percentile(timings, 0.95),
+            'p99_ms': percentile(timings, 0.99),
+            'mean_ms': statistics.fmean(timings),
+            'queries': max(query_counts),
+            'peak_memory_kb': peak / 1024,
+        }
+
+    def compare(self, path, results, threshold):
+        with open(path) as f:
+            baseline = json.load(f)['views']
+
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if result['p95_ms'] > before['p95_ms'] * (1 + threshold / 100):
+                regressions.append(f"{name}: p95 {before['p95_ms']:.2f}ms -> {result['p95_ms']:.2f}ms")
+            if result['queries'] > before['queries']:
+                regressions.append(f"{name}: queries {before['queries']} -> {result['queries']}")
+
+        if regressions:
+            raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+        self.stderr.write(self.style.SUCCESS(f'No regressions against {path}.'))
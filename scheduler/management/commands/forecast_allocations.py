@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from scheduler.forecast import forecast_ranches
+from scheduler.models import Ranch
+
+
+class Command(BaseCommand):
+    help = (
+        'Forecast end-of-season allocation use for every ranch and cache the results. '
+        'Set FORECAST_WORKERS to spread the simulations across processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ranch', type=int, action='append', dest='ranch_ids', help='Limit to a ranch id (repeatable).')
+        parser.add_argument('--trials', type=int, help='Trajectories per ranch. Defaults to FORECAST_TRIALS.')
+
+    def handle(self, *args, **options):
+        ranches = Ranch.objects.order_by('name')
+        if options['ranch_ids']:
+            ranches = ranches.filter(id__in=options['ranch_ids'])
+        ranches = list(ranches)
+
+        forecasts = forecast_ranches(ranches, trials=options['trials'])
+        for ranch in ranches:
+            forecast = forecasts[ranch.id]
+            style = self.style.WARNING if forecast['exceed_probability'] >= 0.5 else self.style.SUCCESS
+            self.stdout.write(style(
+                f"{ranch.name}: {forecast['expected']:.2f} of {forecast['allocation']:.2f} acre-feet expected by "
+                f"{forecast['season_end']}, {forecast['exceed_probability']:.0%} chance of exceeding"
+            ))
@@ -0,0 +1,39 @@
+import calendar
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from scheduler.models import Ranch, ReportArtifact
+from scheduler.reports import request_report
+
+
+class Command(BaseCommand):
+    help = (
+        'Pre-render the PDF report of every ranch for a month so downloads are served from the cache. '
+        'Ranches whose history has not changed since the last run are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Month to render (YYYY-MM). Defaults to the previous month.')
+        parser.add_argument('--ranch', type=int, action='append', dest='ranch_ids', help='Limit to a ranch id (repeatable).')
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                year, month = map(int, options['month'].split('-'))
+                first = date(year, month, 1)
+            except ValueError:
+                raise CommandError(f"Invalid month: {options['month']}")
+        else:
+            today = timezone.localdate()
+            first = date(today.year - 1, 12, 1) if today.month == 1 else date(today.year, today.month - 1, 1)
+        last = first.replace(day=calendar.monthrange(first.year, first.month)[1])
+
+        ranches = Ranch.objects.all()
+        if options['ranch_ids']:
+            ranches = ranches.filter(id__in=options['ranch_ids'])
+
+        # Build inline; the worker pool would not outlive the command
+        for ranch in ranches:
+            artifact = request_report(ranch, first, last, sync=True)
+            style = self.style.SUCCESS if artifact.status == ReportArtifact.READY else self.style.ERROR
+            self.stdout.write(style(f'{ranch.name}: {artifact.status} ({first} to {last})'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from scheduler.importers import CHUNK_SIZE, IMPORTERS
+from scheduler.models import Ranch
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import water meter readings or irrigation history for one ranch from a CSV file. '
+        'Existing readings for the same (well, date) are updated, as are existing history rows with the same '
+        'block, date, well and minutes; other history is added, so re-importing a file does not double it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help='What the file holds.')
+        parser.add_argument('path', help='CSV file with a header row.')
+        parser.add_argument('--ranch', type=int, required=True, help='Ranch id the rows belong to.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help=f'Rows per batch (default {CHUNK_SIZE}).')
+        parser.add_argument('--max-errors', type=int, default=50, help='Row errors to print (default 50).')
+
+    def handle(self, *args, **options):
+        ranch = Ranch.objects.filter(id=options['ranch']).first()
+        if ranch is None:
+            raise CommandError(f"Ranch {options['ranch']} does not exist.")
+
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as f:
+                result = IMPORTERS[options['kind']](ranch, f, options['chunk_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for line, message in result.errors[:options['max_errors']]:
+            self.stderr.write(f'line {line}: {message}')
+        if len(result.errors) > options['max_errors']:
+            self.stderr.write(f"... and {len(result.errors) - options['max_errors']} more")
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result.created}, updated {result.updated}, skipped {len(result.errors)} rows.'
+        ))
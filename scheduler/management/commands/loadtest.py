@@ -0,0 +1,224 @@
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.urls import reverse
+from scheduler.models import Block, Ranch
+from .benchmark_views import percentile
+
+# The read-only pages that have async versions (see scheduler/async_views.py)
+PAGES = ['home', 'ranch_detail', 'block_history', 'ranch_allocation_status', 'well_list', 'ranch_report']
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the read-only pages over HTTP and compare requests per second and tail latency between '
+        'deployments. Either point it at running servers with --target, or pass --workers to start gunicorn '
+        '(WSGI, sync views) and uvicorn (ASGI, async views) with the same number of workers on this database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', default=[], metavar='NAME=URL',
+                            help='A running deployment, e.g. wsgi=http://127.0.0.1:8000 (repeatable).')
+        parser.add_argument('--workers', type=int, help='Start WSGI and ASGI servers with this many worker processes.')
+        parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client connections (default 16).')
+        parser.add_argument('--duration', type=float, default=15.0, help='Seconds of load per deployment (default 15).')
+        parser.add_argument('--ranch', type=int, help='Ranch id. Defaults to the ranch with the most blocks.')
+        parser.add_argument('--output', help='Write the JSON results to this file.')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith(('http://', 'https://')):
+                raise CommandError(f'Expected NAME=URL, got {target!r}')
+            targets.append((name, url.rstrip('/')))
+        if not targets and not options['workers']:
+            raise CommandError('Give at least one --target, or --workers to start the servers.')
+
+        paths = self._paths(options['ranch'])
+        user, created = User.objects.get_or_create(username='loadtest')
+        session = self._session(user)
+        cookies = {settings.SESSION_COOKIE_NAME: session.session_key}
+
+        servers = []
+        try:
+            if options['workers']:
+                for name, command, env in self._server_commands(options['workers']):
+                    url, process = self._start(command, env)
+                    servers.append(process)
+                    targets.append((name, url))
+
+            results = {}
+            for name, url in targets:
+                self.stderr.write(f'Loading {name} ({url}) for {options["duration"]:.0f}s...')
+                results[name] = self._run(url, paths, cookies, options['concurrency'], options['duration'])
+        finally:
+            for process in servers:
+                process.terminate()
+                process.wait(timeout=10)
+            # Leave no login behind in the database
+            session.delete()
+            if created:
+                user.delete()
+
+        report = {
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'workers': options['workers'],
+            'targets': results,
+        }
+        self._print(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _paths(self, ranch_id):
+        if ranch_id:
+            ranch = Ranch.objects.filter(id=ranch_id).first()
+        else:
+            ranch = Ranch.objects.annotate(block_count=Count('irrigation_sets__blocks')).order_by('-block_count').first()
+        block = Block.objects.filter(set__ranch=ranch).order_by('id').first() if ranch else None
+        if block is None:
+            raise CommandError('Nothing to load test; run seed_farm first.')
+        kwargs = {'ranch_detail': [ranch.id], 'block_history': [block.id], 'ranch_allocation_status': [ranch.id],
+                  'well_list': [ranch.id], 'ranch_report': [ranch.id]}
+        return {name: reverse(name, args=kwargs.get(name)) for name in PAGES}
+
+    def _session(self, user):
+        # A logged-in session stored in the shared database, so every server accepts it
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session
+
+    def _server_commands(self, workers):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        commands = []
+        for name, executable, args, async_views in [
+            ('wsgi', 'gunicorn', ['--workers', str(workers), 'irrigation_app.wsgi:application'], '0'),
+            ('asgi', 'uvicorn', ['--workers', str(workers), '--log-level', 'warning', 'irrigation_app.asgi:application'], '1'),
+        ]:
+            if shutil.which(executable) is None:
+                raise CommandError(f'{executable} is not installed; pip install {executable} or use --target.')
+            commands.append((name, [executable] + args, dict(env, DJANGO_ASYNC_VIEWS=async_views)))
+        return commands
+
+    def _start(self, command, env):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        bind = ['--bind', f'127.0.0.1:{port}'] if command[0] == 'gunicorn' else ['--host', '127.0.0.1', '--port', str(port)]
+        process = subprocess.Popen(command + bind, env=env, cwd=settings.BASE_DIR, stdout=sys.stderr)
+        url = f'http://127.0.0.1:{port}'
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'{command[0]} exited with status {process.returncode}')
+            try:
+                requests.get(url + reverse('login'), timeout=1)
+                return url, process
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        process.terminate()
+        raise CommandError(f'{command[0]} did not start within 30 seconds')
+
+    def _run(self, base_url, paths, cookies, concurrency, duration):
+        # Each client cycles through the pages until the time is up
+        latencies = {name: [] for name in paths}
+        errors = {name: 0 for name in paths}
+        lock = threading.Lock()
+
+        def client(offset):
+            session = requests.Session()
+            session.cookies.update(cookies)
+            names = list(paths)
+            i = offset
+            while time.monotonic() < stop:
+                name = names[i % len(names)]
+                i += 1
+                start = time.perf_counter()
+                try:
+                    ok = session.get(base_url + paths[name], allow_redirects=False, timeout=30).status_code == 200
+                except requests.RequestException:
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if ok:
+                        latencies[name].append(elapsed)
+                    else:
+                        errors[name] += 1
+
+        # One untimed pass to fill caches and open connections
+        warm = requests.Session()
+        warm.cookies.update(cookies)
+        for name, path in paths.items():
+            if warm.get(base_url + path, allow_redirects=False, timeout=30).status_code != 200:
+                raise CommandError(f'{base_url + path} did not return 200; is the session valid on that server?')
+
+        stop = time.monotonic() + duration
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(client, range(concurrency)))
+
+        every = [latency for values in latencies.values() for latency in values]
+        return {
+            'requests': len(every),
+            'errors': sum(errors.values()),
+            'rps': round(len(every) / duration, 1),
+            **self._latency(every),
+            'pages': {
+                name: {'requests': len(values), 'errors': errors[name], **self._latency(values)}
+                for name, values in latencies.items()
+            },
+        }
+
+    def _latency(self, values):
+        if not values:
+            return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None}
+        return {
+            'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            'mean_ms': round(statistics.mean(values) * 1000, 2),
+        }
+
+    def _print(self, results):
+        self.stdout.write(f"{'target':<10} {'page':<26} {'req':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, result in results.items():
+            for page, row in result['pages'].items():
+                self.stdout.write(
+                    f"{name:<10} {page:<26} {row['requests']:>7} {row['errors']:>5} "
+                    f"{row['p50_ms'] or 0:>9.2f} {row['p95_ms'] or 0:>9.2f} {row['p99_ms'] or 0:>9.2f}"
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f"{name:<10} {'all':<26} {result['requests']:>7} {result['errors']:>5} "
+                f"{result['p50_ms'] or 0:>9.2f} {result['p95_ms'] or 0:>9.2f} {result['p99_ms'] or 0:>9.2f}  "
+                f"{result['rps']} req/s"
+            ))
+
+        names = list(results)
+        baseline = results[names[0]]
+        for name in names[1:]:
+            result = results[name]
+            if baseline['rps'] and baseline['p99_ms'] and result['p99_ms']:
+                self.stdout.write(
+                    f"{name} vs {names[0]}: {result['rps'] / baseline['rps']:.2f}x requests per second, "
+                    f"p99 {result['p99_ms'] / baseline['p99_ms']:.2f}x"
+                )
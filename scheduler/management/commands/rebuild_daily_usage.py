@@ -0,0 +1,22 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from scheduler.rollups import refresh_daily_usage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the DailyWaterUsage rollup from IrrigationHistory and WaterMeterReading rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_date', help='First day to rebuild (YYYY-MM-DD). Defaults to all history.')
+        parser.add_argument('--to', dest='to_date', help='Last day to rebuild (YYYY-MM-DD). Defaults to all history.')
+        parser.add_argument('--ranch', type=int, action='append', dest='ranch_ids', help='Limit to a ranch id (repeatable).')
+
+    def handle(self, *args, **options):
+        try:
+            from_date = date.fromisoformat(options['from_date']) if options['from_date'] else None
+            to_date = date.fromisoformat(options['to_date']) if options['to_date'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        count = refresh_daily_usage(from_date, to_date, options['ranch_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} daily usage rows.'))
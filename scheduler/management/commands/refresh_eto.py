@@ -0,0 +1,23 @@
+from datetime import date
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from scheduler.weather import arefresh_reference_et
+
+
+class Command(BaseCommand):
+    help = 'Fetch ETo and rainfall for every ranch location concurrently and cache them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to fetch (YYYY-MM-DD). Defaults to today.')
+        parser.add_argument('--concurrency', type=int, help='Maximum fetches in flight. Defaults to the backend pool size.')
+
+    def handle(self, *args, **options):
+        try:
+            day = date.fromisoformat(options['date']) if options['date'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        observations = async_to_sync(arefresh_reference_et)(day, options['concurrency'])
+        for observation in observations:
+            self.stdout.write(f'{observation.location}: ETo {observation.reference_evapotranspiration}')
+        self.stdout.write(self.style.SUCCESS(f'Stored {len(observations)} weather observations.'))
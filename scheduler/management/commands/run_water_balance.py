@@ -0,0 +1,41 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from scheduler.models import Block
+from scheduler.soil import run_water_balance
+
+
+class Command(BaseCommand):
+    help = (
+        'Advance the soil water balance of every block to a day and predict its next irrigation. '
+        'Each block only simulates the days since its last run, or replays from history entered late; '
+        '--from replays every block from a given day.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to advance to (YYYY-MM-DD). Defaults to today.')
+        parser.add_argument('--from', dest='rebuild_from', help='Restart every block from a full root zone on this day (YYYY-MM-DD).')
+        parser.add_argument('--block', type=int, action='append', dest='block_ids', help='Limit to a block id (repeatable).')
+
+    def handle(self, *args, **options):
+        day = self._date(options['date']) or timezone.localdate()
+        rebuild_from = self._date(options['rebuild_from'])
+        if rebuild_from is not None and rebuild_from > day:
+            raise CommandError('--from must not be after --date.')
+
+        blocks = Block.objects.all()
+        if options['block_ids']:
+            blocks = blocks.filter(id__in=options['block_ids'])
+
+        advanced, skipped = run_water_balance(day, blocks, rebuild_from)
+        self.stdout.write(self.style.SUCCESS(f'Advanced {advanced} block(s) to {day}.'))
+        for block in skipped:
+            self.stdout.write(self.style.WARNING(f'Skipped {block.name}: no ETo for {block.set.ranch.location or "its ranch"}.'))
+
+    def _date(self, value):
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'Invalid date: {value}')
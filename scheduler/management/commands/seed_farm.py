@@ -0,0 +1,116 @@
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from scheduler.models import Block, IrrigationHistory, IrrigationSchedule, IrrigationSet, Ranch, WaterMeterReading, Well
+from scheduler.rollups import refresh_daily_usage
+from scheduler.utils import fill_volume
+
+VARIETIES = ['Hass', 'Lamb Hass', 'GEM', 'Reed', 'Navel', 'Valencia', 'Lemon']
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic farm: ranches, sets, wells, blocks, schedules and years of history and meter readings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ranches', type=int, default=5)
+        parser.add_argument('--sets', type=int, default=6, help='Irrigation sets per ranch.')
+        parser.add_argument('--blocks-per-set', type=int, default=8)
+        parser.add_argument('--wells', type=int, default=3, help='Wells per ranch.')
+        parser.add_argument('--years', type=float, default=3, help='Years of history ending today.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable farms.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        end = timezone.localdate()
+        start = end - timedelta(days=int(options['years'] * 365))
+        batch_size = options['batch_size']
+        first_ranch = Ranch.objects.count() + 1
+        totals = {'blocks': 0, 'histories': 0, 'readings': 0}
+
+        for n in range(first_ranch, first_ranch + options['ranches']):
+            with transaction.atomic():
+                ranch = Ranch.objects.create(
+                    name=f'Synthetic Ranch {n}', allocation=Decimal(rng.randint(200, 2000)), location=f'Station {n % 4}',
+                )
+                wells = Well.objects.bulk_create([
+                    Well(name=f'Well {i + 1}', ranch=ranch, gpm=Decimal(rng.randint(600, 1500)))
+                    for i in range(options['wells'])
+                ])
+                sets = IrrigationSet.objects.bulk_create([
+                    IrrigationSet(number=i + 1, ranch=ranch) for i in range(options['sets'])
+                ])
+                blocks = Block.objects.bulk_create([
+                    self.block(rng, irrigation_set, i, wells)
+                    for irrigation_set in sets
+                    for i in range(options['blocks_per_set'])
+                ])
+                schedules = []
+                for block in blocks:
+                    minutes = Decimal(rng.randint(90, 360))
+                    schedules.append(IrrigationSchedule(
+                        block=block, well=block.well, minutes_needed=minutes, hours_needed=minutes / 60,
+                        leaching_factor=Decimal('10.00'), reference_evapotranspiration=Decimal('0.20'),
+                        distribution_uniformity=Decimal('85.00'),
+                    ))
+                IrrigationSchedule.objects.bulk_create(schedules)
+
+                histories, metered = self.history(rng, blocks, start, end)
+                IrrigationHistory.objects.bulk_create(histories, batch_size=batch_size)
+                readings = []
+                for (well_id, day), gallons in metered.items():
+                    # Meters read a little off the applied water; acre-feet follow the reading
+                    gallons, acre_feet = fill_volume(Decimal(str(round(gallons * rng.uniform(0.97, 1.05), 2))), None)
+                    readings.append(WaterMeterReading(ranch=ranch, well_id=well_id, date=day, gallons=gallons, acre_feet=acre_feet))
+                WaterMeterReading.objects.bulk_create(readings, batch_size=batch_size)
+                refresh_daily_usage(start, end, [ranch.id])
+
+            totals['blocks'] += len(blocks)
+            totals['histories'] += len(histories)
+            totals['readings'] += len(readings)
+            self.stdout.write(f'{ranch.name}: {len(blocks)} blocks, {len(histories)} histories, {len(readings)} readings')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {options['ranches']} ranches, {totals['blocks']} blocks, "
+            f"{totals['histories']} histories and {totals['readings']} meter readings."
+        ))
+
+    def block(self, rng, irrigation_set, i, wells):
+        has_crop_x = rng.random() < 0.3
+        return Block(
+            name=f'{irrigation_set.number}-{i + 1}', set=irrigation_set, variety=rng.choice(VARIETIES),
+            acreage=Decimal(rng.randint(20, 400)) / 10, gpm=Decimal(rng.randint(80, 300)),
+            tree_spacing=Decimal(rng.choice([15, 18, 20, 22])), emitter_output=Decimal(rng.choice([1, 2, 4])),
+            has_crop_x=has_crop_x, et_crop_coefficient=Decimal(rng.randint(55, 85)) / 100,
+            days_between_irrigations=None if has_crop_x else rng.randint(3, 7),
+            interval_between_irrigations=rng.randint(3, 7) if has_crop_x else None,
+            well=rng.choice(wells),
+        )
+
+    def history(self, rng, blocks, start, end):
+        # Irrigate each block on its interval, with longer runs in summer
+        histories = []
+        metered = {}
+        for block in blocks:
+            interval = block.interval_between_irrigations or block.days_between_irrigations
+            base_minutes = rng.randint(90, 300)
+            day = start + timedelta(days=rng.randrange(interval))
+            while day <= end:
+                season = 1 + 0.5 * math.sin(2 * math.pi * (day.timetuple().tm_yday - 105) / 365)
+                minutes = round(base_minutes * season * rng.uniform(0.9, 1.1), 2)
+                gallons = round(float(block.gpm) * minutes, 2)
+                gallons_used, acre_feet_used = fill_volume(Decimal(str(gallons)), None)
+                histories.append(IrrigationHistory(
+                    block=block, date=day, minutes_irrigated=Decimal(str(minutes)), gallons_used=gallons_used,
+                    acre_feet_used=acre_feet_used,
+                    days_between_irrigations=block.days_between_irrigations,
+                    interval_between_irrigations=block.interval_between_irrigations,
+                    well=block.well,
+                ))
+                metered[(block.well_id, day)] = metered.get((block.well_id, day), 0) + gallons
+                day += timedelta(days=interval)
+        return histories, metered
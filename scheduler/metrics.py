@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import Counter, defaultdict
+
+# Per-view request metrics, kept in process memory and rendered in the
+# Prometheus text format by the /metrics view. Each worker process keeps its
+# own counters, so scrape every worker (or run one) to get the full picture.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class QueryRecorder:
+    # connection.execute_wrapper hook counting the queries a request runs. The
+    # same SQL run more than once with different parameters is what an N+1
+    # loop looks like, so repeats are counted per statement.
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def most_repeated(self):
+        return self.statements.most_common(1)[0] if self.statements else (None, 0)
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()  # (view, method, status) -> count
+            self.buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+            self.duration = Counter()
+            self.count = Counter()
+            self.queries = Counter()
+            self.query_duration = Counter()
+            self.duplicates = Counter()
+            self.response_bytes = Counter()
+
+    def record(self, view, method, status, duration, recorder, size):
+        with self._lock:
+            self.requests[(view, method, str(status))] += 1
+            buckets = self.buckets[view]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+            self.duration[view] += duration
+            self.count[view] += 1
+            self.queries[view] += recorder.count
+            self.query_duration[view] += recorder.duration
+            self.duplicates[view] += recorder.duplicates
+            self.response_bytes[view] += size
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels)
+                lines.append(f'{name}{{{label_text}}} {value}')
+
+        with self._lock:
+            views = sorted(self.count)
+            metric('scheduler_requests_total', 'counter', 'Requests by view, method and status.', [
+                ((('view', view), ('method', method), ('status', status)), count)
+                for (view, method, status), count in sorted(self.requests.items())
+            ])
+            lines.append('# HELP scheduler_request_duration_seconds Wall time per request.')
+            lines.append('# TYPE scheduler_request_duration_seconds histogram')
+            for view in views:
+                label = _escape(view)
+                for bound, count in zip(DURATION_BUCKETS, self.buckets[view]):
+                    lines.append(f'scheduler_request_duration_seconds_bucket{{view="{label}",le="{bound}"}} {count}')
+                lines.append(f'scheduler_request_duration_seconds_bucket{{view="{label}",le="+Inf"}} {self.count[view]}')
+                lines.append(f'scheduler_request_duration_seconds_sum{{view="{label}"}} {self.duration[view]:.6f}')
+                lines.append(f'scheduler_request_duration_seconds_count{{view="{label}"}} {self.count[view]}')
+            metric('scheduler_db_queries_total', 'counter', 'SQL queries run by requests.', [
+                ((('view', view),), self.queries[view]) for view in views
+            ])
+            metric('scheduler_db_query_duration_seconds_total', 'counter', 'Time spent in SQL queries.', [
+                ((('view', view),), f'{self.query_duration[view]:.6f}') for view in views
+            ])
+            metric('scheduler_db_duplicate_queries_total', 'counter', 'Queries repeating an earlier statement of the same request.', [
+                ((('view', view),), self.duplicates[view]) for view in views
+            ])
+            metric('scheduler_response_size_bytes_total', 'counter', 'Response body bytes sent.', [
+                ((('view', view),), self.response_bytes[view]) for view in views
+            ])
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+registry = Registry()
@@ -0,0 +1,93 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from .metrics import QueryRecorder, registry
+
+logger = logging.getLogger('scheduler.metrics')
+
+def _recording(recorder):
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(recorder))
+    return stack
+
+class MetricsMiddleware:
+    # Records wall time, SQL query count and time, repeated queries and response
+    # size per view (see scheduler.metrics). Streaming responses are measured
+    # until their last chunk is sent, since that is when their queries run.
+    # With METRICS_LOG = True every request is also logged as one JSON line.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with _recording(recorder):
+            response = self.get_response(request)
+        return self._finish(request, response, recorder, start)
+
+    async def __acall__(self, request):
+        # Under ASGI the ORM runs in the request's thread-sensitive worker
+        # thread, whose connections are not the event loop's, so the query
+        # hooks are installed and removed there
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        stack = await sync_to_async(_recording)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self._finish(request, response, recorder, start)
+
+    def _finish(self, request, response, recorder, start):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        if response.streaming and not response.is_async:
+            response.streaming_content = self._measure(response.streaming_content, request, response, view, recorder, start)
+        else:
+            size = 0 if response.streaming else len(response.content)
+            self._record(request, response, view, recorder, start, size)
+        return response
+
+    def _measure(self, content, request, response, view, recorder, start):
+        size = 0
+        try:
+            with _recording(recorder):
+                for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+        finally:
+            self._record(request, response, view, recorder, start, size)
+
+    def _record(self, request, response, view, recorder, start, size):
+        duration = time.perf_counter() - start
+        registry.record(view, request.method, response.status_code, duration, recorder, size)
+
+        threshold = getattr(settings, 'METRICS_REPEATED_QUERY_THRESHOLD', 10)
+        sql, repeats = recorder.most_repeated()
+        if threshold and repeats >= threshold:
+            logger.warning('%s ran the same query %d times: %s', view, repeats, sql)
+        if getattr(settings, 'METRICS_LOG', False):
+            logger.info(json.dumps({
+                'view': view,
+                'path': request.path,
+                'method': request.method,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'queries': recorder.count,
+                'query_ms': round(recorder.duration * 1000, 2),
+                'duplicate_queries': recorder.duplicates,
+                'response_bytes': size,
+            }))
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_daily_usage(apps, schema_editor):
+    DailyWaterUsage = apps.get_model('scheduler', 'DailyWaterUsage')
+    IrrigationHistory = apps.get_model('scheduler', 'IrrigationHistory')
+    WaterMeterReading = apps.get_model('scheduler', 'WaterMeterReading')
+
+    applied = IrrigationHistory.objects.values('date', 'block__set__ranch', 'well', 'block').annotate(
+        total_gallons=Sum('gallons_used'), total_acre_feet=Sum('acre_feet_used'), total_minutes=Sum('minutes_irrigated'),
+    ).order_by()
+    metered = WaterMeterReading.objects.values('date', 'ranch', 'well').annotate(
+        total_gallons=Sum('gallons'), total_acre_feet=Sum('acre_feet'),
+    ).order_by()
+
+    rows = [
+        DailyWaterUsage(
+            date=row['date'], ranch_id=row['block__set__ranch'], well_id=row['well'], block_id=row['block'],
+            gallons=row['total_gallons'] or 0, acre_feet=row['total_acre_feet'] or 0, minutes=row['total_minutes'] or 0,
+        )
+        for row in applied
+    ]
+    rows.extend(
+        DailyWaterUsage(
+            date=row['date'], ranch_id=row['ranch'], well_id=row['well'],
+            gallons=row['total_gallons'] or 0, acre_feet=row['total_acre_feet'] or 0,
+        )
+        for row in metered
+    )
+    DailyWaterUsage.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0017_remove_irrigationschedule_water_quality_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyWaterUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('gallons', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('acre_feet', models.DecimalField(decimal_places=4, default=0, max_digits=10)),
+                ('minutes', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('block', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_water_usage', to='scheduler.block')),
+                ('ranch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_water_usage', to='scheduler.ranch')),
+                ('well', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_water_usage', to='scheduler.well')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ranch', 'date'], name='scheduler_d_ranch_i_2087aa_idx'), models.Index(fields=['block', 'date'], name='scheduler_d_block_i_74935a_idx')],
+            },
+        ),
+        migrations.RunPython(populate_daily_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0018_dailywaterusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ranch',
+            name='location',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.CreateModel(
+            name='WeatherObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('reference_evapotranspiration', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('rainfall', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('location', 'date'), name='unique_weather_location_date')],
+            },
+        ),
+    ]
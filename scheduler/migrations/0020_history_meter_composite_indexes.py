@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0019_weatherobservation_ranch_location'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='irrigationhistory',
+            index=models.Index(fields=['block', 'date'], name='history_block_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='irrigationhistory',
+            index=models.Index(fields=['well', 'date'], name='history_well_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watermeterreading',
+            index=models.Index(fields=['ranch', 'date'], name='meter_ranch_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watermeterreading',
+            index=models.Index(fields=['well', 'date'], name='meter_well_date_idx'),
+        ),
+    ]
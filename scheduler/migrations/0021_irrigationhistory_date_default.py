@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0020_history_meter_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='irrigationhistory',
+            name='date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0022_reportartifact'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeterTelemetry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('points', models.BinaryField(default=bytes)),
+                ('point_count', models.IntegerField(default=0)),
+                ('gallons', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('reading', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='telemetry', to='scheduler.watermeterreading')),
+                ('well', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='telemetry', to='scheduler.well')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('well', 'date'), name='unique_telemetry_well_date')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0023_metertelemetry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='allowable_depletion',
+            field=models.DecimalField(decimal_places=2, default=50.0, max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='available_water_capacity',
+            field=models.DecimalField(decimal_places=2, default=1.5, max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='root_zone_depth',
+            field=models.DecimalField(decimal_places=2, default=2.0, max_digits=5),
+        ),
+        migrations.CreateModel(
+            name='SoilWaterState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('depletion', models.DecimalField(decimal_places=3, max_digits=7)),
+                ('total_available_water', models.DecimalField(decimal_places=3, max_digits=7)),
+                ('crop_et_rate', models.DecimalField(decimal_places=3, max_digits=6)),
+                ('next_irrigation_date', models.DateField(blank=True, null=True)),
+                ('next_irrigation_inches', models.DecimalField(blank=True, decimal_places=3, max_digits=7, null=True)),
+                ('next_irrigation_minutes', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('block', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='soil_water', to='scheduler.block')),
+            ],
+        ),
+    ]
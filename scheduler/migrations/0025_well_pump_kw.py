@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0024_soil_water_balance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='well',
+            name='pump_kw',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0025_well_pump_kw'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportartifact',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0026_reportartifact_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='soilwaterstate',
+            name='replay_from',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
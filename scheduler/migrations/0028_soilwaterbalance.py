@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0027_soilwaterstate_replay_from'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SoilWaterBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('depletion', models.DecimalField(decimal_places=3, max_digits=7)),
+                ('crop_et_rate', models.DecimalField(decimal_places=3, max_digits=6)),
+                ('block', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='soil_water_balances', to='scheduler.block')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('block', 'date'), name='unique_soil_balance_block_date')],
+            },
+        ),
+    ]
@@ -1,9 +1,42 @@
 # scheduler/models.py
 from django.db import models
+from django.utils import timezone
+
+class RanchScopedQuerySet(models.QuerySet):
+    # Base for the querysets below. `ranch_path` is the lookup from the model to
+    # its ranch and `relations` what its pages and __str__ follow, so listing
+    # rows with with_relations() costs one query however many there are.
+    ranch_path = 'ranch'
+    relations = ()
+
+    def for_ranch(self, ranch):
+        return self.filter(**{self.ranch_path: ranch})
+
+    def with_relations(self):
+        return self.select_related(*self.relations)
+
+class IrrigationSetQuerySet(RanchScopedQuerySet):
+    relations = ('ranch',)
+
+class WellQuerySet(RanchScopedQuerySet):
+    relations = ('ranch',)
+
+class BlockQuerySet(RanchScopedQuerySet):
+    ranch_path = 'set__ranch'
+    relations = ('set__ranch', 'well')
+
+class BlockRecordQuerySet(RanchScopedQuerySet):
+    # IrrigationSchedule and IrrigationHistory rows belong to a block
+    ranch_path = 'block__set__ranch'
+    relations = ('block__set__ranch', 'well')
+
+class WaterMeterReadingQuerySet(RanchScopedQuerySet):
+    relations = ('ranch', 'well')
 
 class Ranch(models.Model):
     name = models.CharField(max_length=100)
     allocation = models.DecimalField(max_digits=10, decimal_places=2)
+    location = models.CharField(max_length=100, blank=True, default='')
 
     def __str__(self):
         return self.name
@@ -12,6 +45,8 @@ class IrrigationSet(models.Model):
     number = models.PositiveIntegerField()
     ranch = models.ForeignKey(Ranch, on_delete=models.CASCADE, related_name='irrigation_sets')
 
+    objects = IrrigationSetQuerySet.as_manager()
+
     def __str__(self):
         return f"Set {self.number} - {self.ranch.name}"
 
@@ -19,6 +54,9 @@ class Well(models.Model):
     name = models.CharField(max_length=100)
     ranch = models.ForeignKey(Ranch, on_delete=models.CASCADE, related_name='wells')
     gpm = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
+    pump_kw = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)  # electrical load at full flow
+
+    objects = WellQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.name} - {self.ranch.name}"
@@ -37,6 +75,12 @@ class Block(models.Model):
     interval_between_irrigations = models.IntegerField(null=True, blank=True)
     water_quality = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     well = models.ForeignKey(Well, on_delete=models.CASCADE, related_name='blocks', null=True, blank=True)
+    # Soil water balance inputs (see scheduler/soil.py)
+    root_zone_depth = models.DecimalField(max_digits=5, decimal_places=2, default=2.0)  # feet
+    available_water_capacity = models.DecimalField(max_digits=5, decimal_places=2, default=1.5)  # inches per foot
+    allowable_depletion = models.DecimalField(max_digits=5, decimal_places=2, default=50.0)  # percent
+
+    objects = BlockQuerySet.as_manager()
 
     def __str__(self):
         return f"Block {self.name} - {self.variety} - Set {self.set.number}"
@@ -53,6 +97,8 @@ class IrrigationSchedule(models.Model):
     reference_evapotranspiration = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     distribution_uniformity = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
 
+    objects = BlockRecordQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if self.minutes_needed is None:
             self.minutes_needed = self.calculate_irrigation_time()
@@ -93,7 +139,7 @@ class IrrigationSchedule(models.Model):
 
 class IrrigationHistory(models.Model):
     block = models.ForeignKey(Block, on_delete=models.CASCADE, related_name='irrigation_histories')
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(default=timezone.localdate)
     minutes_irrigated = models.DecimalField(max_digits=10, decimal_places=2)
     gallons_used = models.DecimalField(max_digits=15, decimal_places=2)
     acre_feet_used = models.DecimalField(max_digits=10, decimal_places=4)
@@ -101,6 +147,14 @@ class IrrigationHistory(models.Model):
     interval_between_irrigations = models.IntegerField(null=True, blank=True)
     well = models.ForeignKey(Well, on_delete=models.CASCADE, related_name='irrigation_histories', null=True, blank=True)
 
+    objects = BlockRecordQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['block', 'date'], name='history_block_date_idx'),
+            models.Index(fields=['well', 'date'], name='history_well_date_idx'),
+        ]
+
     def __str__(self):
         return f"Irrigation History for {self.block.name} on {self.date}"
 
@@ -111,5 +165,125 @@ class WaterMeterReading(models.Model):
     gallons = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
     acre_feet = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True)
 
+    objects = WaterMeterReadingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ranch', 'date'], name='meter_ranch_date_idx'),
+            models.Index(fields=['well', 'date'], name='meter_well_date_idx'),
+        ]
+
     def __str__(self):
         return f"Water Meter Reading for {self.ranch.name} on {self.date}"
+
+class DailyWaterUsage(models.Model):
+    # Daily rollup of IrrigationHistory (block set) and WaterMeterReading (block empty) rows.
+    date = models.DateField()
+    ranch = models.ForeignKey(Ranch, on_delete=models.CASCADE, related_name='daily_water_usage')
+    well = models.ForeignKey(Well, on_delete=models.CASCADE, related_name='daily_water_usage', null=True, blank=True)
+    block = models.ForeignKey(Block, on_delete=models.CASCADE, related_name='daily_water_usage', null=True, blank=True)
+    gallons = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    acre_feet = models.DecimalField(max_digits=10, decimal_places=4, default=0)
+    minutes = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ranch', 'date']),
+            models.Index(fields=['block', 'date']),
+        ]
+
+    def __str__(self):
+        return f"Water Usage for {self.ranch.name} on {self.date}"
+
+class WeatherObservation(models.Model):
+    # Cached daily weather for a station/location, filled by scheduler.weather
+    location = models.CharField(max_length=100)
+    date = models.DateField()
+    reference_evapotranspiration = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    rainfall = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['location', 'date'], name='unique_weather_location_date'),
+        ]
+
+    def __str__(self):
+        return f"Weather for {self.location} on {self.date}"
+
+class ReportArtifact(models.Model):
+    # Rendered PDF ranch report, cached until new history arrives for its range
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (READY, 'Ready'), (FAILED, 'Failed')]
+
+    ranch = models.ForeignKey(Ranch, on_delete=models.CASCADE, related_name='report_artifacts')
+    from_date = models.DateField()
+    to_date = models.DateField()
+    latest_history_id = models.BigIntegerField(null=True, blank=True)
+    cache_key = models.CharField(max_length=64, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    content = models.BinaryField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now)  # last status change; a stuck build is retried from it
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Report for {self.ranch.name} {self.from_date} to {self.to_date} ({self.status})"
+
+class MeterTelemetry(models.Model):
+    # One row per well and day of high-frequency flow meter samples, packed by
+    # scheduler.telemetry as little-endian (seconds since midnight, gallons) pairs.
+    # The day's total is kept in step and fed into `reading`.
+    well = models.ForeignKey(Well, on_delete=models.CASCADE, related_name='telemetry')
+    date = models.DateField()
+    points = models.BinaryField(default=bytes)
+    point_count = models.IntegerField(default=0)
+    gallons = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    reading = models.OneToOneField(WaterMeterReading, on_delete=models.SET_NULL, related_name='telemetry', null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['well', 'date'], name='unique_telemetry_well_date'),
+        ]
+
+    def __str__(self):
+        return f"Telemetry for {self.well.name} on {self.date}"
+
+class SoilWaterState(models.Model):
+    # Latest root-zone water balance of a block, advanced one day at a time by
+    # scheduler.soil, with the irrigation it predicts next. Depths are in inches.
+    block = models.OneToOneField(Block, on_delete=models.CASCADE, related_name='soil_water')
+    date = models.DateField()
+    depletion = models.DecimalField(max_digits=7, decimal_places=3)
+    total_available_water = models.DecimalField(max_digits=7, decimal_places=3)
+    crop_et_rate = models.DecimalField(max_digits=6, decimal_places=3)  # smoothed inches per day
+    next_irrigation_date = models.DateField(null=True, blank=True)
+    next_irrigation_inches = models.DecimalField(max_digits=7, decimal_places=3, null=True, blank=True)
+    next_irrigation_minutes = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    replay_from = models.DateField(null=True, blank=True)  # earliest simulated day whose history changed since
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Soil water for {self.block.name} on {self.date}"
+
+class SoilWaterBalance(models.Model):
+    # End-of-day depletion of every simulated day, so a replay after late history
+    # can restart from the day before the change (see scheduler.soil)
+    block = models.ForeignKey(Block, on_delete=models.CASCADE, related_name='soil_water_balances')
+    date = models.DateField()
+    depletion = models.DecimalField(max_digits=7, decimal_places=3)
+    crop_et_rate = models.DecimalField(max_digits=6, decimal_places=3)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['block', 'date'], name='unique_soil_balance_block_date'),
+        ]
+
+    def __str__(self):
+        return f"Soil water balance for {self.block.name} on {self.date}"
@@ -0,0 +1,135 @@
+from collections import defaultdict
+from .scheduler import calculate_irrigation_time, latest_schedules
+from .topology import get_topology
+
+# A job is one block's irrigation run: (block, minutes, gpm). Blocks in the same
+# slot on a well run at the same time, so a slot's combined gpm must stay within
+# the well's gpm and the slot lasts as long as its longest run.
+
+def _duration(slot):
+    return max((job[1] for job in slot), default=0)
+
+def _gpm(slot):
+    return sum(job[2] for job in slot)
+
+def _duration_without(slot, job):
+    return max((other[1] for other in slot if other is not job), default=0)
+
+def _longest(slot):
+    return max(slot, key=lambda job: job[1])
+
+def pack_well(jobs, capacity, max_passes=25):
+    # First-fit decreasing by run time, then a local search that relocates or
+    # swaps each slot's longest run while that shortens the well's pumping window.
+    slots = []
+    for job in sorted(jobs, key=lambda job: (-job[1], -job[2])):
+        for slot in slots:
+            if _gpm(slot) + job[2] <= capacity:
+                slot.append(job)
+                break
+        else:
+            slots.append([job])
+
+    for _ in range(max_passes):
+        if not _improve(slots, capacity):
+            break
+        slots[:] = [slot for slot in slots if slot]
+    slots.sort(key=_duration, reverse=True)
+    return slots
+
+def _improve(slots, capacity):
+    improved = False
+    for a in slots:
+        if not a:
+            continue
+        job = _longest(a)
+        saved = _duration(a) - _duration_without(a, job)
+        if saved <= 0:
+            continue
+        for b in slots:
+            if b is a or not b:
+                continue
+            # Move the longest run of slot a into slot b
+            if _gpm(b) + job[2] <= capacity and max(0, job[1] - _duration(b)) < saved:
+                a.remove(job)
+                b.append(job)
+                improved = True
+                break
+            # Swap it for a shorter run in slot b
+            swapped = _best_swap(a, b, job, capacity)
+            if swapped is not None:
+                a.remove(job)
+                b.remove(swapped)
+                a.append(swapped)
+                b.append(job)
+                improved = True
+                break
+    return improved
+
+def _best_swap(a, b, job, capacity):
+    before = _duration(a) + _duration(b)
+    rest_a = _duration_without(a, job)
+    best, best_total = None, before
+    for other in b:
+        if other[1] >= job[1]:
+            continue
+        if _gpm(a) - job[2] + other[2] > capacity or _gpm(b) - other[2] + job[2] > capacity:
+            continue
+        total = max(rest_a, other[1]) + max(_duration_without(b, other), job[1])
+        if total < best_total:
+            best, best_total = other, total
+    return best
+
+def ranch_jobs(ranch):
+    # Jobs of every scheduled block on the ranch grouped by well id, the wells,
+    # and the blocks that have no schedule or no well. Blocks come from the
+    # topology index, so this is the schedule query alone once it is built.
+    schedules = latest_schedules(ranch)
+    blocks = get_topology(ranch.id).blocks.values()
+
+    jobs_by_well = defaultdict(list)
+    wells = {}
+    unassigned = []
+    for block in blocks:
+        schedule = schedules.get(block.id)
+        if schedule is not None:
+            schedule.block = block
+        well = (schedule.well if schedule is not None and schedule.well_id else None) or block.well
+        minutes = calculate_irrigation_time(schedule)
+        if well is None or minutes is None:
+            unassigned.append(block)
+            continue
+        wells[well.id] = well
+        jobs_by_well[well.id].append((block, float(minutes), float(block.gpm)))
+    return jobs_by_well, wells, unassigned
+
+def optimize_ranch_sets(ranch):
+    # Pack every scheduled block of the ranch into time slots per well and return
+    # the timetable. Wells pump in parallel, so the ranch window is the longest well window.
+    jobs_by_well, wells, unassigned = ranch_jobs(ranch)
+
+    timetable = []
+    for well_id, jobs in jobs_by_well.items():
+        well = wells[well_id]
+        capacity = float(well.gpm)
+        start = 0.0
+        slots = []
+        for number, slot in enumerate(pack_well(jobs, capacity), start=1):
+            duration = _duration(slot)
+            slots.append({
+                'number': number,
+                'start': start,
+                'end': start + duration,
+                'gpm': _gpm(slot),
+                'over_capacity': _gpm(slot) > capacity,
+                'blocks': [{'block': job[0], 'minutes': job[1], 'gpm': job[2]} for job in slot],
+            })
+            start += duration
+        timetable.append({'well': well, 'slots': slots, 'window': start})
+
+    timetable.sort(key=lambda entry: entry['well'].name)
+    return {
+        'wells': timetable,
+        'window': max((entry['window'] for entry in timetable), default=0),
+        'unassigned': unassigned,
+    }
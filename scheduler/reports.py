@@ -1,19 +1,158 @@
-# from io import BytesIO
-# from django.http import HttpResponse
-# from reportlab.lib.pagesizes import letter
-# from reportlab.pdfgen import canvas
-
-# def generate_report(ranch):
-#     buffer = BytesIO()
-#     p = canvas.Canvas(buffer, pagesize=letter)
-#     p.drawString(100, 750, f"Irrigation Schedule for Ranch: {ranch.name}")
-#     # Add more details to the PDF
-#     p.showPage()
-#     p.save()
-#     buffer.seek(0)
-#     return buffer
-
-# def download_report(request, ranch_id):
-#     ranch = Ranch.objects.get(id=ranch_id)
-#     buffer = generate_report(ranch)
-#     return HttpResponse(buffer, as_attachment=True, content_type='application/pdf')
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from itertools import groupby
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from .exports import ranch_report_rows, write_pdf
+from .models import DailyWaterUsage, IrrigationHistory, ReportArtifact
+
+logger = logging.getLogger(__name__)
+
+def _report_rows(ranch, from_date, to_date):
+    # One joined query for the whole range, bucketed by day in Python, plus one
+    # query for the daily totals, so the query count does not grow with the range.
+    histories = (
+        IrrigationHistory.objects
+        .for_ranch(ranch)
+        .filter(date__range=[from_date, to_date])
+        .with_relations()
+        .order_by('date', 'block__set', 'block')
+    )
+    totals = (
+        DailyWaterUsage.objects
+        .filter(ranch=ranch, block__isnull=False, date__range=[from_date, to_date])
+        .values('date')
+        .annotate(gallons=Sum('gallons'), acre_feet=Sum('acre_feet'), minutes=Sum('minutes'))
+        .order_by()
+    )
+    return histories, totals
+
+def build_ranch_report(ranch, from_date, to_date):
+    histories, totals = _report_rows(ranch, from_date, to_date)
+    return _group_report(histories, {row['date']: row for row in totals})
+
+async def abuild_ranch_report(ranch, from_date, to_date):
+    histories, totals = _report_rows(ranch, from_date, to_date)
+    histories = [history async for history in histories]
+    return _group_report(histories, {row['date']: row async for row in totals})
+
+def _group_report(histories, totals):
+    report_data = []
+    for date, day_histories in groupby(histories, key=lambda h: h.date):
+        day_totals = totals.get(date, {})
+        report_data.append({
+            'date': date,
+            'day': date.strftime('%A'),
+            'histories': list(day_histories),
+            'minutes': day_totals.get('minutes'),
+            'gallons': day_totals.get('gallons'),
+            'acre_feet': day_totals.get('acre_feet'),
+        })
+    return report_data
+
+def report_cache_key(ranch, from_date, to_date):
+    # New history in the range changes the newest id and deleted history the
+    # count; edits are caught by invalidate_reports from the history signals.
+    history = IrrigationHistory.objects.filter(
+        block__set__ranch=ranch, date__range=[from_date, to_date],
+    ).aggregate(latest=Max('id'), count=Count('id'))
+    key = f"{ranch.id}:{from_date.isoformat()}:{to_date.isoformat()}:{history['latest']}:{history['count']}"
+    return hashlib.sha256(key.encode()).hexdigest(), history['latest']
+
+def invalidate_reports(ranch_id, date):
+    # Rendered reports whose range covers a day with changed history are stale
+    return ReportArtifact.objects.filter(ranch_id=ranch_id, from_date__lte=date, to_date__gte=date).delete()[0]
+
+def generate_report(ranch, from_date, to_date):
+    buffer = BytesIO()
+    write_pdf(ranch_report_rows(ranch, from_date, to_date), buffer,
+              f"Irrigation Report for Ranch: {ranch.name} ({from_date} to {to_date})")
+    return buffer.getvalue()
+
+def build_artifact(artifact_id):
+    # Render the PDF and store it on the artifact
+    try:
+        artifact = ReportArtifact.objects.select_related('ranch').get(id=artifact_id)
+    except ReportArtifact.DoesNotExist:
+        # Invalidated before its build started; the next request queues a new one
+        logger.info('Report %s was deleted before it was built', artifact_id)
+        return
+    try:
+        content = generate_report(artifact.ranch, artifact.from_date, artifact.to_date)
+    except Exception as e:
+        logger.exception('Report %s failed', artifact_id)
+        ReportArtifact.objects.filter(id=artifact_id).update(
+            status=ReportArtifact.FAILED, error=str(e), updated_at=timezone.now(),
+        )
+        return
+    now = timezone.now()
+    ReportArtifact.objects.filter(id=artifact_id).update(
+        status=ReportArtifact.READY, content=content, content_hash=hashlib.sha256(content).hexdigest(),
+        error='', completed_at=now, updated_at=now,
+    )
+
+def _build_in_worker(artifact_id):
+    # Worker threads have their own database connection to look after
+    close_old_connections()
+    try:
+        build_artifact(artifact_id)
+    finally:
+        close_old_connections()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'REPORT_WORKERS', 2), thread_name_prefix='reports')
+        return _executor
+
+def submit(artifact_id, sync=False):
+    # Build inline with sync=True or when REPORT_WORKER is 'sync' (tests);
+    # otherwise on the worker pool once the artifact row is committed
+    if sync or getattr(settings, 'REPORT_WORKER', 'thread') == 'sync':
+        build_artifact(artifact_id)
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_build_in_worker, artifact_id))
+
+def _build_timeout():
+    return timedelta(seconds=getattr(settings, 'REPORT_BUILD_TIMEOUT', 10 * 60))
+
+def request_report(ranch, from_date, to_date, sync=False):
+    # Return the cached artifact for this ranch and range, queueing a build if
+    # there is none yet, the last one failed, or it has been pending longer
+    # than REPORT_BUILD_TIMEOUT (its worker died or the process restarted).
+    cache_key, latest_history_id = report_cache_key(ranch, from_date, to_date)
+    artifact = ReportArtifact.objects.filter(cache_key=cache_key).first()
+    if artifact is None:
+        try:
+            with transaction.atomic():
+                artifact = ReportArtifact.objects.create(
+                    ranch=ranch, from_date=from_date, to_date=to_date,
+                    latest_history_id=latest_history_id, cache_key=cache_key,
+                )
+        except IntegrityError:
+            # Another request queued the same report first
+            return ReportArtifact.objects.get(cache_key=cache_key)
+        # Older renders of the same range are stale now
+        ReportArtifact.objects.filter(ranch=ranch, from_date=from_date, to_date=to_date).exclude(id=artifact.id).delete()
+        submit(artifact.id, sync)
+    elif artifact.status == ReportArtifact.FAILED or (
+        artifact.status == ReportArtifact.PENDING and artifact.updated_at < timezone.now() - _build_timeout()
+    ):
+        # Only the request that flips the row resubmits it
+        claimed = ReportArtifact.objects.filter(
+            id=artifact.id, status=artifact.status, updated_at=artifact.updated_at,
+        ).update(status=ReportArtifact.PENDING, error='', updated_at=timezone.now())
+        if claimed:
+            submit(artifact.id, sync)
+    artifact.refresh_from_db()
+    return artifact
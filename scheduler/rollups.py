@@ -0,0 +1,55 @@
+from django.db import transaction
+from django.db.models import Sum
+from .dashboard import invalidate_dashboards
+from .models import DailyWaterUsage, IrrigationHistory, WaterMeterReading
+
+def refresh_daily_usage(from_date=None, to_date=None, ranch_ids=None):
+    # Recompute DailyWaterUsage for a date range (and optionally some ranches)
+    # from the raw history and meter rows. Runs a fixed number of queries.
+    usage = DailyWaterUsage.objects.all()
+    histories = IrrigationHistory.objects.all()
+    readings = WaterMeterReading.objects.all()
+    if from_date is not None:
+        usage = usage.filter(date__gte=from_date)
+        histories = histories.filter(date__gte=from_date)
+        readings = readings.filter(date__gte=from_date)
+    if to_date is not None:
+        usage = usage.filter(date__lte=to_date)
+        histories = histories.filter(date__lte=to_date)
+        readings = readings.filter(date__lte=to_date)
+    if ranch_ids is not None:
+        usage = usage.filter(ranch_id__in=ranch_ids)
+        histories = histories.filter(block__set__ranch_id__in=ranch_ids)
+        readings = readings.filter(ranch_id__in=ranch_ids)
+
+    applied = histories.values('date', 'block__set__ranch', 'well', 'block').annotate(
+        total_gallons=Sum('gallons_used'),
+        total_acre_feet=Sum('acre_feet_used'),
+        total_minutes=Sum('minutes_irrigated'),
+    ).order_by()
+    metered = readings.values('date', 'ranch', 'well').annotate(
+        total_gallons=Sum('gallons'),
+        total_acre_feet=Sum('acre_feet'),
+    ).order_by()
+
+    rows = [
+        DailyWaterUsage(
+            date=row['date'], ranch_id=row['block__set__ranch'], well_id=row['well'], block_id=row['block'],
+            gallons=row['total_gallons'] or 0, acre_feet=row['total_acre_feet'] or 0,
+            minutes=row['total_minutes'] or 0,
+        )
+        for row in applied.iterator()
+    ]
+    rows.extend(
+        DailyWaterUsage(
+            date=row['date'], ranch_id=row['ranch'], well_id=row['well'],
+            gallons=row['total_gallons'] or 0, acre_feet=row['total_acre_feet'] or 0,
+        )
+        for row in metered.iterator()
+    )
+
+    with transaction.atomic():
+        usage.delete()
+        DailyWaterUsage.objects.bulk_create(rows, batch_size=1000)
+    invalidate_dashboards(ranch_ids)
+    return len(rows)
@@ -1,39 +1,130 @@
-from .models import Block
+import math
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Max
+from .models import Block, IrrigationHistory, IrrigationSchedule
+from .rollups import refresh_daily_usage
+from .soil import rewind_soil_water
+from .utils import GALLONS_PER_ACRE_FOOT
+from .weather import get_reference_et
 
-def generate_irrigation_schedule(ranch):
-    blocks = Block.objects.filter(set__ranch=ranch).order_by('set__number')
-    schedule = []
+def create_irrigation_schedules(blocks, template):
+    # Schedule every selected block from one unsaved IrrigationSchedule holding the
+    # shared form values. Everything is computed up front and written with
+    # bulk_create, so the number of queries does not depend on the number of blocks.
+    shared_fields = [
+        field.name for field in IrrigationSchedule._meta.concrete_fields
+        if not field.primary_key and field.name != 'block'
+    ]
+    blocks = list(blocks.select_related('set__ranch', 'soil_water'))
+    reference_et = {}
+    if template.reference_evapotranspiration is None and not template.minutes_needed:
+        # Fill in today's ETo for each ranch from the weather client
+        reference_et = get_reference_et({block.set.ranch for block in blocks})
+
+    schedules = []
+    histories = []
     for block in blocks:
-        schedule.append({
+        schedule = IrrigationSchedule(block=block, **{name: getattr(template, name) for name in shared_fields})
+        if schedule.reference_evapotranspiration is None:
+            schedule.reference_evapotranspiration = reference_et.get(block.set.ranch_id)
+        state = getattr(block, 'soil_water', None)
+        if not schedule.minutes_needed and not schedule.inches_needed and state and state.next_irrigation_minutes:
+            # Nothing entered: refill the root zone as predicted by the water balance
+            schedule.minutes_needed = state.next_irrigation_minutes
+            schedule.inches_needed = state.next_irrigation_inches
+        if not schedule.minutes_needed:
+            schedule.minutes_needed = schedule.calculate_irrigation_time()
+        schedule.hours_needed = schedule.minutes_needed / 60
+        schedules.append(schedule)
+
+        # Calculate gallons and acre-feet used
+        gallons_used = float(block.gpm) * float(schedule.minutes_needed)
+        acre_feet_used = gallons_used / GALLONS_PER_ACRE_FOOT
+
+        histories.append(IrrigationHistory(
+            block=block,
+            minutes_irrigated=schedule.minutes_needed,
+            gallons_used=gallons_used,
+            acre_feet_used=acre_feet_used,
+            days_between_irrigations=block.days_between_irrigations if not block.has_crop_x else None,
+            interval_between_irrigations=block.interval_between_irrigations if block.has_crop_x else None,
+            well=schedule.well
+        ))
+
+    with transaction.atomic():
+        IrrigationSchedule.objects.bulk_create(schedules)
+        IrrigationHistory.objects.bulk_create(histories)
+        # bulk_create skips the model signals, so refresh the rollup and mark the
+        # soil states already simulated through that day for a replay in one pass
+        dates = {history.date for history in histories}
+        ranch_ids = {schedule.block.set.ranch_id for schedule in schedules}
+        if dates:
+            refresh_daily_usage(min(dates), max(dates), ranch_ids)
+            rewind_soil_water([block.id for block in blocks], min(dates))
+    return schedules
+
+def latest_schedules(ranch):
+    # Most recent IrrigationSchedule per block on the ranch, keyed by block id (one query).
+    latest_ids = (
+        IrrigationSchedule.objects.for_ranch(ranch)
+        .values('block').annotate(latest_id=Max('id')).values_list('latest_id', flat=True)
+    )
+    schedules = IrrigationSchedule.objects.filter(id__in=latest_ids).select_related('well')
+    return {schedule.block_id: schedule for schedule in schedules}
+
+def generate_irrigation_schedule(ranch):
+    # Weekly irrigation plan for a ranch, one row per block, yielded lazily in
+    # set order. Runs two queries regardless of the number of blocks.
+    schedules = latest_schedules(ranch)
+    blocks = (
+        Block.objects.for_ranch(ranch)
+        .with_relations()
+        .select_related('soil_water')
+        .order_by('set__number', 'name', 'id')
+    )
+    for block in blocks.iterator(chunk_size=500):
+        schedule = schedules.get(block.id)
+        if schedule is not None:
+            schedule.block = block
+        minutes = calculate_irrigation_time(schedule)
+        irrigations = irrigations_per_week(block)
+        gallons = float(block.gpm) * float(minutes) if minutes is not None else None
+        yield {
             'block': block,
-            'irrigation_time': calculate_irrigation_time(block),
-            'fertilization': get_fertilization_info(block),
-        })
-    return schedule
-
-def calculate_irrigation_time(block):
-    # Assume 1 inch of water per acre requires 27,154 gallons of water
-    gallons_per_inch_per_acre = 27154
-    
-    if block.has_crop_x:
-        # Calculate total gallons needed for the block
-        total_gallons_needed = block.acreage * gallons_per_inch_per_acre * block.inches_needed
-    else:
-        # Use ET crop coefficient if crop X is not present
-        et_coefficient = block.et_crop_coefficient or 1.0
-        total_gallons_needed = block.acreage * gallons_per_inch_per_acre * et_coefficient
+            'set_number': block.set.number,
+            'well': (schedule.well if schedule is not None and schedule.well_id else None) or block.well,
+            'schedule': schedule,
+            'irrigation_time': minutes,
+            'hours': float(minutes) / 60 if minutes is not None else None,
+            'gallons': gallons,
+            'irrigations_per_week': irrigations,
+            'weekly_gallons': gallons * irrigations if gallons is not None else None,
+            'fertilization': get_fertilization_info(schedule),
+            'next_irrigation': getattr(block, 'soil_water', None),
+        }
 
-    # Calculate irrigation time in minutes
-    irrigation_time = total_gallons_needed / block.gpm
+def calculate_irrigation_time(schedule):
+    # Minutes per irrigation from the block's latest schedule
+    if schedule is None:
+        return None
+    if schedule.minutes_needed is not None:
+        return schedule.minutes_needed
+    return schedule.calculate_irrigation_time()
 
-    return irrigation_time
+def irrigations_per_week(block):
+    # Crop X blocks are watered on an interval, everything else on days between irrigations
+    days = block.interval_between_irrigations if block.has_crop_x else block.days_between_irrigations
+    if not days or days <= 0:
+        return 1
+    return math.ceil(7 / days)
 
-def get_fertilization_info(block):
+def get_fertilization_info(schedule):
     # Check if the block needs fertilization this week
-    if block.fertilized:
+    if schedule is not None and schedule.fertilized:
         return {
             'fertilized': True,
-            'details': block.fertilization_details
+            'details': schedule.fertilization_details
         }
     else:
         return {
@@ -0,0 +1,129 @@
+from django.db.models import Max, Min, Model
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .dashboard import invalidate_dashboards
+from .models import Block, IrrigationHistory, IrrigationSet, Ranch, WaterMeterReading, Well
+from .reports import invalidate_reports
+from .rollups import refresh_daily_usage
+from .soil import rewind_soil_water
+from .topology import invalidate_topology
+
+def _history_key(history):
+    ranch_id = Block.objects.filter(id=history.block_id).values_list('set__ranch', flat=True).first()
+    return history.date, ranch_id
+
+def _reading_key(reading):
+    return reading.date, reading.ranch_id
+
+def _cascaded(sender, origin):
+    # Deleting a ranch, block or well cascades to its rollup rows as well.
+    return isinstance(origin, Model) and not isinstance(origin, sender)
+
+def _refresh(*keys):
+    for date, ranch_id in set(keys):
+        if date is not None and ranch_id is not None:
+            refresh_daily_usage(date, date, [ranch_id])
+
+@receiver(pre_save, sender=IrrigationHistory)
+@receiver(pre_save, sender=WaterMeterReading)
+def remember_usage_key(sender, instance, **kwargs):
+    # An edit may move a row to another day or ranch, so the old bucket needs a refresh too.
+    instance._usage_key_before = None
+    instance._soil_key_before = None
+    if instance.pk:
+        previous = sender.objects.filter(pk=instance.pk).first()
+        if previous is not None:
+            instance._usage_key_before = _history_key(previous) if sender is IrrigationHistory else _reading_key(previous)
+            if sender is IrrigationHistory:
+                instance._soil_key_before = (previous.block_id, previous.date)
+
+def _rewind(*keys):
+    # Soil water balances already simulated past a changed day replay from it
+    for block_id, date in set(keys):
+        if block_id is not None and date is not None:
+            rewind_soil_water([block_id], date)
+
+def _invalidate_reports(*keys):
+    # Rendered PDF reports over a changed day are rebuilt on the next request
+    for date, ranch_id in set(keys):
+        if date is not None and ranch_id is not None:
+            invalidate_reports(ranch_id, date)
+
+@receiver(post_save, sender=IrrigationHistory)
+def refresh_history_usage(sender, instance, **kwargs):
+    keys = [_history_key(instance), *filter(None, [getattr(instance, '_usage_key_before', None)])]
+    _refresh(*keys)
+    _invalidate_reports(*keys)
+    _rewind((instance.block_id, instance.date), *filter(None, [getattr(instance, '_soil_key_before', None)]))
+
+@receiver(post_save, sender=WaterMeterReading)
+def refresh_reading_usage(sender, instance, **kwargs):
+    _refresh(_reading_key(instance), *filter(None, [getattr(instance, '_usage_key_before', None)]))
+
+@receiver(post_delete, sender=IrrigationHistory)
+def refresh_deleted_history_usage(sender, instance, origin=None, **kwargs):
+    if not _cascaded(sender, origin):
+        key = _history_key(instance)
+        _refresh(key)
+        _invalidate_reports(key)
+        _rewind((instance.block_id, instance.date))
+
+@receiver(post_delete, sender=WaterMeterReading)
+def refresh_deleted_reading_usage(sender, instance, origin=None, **kwargs):
+    if not _cascaded(sender, origin):
+        _refresh(_reading_key(instance))
+
+# Dashboard summaries and the topology index. History and meter readings are
+# covered by the rollup refresh above; these models change the ranch layout.
+
+def _dashboard_ranch(sender, instance):
+    if sender is Block:
+        return IrrigationSet.objects.filter(id=instance.set_id).values_list('ranch', flat=True).first()
+    return instance.ranch_id
+
+@receiver(pre_save, sender=Block)
+@receiver(pre_save, sender=IrrigationSet)
+@receiver(pre_save, sender=Well)
+def remember_dashboard_ranch(sender, instance, **kwargs):
+    # A block, set or well moved to another ranch leaves the old one stale too
+    instance._dashboard_ranch_before = None
+    instance._placement_before = None
+    if instance.pk:
+        previous = sender.objects.filter(pk=instance.pk).first()
+        if previous is not None:
+            instance._dashboard_ranch_before = _dashboard_ranch(sender, previous)
+            if sender is Block:
+                instance._placement_before = (previous.set_id, previous.well_id)
+
+@receiver(post_save, sender=Block)
+@receiver(post_save, sender=IrrigationSet)
+@receiver(post_save, sender=Well)
+def invalidate_saved_dashboard(sender, instance, **kwargs):
+    ranch_ids = [_dashboard_ranch(sender, instance), getattr(instance, '_dashboard_ranch_before', None)]
+    invalidate_dashboards(ranch_ids)
+    invalidate_topology(ranch_ids)
+    placement = getattr(instance, '_placement_before', None)
+    if sender is Block and placement is not None and placement != (instance.set_id, instance.well_id):
+        _refresh_moved_block(instance, ranch_ids)
+
+def _refresh_moved_block(block, ranch_ids):
+    # The block's rollup rows carry its ranch; a block moved to another set or
+    # well has its whole history rebucketed under both ranches
+    dates = IrrigationHistory.objects.filter(block=block).aggregate(first=Min('date'), last=Max('date'))
+    if dates['first'] is not None:
+        refresh_daily_usage(dates['first'], dates['last'], [ranch_id for ranch_id in set(ranch_ids) if ranch_id is not None])
+
+@receiver(post_delete, sender=Block)
+@receiver(post_delete, sender=IrrigationSet)
+@receiver(post_delete, sender=Well)
+def invalidate_deleted_dashboard(sender, instance, origin=None, **kwargs):
+    if not _cascaded(sender, origin):
+        ranch_ids = [_dashboard_ranch(sender, instance)]
+        invalidate_dashboards(ranch_ids)
+        invalidate_topology(ranch_ids)
+
+@receiver(post_save, sender=Ranch)
+@receiver(post_delete, sender=Ranch)
+def invalidate_ranch_dashboard(sender, instance, **kwargs):
+    invalidate_dashboards([instance.id], index=True)
+    invalidate_topology([instance.id])
@@ -0,0 +1,204 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Least
+from django.utils import timezone
+
+from .models import Block, DailyWaterUsage, SoilWaterBalance, SoilWaterState, WeatherObservation
+
+# Daily root-zone water balance per block (FAO-56 style, single crop coefficient):
+#
+#   depletion[d] = clip(depletion[d-1] + ETo[d] * Kc - rain[d] - applied[d] * efficiency, 0, TAW)
+#
+# with TAW = root zone depth * available water capacity. Irrigation is due once
+# depletion reaches the allowable share of TAW. Every block is advanced together
+# as numpy arrays; each block starts from its stored SoilWaterState, so a nightly
+# run only simulates the days since the last one.
+#
+# Every simulated day's end state is also kept as a SoilWaterBalance row.
+# History entered or changed for a day a block has already been simulated
+# through marks its state with replay_from (see rewind_soil_water); the next
+# run replays that block from its balance on the last day before the change,
+# or from a full root zone when it has none.
+
+GALLONS_PER_ACRE_INCH = 27154
+APPLICATION_EFFICIENCY = 0.85  # share of pumped water that reaches the root zone
+ET_SMOOTHING = 0.25  # weight of the newest day in the crop ET rate used to forecast
+DEFAULT_CROP_COEFFICIENT = 1.0  # blocks without a Kc count as the reference crop
+
+def _array(values, default=0.0):
+    return np.array([float(value) if value is not None else default for value in values], dtype=float)
+
+def _decimal(value, places=3):
+    return Decimal(str(round(float(value), places)))
+
+def simulate(depletion, etc, rain, applied, taw, rate):
+    # Advance (blocks,) depletion and smoothed ETc rate through (blocks, days)
+    # inputs. Days before a block's start must hold zeros and NaN ETc. Returns
+    # the final depletion and rate, and both at the end of every day.
+    depletion = depletion.copy()
+    rate = rate.copy()
+    daily_depletion = np.empty(etc.shape)
+    daily_rate = np.empty(etc.shape)
+    for day in range(etc.shape[1]):
+        active = ~np.isnan(etc[:, day])
+        day_etc = np.where(active, etc[:, day], 0.0)
+        depletion = np.clip(depletion + day_etc - rain[:, day] - applied[:, day], 0.0, taw)
+        rate = np.where(active, np.where(np.isnan(rate), day_etc, rate + ET_SMOOTHING * (day_etc - rate)), rate)
+        daily_depletion[:, day] = depletion
+        daily_rate[:, day] = rate
+    return depletion, rate, daily_depletion, daily_rate
+
+def predict(depletion, rate, taw, allowable, acreage, gpm, efficiency=APPLICATION_EFFICIENCY):
+    # Days until depletion reaches the allowable share of TAW at the current ET
+    # rate, and the net inches / run minutes that refill the root zone then.
+    threshold = taw * allowable
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days = np.where(depletion >= threshold, 0.0, np.ceil((threshold - depletion) / rate))
+        days[~np.isfinite(days) | (rate <= 0) & (depletion < threshold)] = np.nan
+        inches = np.minimum(depletion + np.nan_to_num(days) * rate, taw)
+        minutes = inches / efficiency * GALLONS_PER_ACRE_INCH * acreage / gpm
+    minutes[~np.isfinite(minutes) | np.isnan(days)] = np.nan
+    inches[np.isnan(days)] = np.nan
+    return days, inches, minutes
+
+def run_water_balance(day=None, blocks=None, rebuild_from=None):
+    # Advance every block (or the given queryset) to `day`. Blocks without a
+    # state, or all of them with rebuild_from, start from a full root zone.
+    # Returns (blocks advanced, blocks skipped for lack of ETo).
+    day = day or timezone.localdate()
+    # For blocks marked for a replay, their last stored balance before the change
+    seed = SoilWaterBalance.objects.filter(
+        block=OuterRef('pk'), date__lt=OuterRef('soil_water__replay_from'),
+    ).order_by('-date')
+    blocks = list(
+        (blocks if blocks is not None else Block.objects.all()).select_related('set__ranch', 'soil_water').annotate(
+            seed_date=Subquery(seed.values('date')[:1]),
+            seed_depletion=Subquery(seed.values('depletion')[:1]),
+            seed_rate=Subquery(seed.values('crop_et_rate')[:1]),
+        )
+    )
+
+    starts = []
+    for block in blocks:
+        state = getattr(block, 'soil_water', None)
+        if rebuild_from is not None:
+            starts.append((rebuild_from, 0.0, np.nan))
+        elif state is None:
+            starts.append((day, 0.0, np.nan))
+        elif state.replay_from is not None and block.seed_date is not None:
+            starts.append((block.seed_date + timedelta(days=1), float(block.seed_depletion), float(block.seed_rate)))
+        elif state.replay_from is not None:
+            starts.append((state.replay_from, 0.0, np.nan))
+        else:
+            starts.append((state.date + timedelta(days=1), float(state.depletion), float(state.crop_et_rate)))
+    pending = [i for i, (start, _, _) in enumerate(starts) if start <= day]
+    blocks = [blocks[i] for i in pending]
+    starts = [starts[i] for i in pending]
+    if not blocks:
+        return 0, []
+
+    first = min(start for start, _, _ in starts)
+    days = (day - first).days + 1
+
+    # Weather by location, missing days filled with the location's mean ETo
+    locations = sorted({block.set.ranch.location for block in blocks if block.set.ranch.location})
+    eto = np.full((len(locations), days), np.nan)
+    rain = np.zeros((len(locations), days))
+    index = {location: i for i, location in enumerate(locations)}
+    for observation in WeatherObservation.objects.filter(location__in=locations, date__range=[first, day]):
+        column = (observation.date - first).days
+        if observation.reference_evapotranspiration is not None:
+            eto[index[observation.location], column] = float(observation.reference_evapotranspiration)
+        rain[index[observation.location], column] = float(observation.rainfall or 0)
+    observed = (~np.isnan(eto)).sum(axis=1)
+    means = np.where(observed > 0, np.nansum(eto, axis=1) / np.maximum(observed, 1), np.nan)
+    eto = np.where(np.isnan(eto), means[:, None], eto)
+
+    # Blocks whose location has no ETo at all over the range cannot be advanced
+    located = [index.get(block.set.ranch.location) for block in blocks]
+    known = {i for i, row in enumerate(located) if row is not None and observed[row]}
+    skipped = [block for i, block in enumerate(blocks) if i not in known]
+    blocks = [block for i, block in enumerate(blocks) if i in known]
+    starts = [start for i, start in enumerate(starts) if i in known]
+    if not blocks:
+        return 0, skipped
+
+    rows = [located[i] for i in sorted(known)]
+    acreage = _array([block.acreage for block in blocks])
+    gpm = _array([block.gpm for block in blocks])
+    kc = _array([block.et_crop_coefficient for block in blocks], DEFAULT_CROP_COEFFICIENT)
+    taw = _array([block.root_zone_depth for block in blocks]) * _array([block.available_water_capacity for block in blocks])
+    allowable = _array([block.allowable_depletion for block in blocks]) / 100
+
+    # Water applied per block and day, from the usage rollup
+    applied = np.zeros((len(blocks), days))
+    position = {block.id: i for i, block in enumerate(blocks)}
+    usage = (
+        DailyWaterUsage.objects.filter(block__in=position, date__range=[first, day])
+        .values('block', 'date').annotate(gallons=Sum('gallons')).order_by()
+    )
+    for row in usage:
+        applied[position[row['block']], (row['date'] - first).days] = float(row['gallons'])
+    # Net inches reaching the root zone, the same efficiency predict() grosses up by
+    with np.errstate(divide='ignore', invalid='ignore'):
+        applied = np.nan_to_num(applied * APPLICATION_EFFICIENCY / (GALLONS_PER_ACRE_INCH * acreage[:, None]))
+
+    # Inputs before each block's own start day are blanked out
+    offsets = np.array([(start - first).days for start, _, _ in starts])
+    active = np.arange(days)[None, :] >= offsets[:, None]
+    etc = np.where(active, eto[rows] * kc[:, None], np.nan)
+    depletion, rate, daily_depletion, daily_rate = simulate(
+        _array([depletion for _, depletion, _ in starts]),
+        etc, np.where(active, rain[rows], 0.0), np.where(active, applied, 0.0),
+        taw, np.array([rate for _, _, rate in starts]),
+    )
+    rate = np.nan_to_num(rate)
+    wait, inches, minutes = predict(depletion, rate, taw, allowable, acreage, gpm)
+
+    now = timezone.now()
+    states = []
+    for i, block in enumerate(blocks):
+        due = not np.isnan(wait[i])
+        states.append(SoilWaterState(
+            block=block,
+            date=day,
+            depletion=_decimal(depletion[i]),
+            total_available_water=_decimal(taw[i]),
+            crop_et_rate=_decimal(rate[i]),
+            next_irrigation_date=day + timedelta(days=int(wait[i])) if due else None,
+            next_irrigation_inches=_decimal(inches[i]) if due else None,
+            next_irrigation_minutes=_decimal(minutes[i], 2) if due and not np.isnan(minutes[i]) else None,
+            replay_from=None,
+            updated_at=now,
+        ))
+    balances = [
+        SoilWaterBalance(
+            block=blocks[i], date=first + timedelta(days=int(column)),
+            depletion=_decimal(daily_depletion[i, column]), crop_et_rate=_decimal(np.nan_to_num(daily_rate[i, column])),
+        )
+        for i, column in zip(*np.nonzero(active))
+    ]
+    with transaction.atomic():
+        SoilWaterBalance.objects.bulk_create(
+            balances, batch_size=1000, update_conflicts=True, unique_fields=['block', 'date'],
+            update_fields=['depletion', 'crop_et_rate'],
+        )
+        SoilWaterState.objects.bulk_create(
+            states, batch_size=1000, update_conflicts=True, unique_fields=['block'],
+            update_fields=[
+                'date', 'depletion', 'total_available_water', 'crop_et_rate', 'next_irrigation_date',
+                'next_irrigation_inches', 'next_irrigation_minutes', 'replay_from', 'updated_at',
+            ],
+        )
+    return len(states), skipped
+
+def rewind_soil_water(blocks, from_date):
+    # History of `blocks` (ids or a queryset) changed from `from_date` on; states
+    # already past that day are replayed by the next run
+    return SoilWaterState.objects.filter(block__in=blocks, date__gte=from_date).update(
+        replay_from=Least(Coalesce(F('replay_from'), Value(from_date)), Value(from_date)),
+    )
@@ -0,0 +1,250 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import OperationalError, close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import MeterTelemetry, WaterMeterReading, Well
+from .rollups import refresh_daily_usage
+from .utils import GALLONS_PER_ACRE_FOOT
+
+logger = logging.getLogger(__name__)
+
+# Flow meters post batches of samples: gallons delivered since the previous
+# sample, stamped with the time it was taken. Samples are buffered in process
+# memory and written in bulk, merged into one MeterTelemetry row per well and
+# day (8 bytes per sample), and each day's total is kept in a WaterMeterReading
+# so allocation and usage reports pick it up like a hand-entered reading.
+
+POINT_DTYPE = np.dtype([('second', '<u4'), ('gallons', '<f4')])
+MAX_ID = 2 ** 63 - 1
+
+def _capacity(model, name):
+    field = model._meta.get_field(name)
+    return Decimal(10) ** (field.max_digits - field.decimal_places)
+
+# Largest daily volume the gallons and acre-feet columns can hold
+MAX_GALLONS = min(
+    _capacity(MeterTelemetry, 'gallons'), _capacity(WaterMeterReading, 'gallons'),
+    _capacity(WaterMeterReading, 'acre_feet') * GALLONS_PER_ACRE_FOOT,
+) - 1
+
+def unpack(data):
+    return np.frombuffer(bytes(data or b''), dtype=POINT_DTYPE)
+
+def parse_timestamp(value):
+    # Epoch seconds or ISO 8601; times without an offset are in the site's time zone.
+    # Returns the local day and the seconds since its midnight.
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        moment = datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    elif isinstance(value, str):
+        moment = datetime.fromisoformat(value)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+    else:
+        raise ValueError(f'invalid timestamp: {value!r}')
+    moment = timezone.localtime(moment)
+    return moment.date(), moment.hour * 3600 + moment.minute * 60 + moment.second
+
+def parse_batch(payload):
+    # {"readings": [{"well": <id>, "timestamp": <epoch or ISO>, "gallons": <number>}, ...]}
+    # Returns the valid points as (well_id, day, second, gallons) and the errors by index.
+    readings = payload.get('readings') if isinstance(payload, dict) else None
+    if not isinstance(readings, list):
+        raise ValueError('Expected an object with a "readings" list.')
+
+    def well_id(item):
+        # JSON true/false are ints to Python; they are not well ids
+        well = item.get('well') if isinstance(item, dict) else None
+        return well if isinstance(well, int) and not isinstance(well, bool) and 0 < well <= MAX_ID else None
+
+    well_ids = {well_id(item) for item in readings} - {None}
+    known = set(Well.objects.filter(id__in=well_ids).values_list('id', flat=True))
+
+    points, errors = [], []
+    for index, item in enumerate(readings):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('expected an object')
+            if well_id(item) not in known:
+                raise ValueError(f"unknown well: {item.get('well')!r}")
+            gallons = item.get('gallons')
+            if isinstance(gallons, bool) or not isinstance(gallons, (int, float)) or not 0 <= gallons <= MAX_GALLONS:
+                raise ValueError(f'gallons must be a non-negative number up to {MAX_GALLONS}: {gallons!r}')
+            day, second = parse_timestamp(item.get('timestamp'))
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        points.append((item['well'], day, second, gallons))
+    return points, errors
+
+def write_points(points):
+    # Merge samples into their (well, day) rows, keeping the latest sample for a
+    # given second, then update each day's WaterMeterReading and the usage rollup.
+    grouped = defaultdict(list)
+    for well_id, day, second, gallons in points:
+        grouped[(well_id, day)].append((second, gallons))
+    ranches = dict(Well.objects.filter(id__in={key[0] for key in grouped}).values_list('id', 'ranch_id'))
+    grouped = {key: samples for key, samples in grouped.items() if key[0] in ranches}  # wells deleted meanwhile
+    if not grouped:
+        return 0
+
+    days = {key[1] for key in grouped}
+    now = timezone.now()
+    with transaction.atomic():
+        # Create missing rows first so the locked read below sees every key
+        MeterTelemetry.objects.bulk_create(
+            [MeterTelemetry(well_id=well_id, date=day) for well_id, day in grouped], ignore_conflicts=True,
+        )
+        rows = {
+            (row.well_id, row.date): row
+            for row in MeterTelemetry.objects.select_for_update().filter(well_id__in=ranches, date__in=days)
+            if (row.well_id, row.date) in grouped
+        }
+        readings = WaterMeterReading.objects.in_bulk([row.reading_id for row in rows.values() if row.reading_id])
+
+        new_readings = []
+        for key, samples in grouped.items():
+            row = rows[key]
+            merged = np.concatenate([unpack(row.points), np.array(samples, dtype=POINT_DTYPE)])[::-1]
+            _, latest = np.unique(merged['second'], return_index=True)
+            merged = merged[latest]
+            row.points = merged.tobytes()
+            row.point_count = len(merged)
+            row.gallons = Decimal(str(round(float(merged['gallons'].sum(dtype=np.float64)), 2)))
+            if row.gallons > MAX_GALLONS:
+                raise ValueError(f'{row.gallons} gallons for well {key[0]} on {key[1]} do not fit a meter reading')
+            row.updated_at = now
+
+            reading = readings.get(row.reading_id)
+            if reading is None:
+                reading = WaterMeterReading(ranch_id=ranches[key[0]], well_id=key[0], date=key[1])
+                new_readings.append((row, reading))
+            reading.gallons = row.gallons
+            reading.acre_feet = (row.gallons / GALLONS_PER_ACRE_FOOT).quantize(Decimal('0.0001'))
+
+        WaterMeterReading.objects.bulk_create([reading for _, reading in new_readings])
+        for row, reading in new_readings:
+            row.reading = reading
+        WaterMeterReading.objects.bulk_update(readings.values(), ['gallons', 'acre_feet'])
+        MeterTelemetry.objects.bulk_update(rows.values(), ['points', 'point_count', 'gallons', 'reading', 'updated_at'])
+
+    # Bulk writes skip the signals that keep the rollup current
+    refresh_daily_usage(min(days), max(days), set(ranches.values()))
+    return len(points)
+
+class TelemetryBuffer:
+    # Thread-safe in-memory buffer, flushed when it holds `flush_size` points or
+    # `flush_interval` seconds after the first unflushed point arrived.
+    def __init__(self, flush_size=5000, flush_interval=5.0):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._points = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._points)
+
+    def add(self, points):
+        with self._lock:
+            self._points.extend(points)
+            full = len(self._points) >= self.flush_size
+            if not full and self._points and self._timer is None and self.flush_interval:
+                self._timer = threading.Timer(self.flush_interval, self._flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            points, self._points = self._points, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not points:
+            return 0
+        with self._flush_lock:
+            try:
+                return write_points(points)
+            except OperationalError:
+                # The database is unavailable; put the points back so the next flush retries them
+                with self._lock:
+                    self._points[:0] = points
+                raise
+            except Exception:
+                logger.exception('Telemetry flush failed; writing each well and day on its own')
+            return self._write_separately(points)
+
+    def _write_separately(self, points):
+        # One bad (well, day) must not hold up the rest: each is written on its
+        # own, and the points of any that still fails are dropped
+        grouped = defaultdict(list)
+        for point in points:
+            grouped[point[:2]].append(point)
+        groups = list(grouped.items())
+        written = 0
+        for index, ((well_id, day), group) in enumerate(groups):
+            try:
+                written += write_points(group)
+            except OperationalError:
+                with self._lock:
+                    self._points[:0] = [point for _, rest in groups[index:] for point in rest]
+                raise
+            except Exception:
+                logger.exception('Dropped %d telemetry points for well %s on %s', len(group), well_id, day)
+        return written
+
+    def _flush_in_thread(self):
+        with self._lock:
+            self._timer = None
+        close_old_connections()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Telemetry flush failed')
+        finally:
+            close_old_connections()
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_buffer():
+    # Shared buffer built from TELEMETRY_FLUSH_SIZE / TELEMETRY_FLUSH_INTERVAL
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = TelemetryBuffer(
+                getattr(settings, 'TELEMETRY_FLUSH_SIZE', 5000),
+                getattr(settings, 'TELEMETRY_FLUSH_INTERVAL', 5.0),
+            )
+        return _buffer
+
+def reset_buffer():
+    global _buffer
+    with _buffer_lock:
+        _buffer = None
+
+@receiver(setting_changed)
+def _reset_buffer_on_setting_change(setting, **kwargs):
+    if setting.startswith('TELEMETRY_'):
+        reset_buffer()
+
+@atexit.register
+def _flush_on_exit():
+    if _buffer is not None:
+        try:
+            _buffer.flush()
+        except Exception:
+            logger.exception('Telemetry flush at exit failed')
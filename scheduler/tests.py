@@ -1,3 +1,1275 @@
-from django.test import TestCase
+import csv
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.test import AsyncRequestFactory, LiveServerTestCase, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import async_views, urls as scheduler_urls
+from .calculator import irrigation_minutes, ranch_irrigation_times
+from .dashboard import get_dashboard
+from .energy import STEP_MINUTES, energy_schedule
+from .forecast import forecast_ranch, forecast_ranches
+from .forms import BlockForm, IrrigationScheduleForm, IrrigationSetForm
+from .importers import import_irrigation_history, import_meter_readings
+from .metrics import QueryRecorder, registry
+from .middleware import MetricsMiddleware
+from .models import *
+from .optimizer import _improve, optimize_ranch_sets, pack_well
+from .reports import build_artifact, build_ranch_report, request_report
+from .scheduler import create_irrigation_schedules, generate_irrigation_schedule
+from .soil import run_water_balance
+from .telemetry import get_buffer, unpack
+from .topology import get_topology
+from .utils import get_history_page, get_metered_usage, get_water_usage
+from .weather import arefresh_reference_et, get_client
+
+
+def create_farm(blocks_per_set=3, sets=2):
+    ranch = Ranch.objects.create(name='North', allocation=Decimal('100.00'))
+    well = Well.objects.create(name='Well 1', ranch=ranch, gpm=Decimal('500.00'))
+    blocks = []
+    for number in range(1, sets + 1):
+        irrigation_set = IrrigationSet.objects.create(number=number, ranch=ranch)
+        for i in range(blocks_per_set):
+            blocks.append(Block.objects.create(
+                name=f'{number}-{i}', set=irrigation_set, variety='Hass', acreage=Decimal('10.00'),
+                gpm=Decimal('100.00'), well=well,
+            ))
+    return ranch, well, blocks
+
+
+def create_history(block, day, minutes=Decimal('60.00'), well=None):
+    gallons = block.gpm * minutes
+    return IrrigationHistory.objects.create(
+        block=block, date=day, minutes_irrigated=minutes, gallons_used=gallons,
+        acre_feet_used=gallons / 27154, well=well or block.well,
+    )
+
+
+class RanchReportTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm()
+        self.user = User.objects.create_user('grower', password='pw')
+        self.client.force_login(self.user)
+
+    def test_report_groups_histories_by_day(self):
+        start = date(2024, 6, 1)
+        for offset in range(3):
+            for block in self.blocks:
+                create_history(block, start + timedelta(days=offset * 2))
+
+        report = build_ranch_report(self.ranch, start, start + timedelta(days=6))
+
+        self.assertEqual([d['date'] for d in report], [start, start + timedelta(days=2), start + timedelta(days=4)])
+        self.assertEqual(report[0]['day'], 'Saturday')
+        self.assertEqual(len(report[0]['histories']), len(self.blocks))
+
+    def test_report_query_count_is_independent_of_range(self):
+        start = date(2024, 1, 1)
+        for offset in range(0, 120, 3):
+            for block in self.blocks:
+                create_history(block, start + timedelta(days=offset))
+
+        url = reverse('ranch_report', args=[self.ranch.id])
+        counts = []
+        for days in (7, 120):
+            data = {'from_date': start, 'to_date': start + timedelta(days=days)}
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(url, data)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1])
+
+        with self.assertNumQueries(2):
+            report = build_ranch_report(self.ranch, start, start + timedelta(days=120))
+            for day_data in report:
+                for history in day_data['histories']:
+                    history.well.name, history.block.set.number, history.block.acreage
+
+
+class WaterUsageTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=1)
+
+    def test_usage_totals_are_filtered_by_scope_and_window(self):
+        create_history(self.blocks[0], date(2024, 5, 1), minutes=Decimal('30.00'))
+        create_history(self.blocks[0], date(2024, 5, 8), minutes=Decimal('60.00'))
+        create_history(self.blocks[1], date(2024, 5, 8), minutes=Decimal('90.00'))
+
+        usage = get_water_usage(ranch=self.ranch)
+        self.assertEqual(usage['minutes'], Decimal('180.00'))
+        self.assertEqual(usage['gallons'], Decimal('18000.00'))
+
+        usage = get_water_usage(block=self.blocks[0], from_date=date(2024, 5, 2))
+        self.assertEqual(usage['minutes'], Decimal('60.00'))
+
+        usage = get_water_usage(well=self.well, to_date=date(2024, 4, 30))
+        self.assertEqual(usage['gallons'], 0)
+
+    def test_metered_usage_sums_readings(self):
+        WaterMeterReading.objects.create(ranch=self.ranch, well=self.well, date=date(2024, 5, 1),
+                                         gallons=Decimal('27154.00'), acre_feet=Decimal('1.0000'))
+        WaterMeterReading.objects.create(ranch=self.ranch, date=date(2024, 5, 2),
+                                         gallons=Decimal('13577.00'), acre_feet=Decimal('0.5000'))
+
+        usage = get_metered_usage(ranch=self.ranch)
+        self.assertEqual(usage['acre_feet'], Decimal('1.5'))
+        self.assertEqual(get_metered_usage(well=self.well)['gallons'], Decimal('27154'))
+
+
+class DailyWaterUsageTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=1)
+
+    def test_rollup_follows_history_and_meter_writes(self):
+        history = IrrigationHistory.objects.create(
+            block=self.blocks[0], minutes_irrigated=Decimal('60.00'), gallons_used=Decimal('6000.00'),
+            acre_feet_used=Decimal('0.2210'), well=self.well,
+        )
+        reading = WaterMeterReading.objects.create(ranch=self.ranch, well=self.well, date=history.date,
+                                                   gallons=Decimal('27154.00'), acre_feet=Decimal('1.0000'))
+
+        applied = DailyWaterUsage.objects.get(block=self.blocks[0])
+        self.assertEqual((applied.date, applied.ranch, applied.well), (history.date, self.ranch, self.well))
+        self.assertEqual(applied.minutes, Decimal('60.00'))
+        self.assertEqual(DailyWaterUsage.objects.get(block__isnull=True).acre_feet, Decimal('1.0000'))
+
+        reading.date = date(2024, 1, 1)
+        reading.save()
+        self.assertEqual(DailyWaterUsage.objects.get(block__isnull=True).date, date(2024, 1, 1))
+
+        history.delete()
+        reading.delete()
+        self.assertFalse(DailyWaterUsage.objects.exists())
+
+    def test_rebuild_command_restores_range(self):
+        create_history(self.blocks[0], date(2024, 5, 1))
+        create_history(self.blocks[1], date(2024, 5, 1))
+        create_history(self.blocks[1], date(2024, 6, 1))
+        DailyWaterUsage.objects.all().delete()
+
+        call_command('rebuild_daily_usage', '--from', '2024-05-01', '--to', '2024-05-31', stdout=StringIO())
+
+        self.assertEqual(DailyWaterUsage.objects.count(), 2)
+        self.assertEqual(get_water_usage(ranch=self.ranch)['minutes'], Decimal('120.00'))
+
+    def test_moving_a_block_moves_its_usage(self):
+        create_history(self.blocks[0], date(2024, 5, 1))
+        create_history(self.blocks[0], date(2024, 6, 1))
+        other, other_well, _ = create_farm(blocks_per_set=1, sets=1)
+
+        block = Block.objects.get(id=self.blocks[0].id)
+        block.set = IrrigationSet.objects.get(ranch=other)
+        block.save()
+
+        self.assertEqual(get_water_usage(ranch=self.ranch)['minutes'], Decimal('0'))
+        self.assertEqual(get_water_usage(ranch=other)['minutes'], Decimal('120.00'))
+        self.assertEqual(set(DailyWaterUsage.objects.filter(block=block).values_list('ranch', flat=True)), {other.id})
+
+    def test_deleting_a_block_cascades_without_rebuilding(self):
+        create_history(self.blocks[0], date(2024, 5, 1))
+        self.blocks[0].delete()
+        self.assertFalse(DailyWaterUsage.objects.exists())
+
+
+class ScheduleCreationTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=6, sets=2)
+
+    def schedule(self, blocks):
+        template = IrrigationSchedule(minutes_needed=Decimal('90.00'), leaching_factor=Decimal('10.00'), well=self.well)
+        with CaptureQueriesContext(connection) as ctx:
+            schedules = create_irrigation_schedules(Block.objects.filter(id__in=[b.id for b in blocks]), template)
+        return schedules, len(ctx)
+
+    def test_bulk_schedule_writes_schedules_histories_and_rollup(self):
+        schedules, _ = self.schedule(self.blocks[:3])
+
+        self.assertEqual(len(schedules), 3)
+        self.assertEqual(IrrigationSchedule.objects.count(), 3)
+        self.assertEqual(IrrigationSchedule.objects.first().hours_needed, Decimal('1.50'))
+        self.assertEqual(IrrigationHistory.objects.filter(well=self.well).count(), 3)
+        self.assertEqual(get_water_usage(ranch=self.ranch)['minutes'], Decimal('270.00'))
+
+    def test_bulk_schedule_query_count_is_constant(self):
+        _, few = self.schedule(self.blocks[:2])
+        _, many = self.schedule(self.blocks)
+        self.assertEqual(few, many)
+
+
+class VectorizedCalculatorTests(TestCase):
+    def test_matches_scalar_calculator_exactly(self):
+        rng = random.Random(7)
+        money = lambda low, high: Decimal(f'{rng.uniform(low, high):.2f}')
+        schedules = []
+        for _ in range(500):
+            block = Block(
+                acreage=money(1, 40), gpm=money(0.5, 2), tree_spacing=rng.choice([None, money(10, 25)]),
+                emitter_output=rng.choice([None, money(1, 6)]), et_crop_coefficient=money(0.3, 1.1), has_crop_x=False,
+            )
+            schedules.append(IrrigationSchedule(
+                block=block, reference_evapotranspiration=money(0.05, 0.4), distribution_uniformity=money(70, 95),
+                leaching_factor=money(0, 20),
+            ))
+
+        minutes = irrigation_minutes(
+            [s.reference_evapotranspiration for s in schedules], [s.block.et_crop_coefficient for s in schedules],
+            [s.distribution_uniformity for s in schedules], [s.leaching_factor for s in schedules],
+            [s.block.tree_spacing for s in schedules], [s.block.emitter_output for s in schedules],
+            [s.block.gpm for s in schedules],
+        )
+
+        self.assertEqual(minutes.tolist(), [s.irrigation_calculator() for s in schedules])
+
+    def test_ranch_times_broadcast_over_et_scenarios(self):
+        ranch, well, blocks = create_farm(blocks_per_set=2, sets=2)
+        Block.objects.filter(id=blocks[0].id).update(
+            has_crop_x=False, et_crop_coefficient=Decimal('0.80'), tree_spacing=Decimal('20.00'), emitter_output=Decimal('2.00'),
+        )
+        Block.objects.filter(id=blocks[1].id).update(has_crop_x=True)
+
+        times = ranch_irrigation_times([ranch], eto=np.array([[0.2], [0.3]]), du=85, leaching=10, inches_needed=1)
+
+        self.assertEqual(times['minutes'].shape, (2, len(blocks)))
+        self.assertEqual(times['block_ids'].tolist(), [b.id for b in blocks])
+        self.assertAlmostEqual(times['minutes'][0, 1], 27154 / 100)
+        self.assertGreater(times['minutes'][1, 0], times['minutes'][0, 0])
+        np.testing.assert_array_equal(times['gallons'], times['minutes'] * 100)
+
+
+class IrrigationPlanTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=4, sets=2)
+        Block.objects.filter(set__number=1).update(has_crop_x=True, interval_between_irrigations=3)
+        template = IrrigationSchedule(minutes_needed=Decimal('120.00'), leaching_factor=Decimal('10.00'),
+                                      fertilized=True, fertilization_details='UN-32')
+        create_irrigation_schedules(Block.objects.filter(id__in=[b.id for b in self.blocks[1:]]), template)
+        self.user = User.objects.create_user('grower', password='pw')
+        self.client.force_login(self.user)
+
+    def test_plan_uses_latest_schedule_per_block(self):
+        template = IrrigationSchedule(minutes_needed=Decimal('30.00'), leaching_factor=Decimal('10.00'), well=self.well)
+        create_irrigation_schedules(Block.objects.filter(id=self.blocks[1].id), template)
+
+        with self.assertNumQueries(2):
+            plan = {row['block'].id: row for row in generate_irrigation_schedule(self.ranch)}
+
+        self.assertIsNone(plan[self.blocks[0].id]['schedule'])
+        self.assertEqual(plan[self.blocks[1].id]['irrigation_time'], Decimal('30.00'))
+        self.assertEqual(plan[self.blocks[1].id]['irrigations_per_week'], 3)
+        self.assertEqual(plan[self.blocks[1].id]['fertilization'], {'fertilized': False, 'details': None})
+        self.assertEqual(plan[self.blocks[5].id]['weekly_gallons'], 12000.0)
+        self.assertEqual(plan[self.blocks[5].id]['fertilization']['details'], 'UN-32')
+
+    def test_plan_json_streams_every_block(self):
+        response = self.client.get(reverse('irrigation_plan_json', args=[self.ranch.id]))
+        data = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual([row['block_id'] for row in data['plan']], [b.id for b in self.blocks])
+        self.assertEqual(data['plan'][1]['hours'], 2.0)
+
+    def test_plan_page_renders(self):
+        response = self.client.get(reverse('irrigation_plan', args=[self.ranch.id]))
+        self.assertContains(response, 'No schedule')
+
+
+class SetOptimizerTests(TestCase):
+    def test_pack_well_respects_capacity_and_shortens_window(self):
+        rng = random.Random(3)
+        jobs = [(i, rng.randint(30, 360), rng.uniform(50, 600)) for i in range(200)]
+
+        slots = pack_well(jobs, 1000)
+
+        self.assertEqual(sorted(job[0] for slot in slots for job in slot), list(range(200)))
+        self.assertTrue(all(sum(job[2] for job in slot) <= 1000 for slot in slots))
+        sequential = sum(job[1] for job in jobs)
+        self.assertLess(sum(max(job[1] for job in slot) for slot in slots), sequential / 2)
+
+    def test_pack_well_swaps_long_runs_together(self):
+        a, b, c, d = ('a', 100, 50), ('b', 90, 50), ('c', 95, 50), ('d', 10, 50)
+        slots = [[a, b], [c, d]]
+        _improve(slots, 100)
+        self.assertEqual(sum(max(job[1] for job in slot) for slot in slots), 190)
+
+    def test_ranch_timetable(self):
+        ranch, well, blocks = create_farm(blocks_per_set=3, sets=2)
+        template = IrrigationSchedule(minutes_needed=Decimal('60.00'), leaching_factor=Decimal('10.00'))
+        create_irrigation_schedules(Block.objects.filter(id__in=[b.id for b in blocks[:5]]), template)
+
+        timetable = optimize_ranch_sets(ranch)
+
+        # 500 GPM well, 100 GPM blocks: all five fit in a single slot
+        self.assertEqual(timetable['window'], 60.0)
+        self.assertEqual(len(timetable['wells'][0]['slots']), 1)
+        self.assertEqual(timetable['unassigned'], [blocks[5]])
+
+    def test_energy_schedule_moves_runs_off_peak(self):
+        ranch, well, blocks = create_farm(blocks_per_set=3, sets=2)
+        Well.objects.filter(id=well.id).update(pump_kw=Decimal('50.00'))
+        Block.objects.update(has_crop_x=False, days_between_irrigations=1)
+        template = IrrigationSchedule(minutes_needed=Decimal('60.00'), leaching_factor=Decimal('10.00'))
+        create_irrigation_schedules(Block.objects.all(), template)
+        tariff = {'base': 0.30, 'windows': [{'start': 22, 'end': 24, 'price': 0.05}]}
+
+        timetable = energy_schedule(ranch, tariff)
+
+        runs = timetable['wells'][0]['runs']
+        self.assertEqual(len(runs), 6 * 7)
+        # Every block runs once a day, inside the two cheap hours
+        for block in blocks:
+            starts = [run['start'] for run in runs if run['block'] == block]
+            self.assertEqual(sorted(start // (24 * 60) for start in starts), list(range(7)))
+        self.assertTrue(all(22 * 60 <= run['start'] % (24 * 60) <= 24 * 60 - run['minutes'] for run in runs))
+        # Never more than the well's 500 gpm at once
+        usage = [0] * (7 * 24 * 60 // STEP_MINUTES)
+        for run in runs:
+            for step in range(run['start'] // STEP_MINUTES, int(run['end']) // STEP_MINUTES):
+                usage[step] += run['gpm']
+        self.assertLessEqual(max(usage), 500)
+        # 10 kWh per run (a fifth of the 50 kW pump for an hour) at $0.05
+        self.assertAlmostEqual(timetable['cost'], 42 * 10 * 0.05)
+        self.assertAlmostEqual(timetable['baseline_cost'], 42 * 10 * 0.30)
+
+
+@override_settings(WEATHER_BACKEND='scheduler.weather.StubBackend', WEATHER_OPTIONS={
+    'eto': 0.25, 'observations': {'Fillmore': {'eto': 0.31, 'rainfall': 0.1}},
+})
+class WeatherClientTests(TestCase):
+    def test_client_caches_in_memory_and_database(self):
+        client = get_client()
+        day = date(2024, 7, 1)
+
+        observations = client.get_many(['Fillmore', 'Piru', 'Fillmore'], day)
+
+        self.assertEqual(observations['Fillmore'].reference_evapotranspiration, Decimal('0.31'))
+        self.assertEqual(observations['Piru'].rainfall, Decimal('0.00'))
+        self.assertEqual(len(client.backend.calls), 2)
+        self.assertEqual(WeatherObservation.objects.filter(date=day).count(), 2)
+
+        with self.assertNumQueries(0):
+            client.get('Piru', day)
+
+        client.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(client.get('Piru', day).reference_evapotranspiration, Decimal('0.25'))
+        self.assertEqual(len(client.backend.calls), 2)
+
+    def test_scheduling_fills_reference_et_from_weather(self):
+        ranch, well, blocks = create_farm(blocks_per_set=2, sets=1)
+        Ranch.objects.filter(id=ranch.id).update(location='Fillmore')
+        Block.objects.filter(id__in=[b.id for b in blocks]).update(
+            has_crop_x=False, et_crop_coefficient=Decimal('0.80'), tree_spacing=Decimal('20.00'),
+            emitter_output=Decimal('2.00'),
+        )
+        template = IrrigationSchedule(leaching_factor=Decimal('10.00'), distribution_uniformity=Decimal('85.00'))
+
+        schedules = create_irrigation_schedules(Block.objects.filter(set__ranch=ranch), template)
+
+        self.assertEqual([s.reference_evapotranspiration for s in schedules], [Decimal('0.31')] * 2)
+        self.assertEqual(schedules[0].minutes_needed, schedules[0].irrigation_calculator())
+
+    def test_stub_accepts_the_default_options(self):
+        with override_settings(WEATHER_OPTIONS={'api_key': '', 'timeout': 5, 'retries': 3, 'pool_size': 10}):
+            self.assertEqual(get_client().get('Piru', date(2024, 7, 1)).reference_evapotranspiration, Decimal('0.20'))
+
+
+class FakeWeatherHandler(BaseHTTPRequestHandler):
+    in_flight = 0
+    max_in_flight = 0
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        location = parse_qs(urlparse(self.path).query)['location'][0]
+        cls.requests.append(location)
+        time.sleep(0.05)
+        body = json.dumps({'eto': 0.1 + len(location) / 100, 'rainfall': 0}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with cls.lock:
+            cls.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class AsyncWeatherRefreshTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeWeatherHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeWeatherHandler.requests = []
+        FakeWeatherHandler.max_in_flight = 0
+        for i, location in enumerate(['Fillmore', ' fillmore', 'Piru', 'Santa Paula', 'Ojai', 'Moorpark', 'Somis']):
+            Ranch.objects.create(name=f'Ranch {i}', allocation=Decimal('100.00'), location=location)
+        url = f'http://127.0.0.1:{self.server.server_port}/weather'
+        self.settings_override = override_settings(WEATHER_OPTIONS={'url': url, 'retries': 0, 'pool_size': 3})
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    async def test_refresh_fetches_each_station_once_with_a_concurrency_limit(self):
+        observations = await arefresh_reference_et(date(2024, 7, 1))
+
+        self.assertEqual(sorted(FakeWeatherHandler.requests), ['Fillmore', 'Moorpark', 'Ojai', 'Piru', 'Santa Paula', 'Somis'])
+        self.assertLessEqual(FakeWeatherHandler.max_in_flight, 3)
+        self.assertGreater(FakeWeatherHandler.max_in_flight, 1)
+        self.assertEqual(len(observations), 7)
+        self.assertEqual(await WeatherObservation.objects.filter(date=date(2024, 7, 1)).acount(), 7)
+        fillmore = await WeatherObservation.objects.aget(location=' fillmore')
+        self.assertEqual(fillmore.reference_evapotranspiration, Decimal('0.18'))
+
+    def test_refresh_command(self):
+        out = StringIO()
+        call_command('refresh_eto', '--date', '2024-07-02', '--concurrency', '2', stdout=out)
+
+        self.assertIn('Stored 7 weather observations.', out.getvalue())
+        self.assertLessEqual(FakeWeatherHandler.max_in_flight, 2)
+
+    def test_refresh_view_requires_post(self):
+        self.client.force_login(User.objects.create_user('grower', password='pw'))
+        self.assertEqual(self.client.get(reverse('refresh_eto')).status_code, 405)
+        response = self.client.post(reverse('refresh_eto'))
+        self.assertEqual(len(response.json()['observations']), 7)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_seed_and_benchmark_every_view(self):
+        call_command('seed_farm', '--ranches', '1', '--sets', '2', '--blocks-per-set', '3', '--years', '0.1', stdout=StringIO())
+        self.assertEqual(Block.objects.count(), 6)
+        self.assertTrue(IrrigationHistory.objects.exists())
+        self.assertTrue(DailyWaterUsage.objects.filter(block__isnull=True).exists())
+        for reading in WaterMeterReading.objects.all():
+            self.assertEqual(reading.acre_feet, (reading.gallons / 27154).quantize(Decimal('0.0001')))
+
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            call_command('benchmark_views', '--iterations', '2', '--output', output.name, stderr=StringIO())
+            results = json.load(output)
+
+        self.assertEqual(set(results['views']), {'home', *(p.name for p in scheduler_urls.urlpatterns)})
+        self.assertEqual(results['views']['ranch_report']['status'], 200)
+        self.assertGreater(results['views']['block_history']['queries'], 0)
+        self.assertFalse(User.objects.filter(username='benchmark').exists())
+        self.assertFalse(Session.objects.exists())
+
+        output = StringIO()
+        call_command('benchmark_queries', '--repeat', '1', '--json', stdout=output)
+        queries = json.loads(output.getvalue())['queries']
+        self.assertEqual(set(queries), {
+            'block_history', 'block_history_seasons', 'ranch_report', 'ranch_report_totals',
+            'ranch_allocation_status', 'ranch_allocation_status_totals',
+        })
+        self.assertGreater(queries['ranch_report']['rows'], 0)
+
+
+class BlockHistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=1, sets=1)
+        self.block = self.blocks[0]
+        start = date(2022, 12, 1)
+        for offset in range(0, 130):
+            create_history(self.block, start + timedelta(days=offset // 2))
+        self.client.force_login(User.objects.create_user('grower', password='pw'))
+
+    def test_keyset_pages_cover_every_row_once(self):
+        seen = []
+        cursor = None
+        while True:
+            histories, cursor = get_history_page(self.block, cursor, page_size=40)
+            seen.extend(histories)
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 130)
+        self.assertEqual(len({h.id for h in seen}), 130)
+        self.assertEqual(seen, sorted(seen, key=lambda h: (h.date, h.id), reverse=True))
+
+    def test_json_pages_and_season_summaries(self):
+        url = reverse('block_history_json', args=[self.block.id])
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['histories']), 50)
+        self.assertEqual([s['season'] for s in first['seasons']], [2023, 2022])
+        self.assertEqual(first['seasons'][1]['irrigation_days'], 31)
+        self.assertEqual(Decimal(first['seasons'][1]['minutes']), Decimal('3720'))
+
+        second = self.client.get(url, {'before': first['next']}).json()
+        self.assertNotIn('seasons', second)
+        self.assertLess(second['histories'][0]['date'], first['histories'][-1]['date'])
+        self.assertEqual(self.client.get(url, {'before': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('block_history_json', args=[0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('block_history', args=[0])).status_code, 404)
+
+    def test_page_query_count_does_not_depend_on_history_size(self):
+        url = reverse('block_history', args=[self.block.id])
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        for offset in range(100):
+            create_history(self.block, date(2021, 1, 1) + timedelta(days=offset))
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(url)
+        self.assertEqual(len(before), len(after))
+        self.assertContains(response, '?before=')
+        self.assertContains(response, f'History for Block: {self.block.name}')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=1)
+        for offset in range(10):
+            for block in self.blocks:
+                create_history(block, date(2024, 6, 1) + timedelta(days=offset))
+        WaterMeterReading.objects.create(ranch=self.ranch, well=self.well, date=date(2024, 6, 1),
+                                         gallons=Decimal('27154.00'), acre_feet=Decimal('1.0000'))
+        self.client.force_login(User.objects.create_user('grower', password='pw'))
+
+    def test_ranch_report_csv_streams_the_whole_range(self):
+        url = reverse('export_ranch_report', args=[self.ranch.id, 'csv'])
+        response = self.client.get(url, {'from_date': '2024-06-01', 'to_date': '2024-06-05'})
+
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:3], ['Date', 'Day', 'Well'])
+        self.assertEqual(len(rows), 1 + 5 * len(self.blocks))
+        self.assertEqual(rows[1][:5], ['2024-06-01', 'Saturday', 'Well 1', '1', '1-0'])
+
+    def test_block_history_and_meter_reading_exports(self):
+        response = self.client.get(reverse('export_block_history', args=[self.blocks[0].id, 'csv']))
+        self.assertEqual(b''.join(response.streaming_content).decode().count('\n'), 11)
+
+        response = self.client.get(reverse('export_meter_readings', args=[self.ranch.id, 'xlsx']))
+        self.assertEqual(response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+
+    def test_pdf_export_and_unknown_format(self):
+        url = reverse('export_ranch_report', args=[self.ranch.id, 'pdf'])
+        response = self.client.get(url, {'from_date': '2024-06-01', 'to_date': '2024-06-10'})
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        self.assertEqual(self.client.get(reverse('export_ranch_report', args=[self.ranch.id, 'doc'])).status_code, 404)
+
+    @override_settings(PDF_EXPORT_MAX_ROWS=10)
+    def test_large_pdf_exports_are_refused(self):
+        url = reverse('export_ranch_report', args=[self.ranch.id, 'pdf'])
+        response = self.client.get(url, {'from_date': '2024-06-01', 'to_date': '2024-06-10'})
+        self.assertEqual(response.status_code, 413)
+        self.assertIn(b'CSV or XLSX', response.content)
+
+        url = reverse('export_ranch_report', args=[self.ranch.id, 'csv'])
+        response = self.client.get(url, {'from_date': '2024-06-01', 'to_date': '2024-06-10'})
+        self.assertEqual(b''.join(response.streaming_content).decode().count('\n'), 1 + 10 * len(self.blocks))
+
+@override_settings(REPORT_WORKER='sync')
+class ReportArtifactTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=1)
+        for block in self.blocks:
+            create_history(block, date(2024, 6, 1))
+        self.client.force_login(User.objects.create_user('grower', password='pw'))
+
+    def test_download_is_built_once_and_served_from_cache(self):
+        url = reverse('download_report', args=[self.ranch.id])
+        params = {'from_date': '2024-06-01', 'to_date': '2024-06-30'}
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+        artifact = ReportArtifact.objects.get()
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertFalse(any('UPDATE' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(ReportArtifact.objects.get().completed_at, artifact.completed_at)
+
+    def test_new_history_invalidates_the_cached_report(self):
+        first = request_report(self.ranch, date(2024, 6, 1), date(2024, 6, 30))
+        self.assertEqual(first.status, ReportArtifact.READY)
+        self.assertEqual(request_report(self.ranch, date(2024, 6, 1), date(2024, 6, 30)).id, first.id)
+
+        create_history(self.blocks[0], date(2024, 6, 2))
+        second = request_report(self.ranch, date(2024, 6, 1), date(2024, 6, 30))
+        self.assertNotEqual(second.cache_key, first.cache_key)
+        self.assertEqual(second.status, ReportArtifact.READY)
+        self.assertFalse(ReportArtifact.objects.filter(id=first.id).exists())
+
+    def test_edited_or_deleted_history_invalidates_the_cached_report(self):
+        first = request_report(self.ranch, date(2024, 6, 1), date(2024, 6, 30))
+        history = IrrigationHistory.objects.filter(block=self.blocks[0]).get()
+        history.minutes_irrigated = Decimal('45.00')
+        history.save()
+        self.assertFalse(ReportArtifact.objects.filter(id=first.id).exists())
+        edited = request_report(self.ranch, date(2024, 6, 1), date(2024, 6, 30))
+        self.assertNotEqual(edited.content_hash, first.content_hash)
+
+        # Reports of other ranges stay cached
+        other = request_report(self.ranch, date(2024, 7, 1), date(2024, 7, 31))
+        IrrigationHistory.objects.filter(block=self.blocks[1]).delete()
+        self.assertFalse(ReportArtifact.objects.filter(id=edited.id).exists())
+        self.assertTrue(ReportArtifact.objects.filter(id=other.id).exists())
+        self.assertNotEqual(request_report(self.ranch, date(2024, 6, 1), date(2024, 6, 30)).cache_key, edited.cache_key)
+
+    def test_build_of_a_deleted_artifact_is_skipped(self):
+        with self.assertLogs('scheduler.reports', 'INFO'):
+            build_artifact(0)
+
+    @override_settings(REPORT_WORKER='thread')
+    def test_builds_are_queued_on_commit_and_stuck_ones_retried(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            artifact = request_report(self.ranch, date(2024, 6, 1), date(2024, 6, 30))
+        self.assertEqual((artifact.status, len(callbacks)), (ReportArtifact.PENDING, 1))
+
+        # Pending within the timeout: left to its worker
+        with self.captureOnCommitCallbacks() as callbacks:
+            request_report(self.ranch, date(2024, 6, 1), date(2024, 6, 30))
+        self.assertEqual(callbacks, [])
+
+        ReportArtifact.objects.filter(id=artifact.id).update(updated_at=timezone.now() - timedelta(hours=1))
+        with self.captureOnCommitCallbacks() as callbacks:
+            request_report(self.ranch, date(2024, 6, 1), date(2024, 6, 30))
+        self.assertEqual(len(callbacks), 1)
+
+        # The monthly command builds inline without touching REPORT_WORKER
+        call_command('generate_monthly_reports', '--month', '2024-05', stdout=StringIO())
+        self.assertEqual(ReportArtifact.objects.get(from_date=date(2024, 5, 1)).status, ReportArtifact.READY)
+
+class CsvImportTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=1)
+
+    def test_meter_readings_upsert_convert_and_report_errors(self):
+        WaterMeterReading.objects.create(ranch=self.ranch, well=self.well, date=date(2024, 6, 1),
+                                         gallons=Decimal('1.00'), acre_feet=Decimal('0.0000'))
+        lines = ['date,well,gallons,acre_feet']
+        lines += [f'{date(2024, 6, 1) + timedelta(days=i)},Well 1,27154,' for i in range(30)]
+        lines += ['2024-07-01,Well 1,,2', '2024-07-02,Well 9,100,', 'yesterday,Well 1,100,', '2024-07-03,Well 1,,']
+
+        # Per chunk: lookup, update, insert (plus savepoints); the rollup refresh runs once
+        with self.assertNumQueries(16):
+            result = import_meter_readings(self.ranch, StringIO('\n'.join(lines)), chunk_size=20)
+
+        self.assertEqual((result.created, result.updated), (30, 1))
+        self.assertEqual([line for line, _ in result.errors], [33, 34, 35])
+        self.assertIn('Well 9', result.errors[0][1])
+        self.assertEqual(WaterMeterReading.objects.get(date=date(2024, 6, 1)).acre_feet, Decimal('1.0000'))
+        self.assertEqual(WaterMeterReading.objects.get(date=date(2024, 7, 1)).gallons, Decimal('54308.00'))
+        self.assertEqual(get_metered_usage(ranch=self.ranch)['acre_feet'], Decimal('32.0000'))
+
+    def test_history_import_fills_volumes_and_refreshes_rollup(self):
+        create_history(self.blocks[0], date(2024, 6, 1), minutes=Decimal('10.00'))
+        Block.objects.filter(id=self.blocks[1].id).update(has_crop_x=False, days_between_irrigations=7, interval_between_irrigations=3)
+        upload = 'date,block,minutes\n2024-06-01,1-0,60\n2024-06-01,1-1,30\n2024-06-01,1-1,30\n2024-06-02,9-9,30\n'
+
+        result = import_irrigation_history(self.ranch, StringIO(upload))
+
+        # A second irrigation the same day is a new record, and so is a repeated row
+        self.assertEqual((result.created, result.updated, len(result.errors)), (3, 0, 1))
+        history = IrrigationHistory.objects.filter(block=self.blocks[0]).order_by('id').last()
+        self.assertEqual((history.minutes_irrigated, history.gallons_used), (Decimal('60.00'), Decimal('6000.00')))
+        self.assertEqual(get_water_usage(ranch=self.ranch)['gallons'], Decimal('13000.00'))
+        history = IrrigationHistory.objects.filter(block=self.blocks[1]).first()
+        self.assertEqual((history.days_between_irrigations, history.interval_between_irrigations), (7, None))
+
+        # Importing the same file again updates those rows in place
+        result = import_irrigation_history(self.ranch, StringIO(upload), chunk_size=2)
+        self.assertEqual((result.created, result.updated), (0, 3))
+        self.assertEqual(IrrigationHistory.objects.count(), 4)
+
+    def test_failed_import_still_refreshes_the_committed_chunks(self):
+        def upload():
+            # An upload that cannot be decoded past its first row
+            yield 'date,block,minutes\n'
+            yield '2024-06-01,1-0,60\n'
+            raise UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'invalid start byte')
+
+        with self.assertRaises(UnicodeDecodeError):
+            import_irrigation_history(self.ranch, upload(), chunk_size=1)
+        self.assertEqual(IrrigationHistory.objects.count(), 1)
+        self.assertEqual(get_water_usage(ranch=self.ranch)['gallons'], Decimal('6000.00'))
+
+    def test_upload_view_and_missing_columns(self):
+        self.client.force_login(User.objects.create_user('grower', password='pw'))
+        url = reverse('import_data', args=[self.ranch.id])
+        upload = SimpleUploadedFile('readings.csv', b'date,well,gallons\n2024-06-01,Well 1,500\n')
+        response = self.client.post(url, {'kind': 'readings', 'file': upload})
+        self.assertContains(response, 'Created 1, updated 0, skipped 0 rows.')
+
+        upload = SimpleUploadedFile('readings.csv', b'day,gallons\n2024-06-01,500\n')
+        response = self.client.post(url, {'kind': 'readings', 'file': upload})
+        self.assertContains(response, 'Missing column(s): date')
+
+@override_settings(TELEMETRY_TOKEN='secret', TELEMETRY_FLUSH_SIZE=1000, TELEMETRY_FLUSH_INTERVAL=0)
+class TelemetryTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=1, sets=1)
+        self.url = reverse('ingest_telemetry')
+
+    def post(self, readings, token='secret'):
+        return self.client.post(self.url, json.dumps({'readings': readings}), content_type='application/json',
+                                HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_rejects_bad_token_and_reports_bad_points(self):
+        self.assertEqual(self.post([], token='wrong').status_code, 401)
+        if not Well.objects.filter(id=1).exists():
+            Well.objects.create(id=1, name='Well 0', ranch=self.ranch, gpm=Decimal('100.00'))
+        response = self.post([
+            {'well': self.well.id, 'timestamp': '2024-06-01T08:00:00+00:00', 'gallons': 10},
+            {'well': 999, 'timestamp': '2024-06-01T08:00:00+00:00', 'gallons': 10},
+            {'well': self.well.id, 'timestamp': 'soon', 'gallons': 10},
+            {'well': self.well.id, 'timestamp': 1717228800, 'gallons': -1},
+            {'well': True, 'timestamp': 1717228800, 'gallons': 10},  # not well 1
+        ])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['accepted'], 1)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2, 3, 4])
+        self.assertEqual(len(get_buffer()), 1)
+
+        # Values the reading columns cannot hold, and ids past a bigint, are per-row errors
+        response = self.post([
+            {'well': self.well.id, 'timestamp': 1717228800, 'gallons': 1e20},
+            {'well': 2 ** 64, 'timestamp': 1717228800, 'gallons': 10},
+        ])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [0, 1])
+        self.assertIn('non-negative', response.json()['errors'][0]['error'])
+
+    def test_a_bad_day_does_not_block_the_others(self):
+        start = 1717200000  # 2024-06-01 00:00 UTC
+        self.post([{'well': self.well.id, 'timestamp': start + i, 'gallons': 10} for i in range(3)])
+        # A day whose total overflows the reading columns, as if it had slipped past validation
+        get_buffer().add([(self.well.id, date(2024, 6, 2), second, 2e10) for second in range(3)])
+
+        with self.assertLogs('scheduler.telemetry', 'ERROR'):
+            self.assertEqual(get_buffer().flush(), 3)
+        self.assertEqual(len(get_buffer()), 0)
+        self.assertEqual(list(WaterMeterReading.objects.values_list('date', 'gallons')), [(date(2024, 6, 1), Decimal('30.00'))])
+
+        # Later batches go through
+        self.post([{'well': self.well.id, 'timestamp': start + 10, 'gallons': 5}])
+        get_buffer().flush()
+        self.assertEqual(WaterMeterReading.objects.get().gallons, Decimal('35.00'))
+
+    def test_flush_packs_points_per_day_and_feeds_meter_readings(self):
+        start = 1717200000  # 2024-06-01 00:00 UTC
+        self.post([{'well': self.well.id, 'timestamp': start + i * 300, 'gallons': 25.5} for i in range(600)])
+        # Resending a sample replaces it rather than counting it twice
+        self.post([{'well': self.well.id, 'timestamp': start, 'gallons': 30}])
+        self.assertEqual(len(get_buffer()), 601)
+
+        # One write per table for all three days, however many points there are
+        with self.assertNumQueries(13):
+            get_buffer().flush()
+
+        rows = list(MeterTelemetry.objects.order_by('date'))
+        self.assertEqual([row.point_count for row in rows], [288, 288, 24])
+        self.assertEqual(len(rows[0].points), 288 * 8)
+        self.assertEqual(unpack(rows[0].points)['gallons'][0], 30)
+        self.assertEqual(rows[0].gallons, Decimal('7348.50'))
+        self.assertEqual(rows[0].reading.gallons, Decimal('7348.50'))
+        self.assertEqual(get_metered_usage(ranch=self.ranch)['gallons'], Decimal('15300.00') + Decimal('4.50'))
+
+        # A later batch for the same day updates the same rows
+        self.post([{'well': self.well.id, 'timestamp': start + 3 * 86400 - 60, 'gallons': 100}])
+        get_buffer().flush()
+        self.assertEqual(MeterTelemetry.objects.count(), 3)
+        self.assertEqual(WaterMeterReading.objects.count(), 3)
+        self.assertEqual(MeterTelemetry.objects.get(date=date(2024, 6, 3)).reading.gallons, Decimal('712.00'))
+
+class MetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=1)
+        for block in self.blocks:
+            create_history(block, date(2024, 6, 1))
+        self.client.force_login(User.objects.create_user('grower', password='pw'))
+        registry.reset()
+
+    def test_records_views_and_streamed_exports(self):
+        self.client.get(reverse('ranch_report', args=[self.ranch.id]))
+        response = self.client.get(reverse('export_block_history', args=[self.blocks[0].id, 'csv']))
+        body = b''.join(response.streaming_content)
+
+        self.assertEqual(registry.count['ranch_report'], 1)
+        self.assertGreater(registry.queries['ranch_report'], 0)
+        # Streamed rows are read after the view returns and still count
+        self.assertEqual(registry.response_bytes['export_block_history'], len(body))
+        self.assertGreaterEqual(registry.queries['export_block_history'], 3)
+
+        with override_settings(METRICS_TOKEN='scrape'):
+            metrics = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+        self.assertIn('scheduler_requests_total{view="ranch_report",method="GET",status="200"} 1', metrics)
+        self.assertIn('scheduler_request_duration_seconds_count{view="export_block_history"} 1', metrics)
+
+    def test_repeated_queries_are_flagged(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for block in self.blocks:
+                list(IrrigationHistory.objects.filter(block=block))
+        self.assertEqual((recorder.count, recorder.duplicates), (2, 1))
+
+        def n_plus_one(request):
+            return HttpResponse(', '.join(block.set.ranch.name for block in Block.objects.all()))
+
+        with self.assertLogs('scheduler.metrics', 'WARNING') as logs, override_settings(METRICS_REPEATED_QUERY_THRESHOLD=2):
+            MetricsMiddleware(n_plus_one)(RequestFactory().get('/'))
+        self.assertIn('ran the same query 2 times', logs.output[0])
+        self.assertEqual(registry.duplicates['<unresolved>'], 2)
+
+    @override_settings(METRICS_TOKEN='scrape')
+    def test_metrics_endpoint_needs_the_token_or_staff(self):
+        url = reverse('metrics')
+        # A local address proves nothing behind a proxy
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        self.client.force_login(User.objects.create_user('admin', password='pw', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=2)
+        self.client.force_login(User.objects.create_user('grower', password='pw'))
+
+    def test_ranch_detail_is_served_from_cache(self):
+        url = reverse('ranch_detail', args=[self.ranch.id])
+        with self.assertNumQueries(6):  # session, user, then ranch, blocks, wells and usage
+            self.client.get(url)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, '1-0 - Hass')
+        self.assertEqual(self.client.get(reverse('ranch_detail', args=[999])).status_code, 404)
+
+    def test_writes_invalidate_only_their_ranch(self):
+        other, _, _ = create_farm(blocks_per_set=1, sets=1)
+        get_dashboard(self.ranch.id)
+        get_dashboard(other.id)
+
+        create_history(self.blocks[0], timezone.localdate())
+        with self.assertNumQueries(0):
+            get_dashboard(other.id)
+        self.assertEqual(get_dashboard(self.ranch.id)['week_gallons'], Decimal('6000.00'))
+
+        Well.objects.create(name='Well 2', ranch=self.ranch, gpm=Decimal('250.00'))
+        Block.objects.filter(id=self.blocks[0].id).first().delete()
+        dashboard = get_dashboard(self.ranch.id)
+        self.assertEqual([well['name'] for well in dashboard['wells']], ['Well 1', 'Well 2'])
+        self.assertEqual(len(dashboard['blocks']), 3)
+
+        WaterMeterReading.objects.create(ranch=self.ranch, well=self.well, date=timezone.localdate(),
+                                         gallons=Decimal('27154.00'), acre_feet=Decimal('1.0000'))
+        self.assertEqual(get_dashboard(self.ranch.id)['allocation_remaining'], Decimal('99.0000'))
+
+    def test_home_lists_ranches_from_cache(self):
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('home'))
+        Ranch.objects.create(name='South', allocation=Decimal('50.00'))
+        self.assertContains(self.client.get(reverse('home')), 'South')
+
+class PageQueryCountTests(TestCase):
+    # Every page runs the same number of queries however many blocks, wells,
+    # sets and records the ranch has
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('grower', password='pw'))
+
+    def grow(self, ranch, well, blocks):
+        for number in range(10, 13):
+            irrigation_set = IrrigationSet.objects.create(number=number, ranch=ranch)
+            extra_well = Well.objects.create(name=f'Well {number}', ranch=ranch, gpm=Decimal('300.00'))
+            for i in range(3):
+                blocks.append(Block.objects.create(
+                    name=f'{number}-{i}', set=irrigation_set, variety='Hass', acreage=Decimal('5.00'),
+                    gpm=Decimal('50.00'), well=extra_well,
+                ))
+        for block in blocks:
+            create_history(block, timezone.localdate())
+            WaterMeterReading.objects.create(ranch=ranch, well=block.well, date=timezone.localdate(),
+                                             gallons=Decimal('100.00'), acre_feet=Decimal('0.0037'))
+
+    def pages(self, ranch, block):
+        return {
+            'home': reverse('home'),
+            'ranch_detail': reverse('ranch_detail', args=[ranch.id]),
+            'create_block': reverse('create_block', args=[ranch.id]),
+            'create_irrigation_set': reverse('create_irrigation_set', args=[ranch.id]),
+            'create_irrigation_schedule': reverse('create_irrigation_schedule', args=[ranch.id]),
+            'create_water_meter_reading': reverse('create_water_meter_reading'),
+            'block_history': reverse('block_history', args=[block.id]),
+            'ranch_allocation_status': reverse('ranch_allocation_status', args=[ranch.id]),
+            'well_list': reverse('well_list', args=[ranch.id]),
+            'create_well': reverse('create_well', args=[ranch.id]),
+            'ranch_report': reverse('ranch_report', args=[ranch.id]),
+            'irrigation_plan': reverse('irrigation_plan', args=[ranch.id]),
+            'set_timetable': reverse('set_timetable', args=[ranch.id]),
+            'energy_timetable': reverse('set_timetable', args=[ranch.id]) + '?mode=energy',
+        }
+
+    def count(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_query_counts_do_not_grow_with_the_ranch(self):
+        ranch, well, blocks = create_farm(blocks_per_set=1, sets=1)
+        create_history(blocks[0], timezone.localdate())
+        pages = self.pages(ranch, blocks[0])
+        small = {name: self.count(url) for name, url in pages.items()}
+
+        self.grow(ranch, well, blocks)
+        create_farm(blocks_per_set=2, sets=2)  # another ranch's rows show up in unscoped choices
+        large = {name: self.count(url) for name, url in pages.items()}
+
+        self.assertEqual(large, small)
+        self.assertEqual(small, {
+            'home': 7, 'ranch_detail': 6, 'create_block': 5, 'create_irrigation_set': 4,
+            'create_irrigation_schedule': 5, 'create_water_meter_reading': 4, 'block_history': 6,
+            'ranch_allocation_status': 10, 'well_list': 6, 'create_well': 4, 'ranch_report': 5,
+            'irrigation_plan': 5, 'set_timetable': 7, 'energy_timetable': 7,
+        })
+
+class RanchScopedFormTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=2)
+        self.other, self.other_well, self.other_blocks = create_farm(blocks_per_set=3, sets=1)
+
+    def test_choices_are_limited_to_the_ranch(self):
+        form = IrrigationScheduleForm(ranch=self.ranch)
+        self.assertEqual(set(form.fields['blocks'].queryset), set(self.blocks))
+        self.assertEqual(list(form.fields['well'].queryset), [self.well])
+
+        form = BlockForm(ranch=self.ranch)
+        self.assertEqual(set(form.fields['set'].queryset), set(IrrigationSet.objects.filter(ranch=self.ranch)))
+        with self.assertNumQueries(2):  # set and well choices, labels included
+            form.as_p()
+
+        self.assertEqual(list(IrrigationSetForm(ranch=self.ranch).fields['ranch'].queryset), [self.ranch])
+
+    def test_blocks_of_another_ranch_are_rejected(self):
+        form = IrrigationScheduleForm({
+            'blocks': [self.blocks[0].id, self.other_blocks[0].id], 'minutes_needed': '60', 'leaching_factor': '10',
+        }, ranch=self.ranch)
+        self.assertFalse(form.is_valid())
+        self.assertIn('blocks', form.errors)
+
+    def test_create_block_keeps_the_chosen_set(self):
+        self.client.force_login(User.objects.create_user('grower', password='pw'))
+        second_set = IrrigationSet.objects.get(ranch=self.ranch, number=2)
+        self.client.post(reverse('create_block', args=[self.ranch.id]), {
+            'name': 'New', 'set': second_set.id, 'variety': 'Hass', 'acreage': '4', 'gpm': '40',
+            'has_crop_x': 'on', 'well': self.well.id,
+            'root_zone_depth': '2', 'available_water_capacity': '1.5', 'allowable_depletion': '50',
+        })
+        self.assertEqual(Block.objects.get(name='New').set, second_set)
+
+
+class SoilWaterBalanceTests(TestCase):
+    def setUp(self):
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=1)
+        Ranch.objects.filter(id=self.ranch.id).update(location='Fillmore')
+        self.start = date(2024, 6, 1)
+
+    def weather(self, days, eto='0.25', rain=None):
+        rain = rain or {}
+        for offset in range(days):
+            WeatherObservation.objects.create(
+                location='Fillmore', date=self.start + timedelta(days=offset), reference_evapotranspiration=Decimal(eto),
+                rainfall=Decimal(rain.get(offset, '0')), fetched_at=timezone.now(),
+            )
+
+    def test_prediction_follows_the_balance(self):
+        self.weather(4)
+        run_water_balance(self.start)
+        run_water_balance(self.start + timedelta(days=3))
+
+        # 4 days at 0.25 in leaves 1.0 in depleted; 50% of 3.0 in is allowed, so due in 2 days
+        state = SoilWaterState.objects.get(block=self.blocks[0])
+        self.assertEqual(state.depletion, Decimal('1.000'))
+        self.assertEqual(state.total_available_water, Decimal('3.000'))
+        self.assertEqual(state.next_irrigation_date, date(2024, 6, 6))
+        self.assertEqual(state.next_irrigation_inches, Decimal('1.500'))
+        self.assertAlmostEqual(float(state.next_irrigation_minutes), 1.5 / 0.85 * 27154 * 10 / 100, places=1)
+
+        # Already up to date: nothing left to simulate
+        self.assertEqual(run_water_balance(self.start + timedelta(days=3))[0], 0)
+
+    def test_rain_and_irrigation_refill_the_root_zone(self):
+        self.weather(10, rain={4: '5.00'})
+        create_history(self.blocks[0], self.start + timedelta(days=8), minutes=Decimal('600.00'))
+        run_water_balance(self.start + timedelta(days=4), rebuild_from=self.start)
+        self.assertEqual(SoilWaterState.objects.get(block=self.blocks[0]).depletion, Decimal('0.000'))
+
+        run_water_balance(self.start + timedelta(days=9))
+        states = {state.block_id: state.depletion for state in SoilWaterState.objects.all()}
+        self.assertEqual(states[self.blocks[1].id], Decimal('1.250'))
+        # 60,000 gallons over 10 acres is 0.221 in, of which 85% (0.188 in) reaches the roots
+        self.assertEqual(states[self.blocks[0].id], Decimal('1.062'))
+
+    def test_day_by_day_runs_match_a_single_run(self):
+        self.weather(10, eto='0.31', rain={2: '0.40', 6: '0.15'})
+        create_history(self.blocks[0], self.start + timedelta(days=5), minutes=Decimal('300.00'))
+        for offset in range(10):
+            run_water_balance(self.start + timedelta(days=offset))
+        incremental = list(SoilWaterState.objects.order_by('block').values_list('depletion', 'crop_et_rate', 'next_irrigation_date'))
+
+        # All blocks advance together in a fixed number of queries (three reads, two
+        # upserts and their savepoint)
+        with self.assertNumQueries(7):
+            run_water_balance(self.start + timedelta(days=9), rebuild_from=self.start)
+        single = list(SoilWaterState.objects.order_by('block').values_list('depletion', 'crop_et_rate', 'next_irrigation_date'))
+        self.assertEqual(incremental, single)
+
+    def test_schedules_default_to_the_predicted_irrigation(self):
+        self.weather(4)
+        run_water_balance(self.start + timedelta(days=3), rebuild_from=self.start)
+        template = IrrigationSchedule(reference_evapotranspiration=Decimal('0.25'), leaching_factor=Decimal('10.00'))
+        schedules = create_irrigation_schedules(Block.objects.filter(id=self.blocks[0].id), template)
+        state = SoilWaterState.objects.get(block=self.blocks[0])
+        self.assertEqual(schedules[0].minutes_needed, state.next_irrigation_minutes)
+        self.assertEqual(schedules[0].inches_needed, Decimal('1.500'))
+
+    def test_bulk_schedules_mark_the_soil_state_for_a_replay(self):
+        today = timezone.localdate()
+        WeatherObservation.objects.create(
+            location='Fillmore', date=today, reference_evapotranspiration=Decimal('0.25'), rainfall=0, fetched_at=timezone.now(),
+        )
+        run_water_balance(today, rebuild_from=today)
+        template = IrrigationSchedule(minutes_needed=Decimal('600.00'), leaching_factor=Decimal('10.00'))
+        create_irrigation_schedules(Block.objects.filter(id=self.blocks[0].id), template)
+        self.assertEqual(SoilWaterState.objects.get(block=self.blocks[0]).replay_from, today)
+        self.assertIsNone(SoilWaterState.objects.get(block=self.blocks[1]).replay_from)
+
+        run_water_balance(today)
+        replayed = SoilWaterState.objects.get(block=self.blocks[0])
+        self.assertIsNone(replayed.replay_from)
+        self.assertLess(replayed.depletion, SoilWaterState.objects.get(block=self.blocks[1]).depletion)
+
+    def test_late_history_replays_from_the_day_before(self):
+        self.weather(30, eto='0.08')
+        end = self.start + timedelta(days=29)
+        run_water_balance(end, rebuild_from=self.start)
+        before = SoilWaterState.objects.get(block=self.blocks[0]).depletion
+        self.assertEqual(before, Decimal('2.400'))
+
+        late = create_history(self.blocks[0], self.start + timedelta(days=25), minutes=Decimal('600.00'))
+        self.assertEqual(SoilWaterState.objects.get(block=self.blocks[0]).replay_from, late.date)
+        self.assertEqual(SoilWaterState.objects.get(block=self.blocks[1]).replay_from, None)
+        self.assertEqual(run_water_balance(end)[0], 1)
+        replayed = SoilWaterState.objects.get(block=self.blocks[0])
+        self.assertIsNone(replayed.replay_from)
+        # Seeded from the stored 2.000 in on day 24, not a full root zone: 2.4 less 0.188 in net
+        self.assertEqual(replayed.depletion, Decimal('2.212'))
+        self.assertEqual(SoilWaterBalance.objects.get(block=self.blocks[0], date=late.date).depletion, Decimal('1.892'))
+        run_water_balance(end, rebuild_from=self.start)
+        self.assertEqual(SoilWaterState.objects.get(block=self.blocks[0]).depletion, replayed.depletion)
+
+        late.delete()
+        run_water_balance(end)
+        self.assertEqual(SoilWaterState.objects.get(block=self.blocks[0]).depletion, before)
+
+
+class AllocationForecastTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=1)
+        self.day = date(2024, 12, 1)  # 30 days left in the season
+        # 60 minutes at 100 gpm every other day (4 times a week) on each block
+        Block.objects.update(has_crop_x=False, days_between_irrigations=2)
+        template = IrrigationSchedule(minutes_needed=Decimal('60.00'), leaching_factor=Decimal('10.00'))
+        create_irrigation_schedules(Block.objects.all(), template)
+        WaterMeterReading.objects.create(ranch=self.ranch, date=date(2024, 11, 1), acre_feet=Decimal('90.0000'),
+                                         gallons=Decimal('2443860.00'))
+
+    def test_projection_and_exceedance(self):
+        forecast = forecast_ranch(self.ranch, self.day, trials=2000)
+        daily = 2 * 6000 * 4 / 7 / 27154
+        self.assertEqual(forecast['days_remaining'], 30)
+        self.assertEqual(forecast['used'], 90.0)
+        self.assertAlmostEqual(forecast['expected'], 90 + daily * 30, delta=0.1)
+        self.assertLess(forecast['p10'], forecast['p50'])
+        self.assertLess(forecast['p50'], forecast['p90'])
+        self.assertLess(forecast['exceed_probability'], 0.05)
+
+        Ranch.objects.filter(id=self.ranch.id).update(allocation=Decimal('90.00') + Decimal(str(round(daily * 30, 2))))
+        self.ranch.refresh_from_db()
+        self.assertGreater(forecast_ranch(self.ranch, self.day, trials=2000)['exceed_probability'], 0.2)
+        self.assertLess(forecast_ranch(self.ranch, self.day, trials=2000)['exceed_probability'], 0.8)
+
+    def test_cached_until_new_usage_arrives(self):
+        first = forecast_ranch(self.ranch, self.day, trials=500)
+        with self.assertNumQueries(2):
+            self.assertEqual(forecast_ranch(self.ranch, self.day, trials=500), first)
+
+        WaterMeterReading.objects.create(ranch=self.ranch, date=date(2024, 11, 2), acre_feet=Decimal('5.0000'),
+                                         gallons=Decimal('135770.00'))
+        # Last season's use does not count against this one
+        WaterMeterReading.objects.create(ranch=self.ranch, date=date(2023, 12, 31), acre_feet=Decimal('7.0000'),
+                                         gallons=Decimal('190078.00'))
+        second = forecast_ranch(self.ranch, self.day, trials=500)
+        self.assertEqual(second['used'], 95.0)
+
+        # Block settings and new schedules start a fresh forecast too
+        Block.objects.filter(id=self.blocks[0].id).update(gpm=Decimal('200.00'))
+        third = forecast_ranch(self.ranch, self.day, trials=500)
+        self.assertNotEqual(third['expected'], second['expected'])
+        create_irrigation_schedules(Block.objects.filter(id=self.blocks[0].id),
+                                    IrrigationSchedule(minutes_needed=Decimal('120.00'), leaching_factor=Decimal('10.00')))
+        self.assertGreater(forecast_ranch(self.ranch, self.day, trials=500)['expected'], third['expected'])
+
+    @override_settings(FORECAST_WORKERS=2)
+    def test_process_pool_matches_inline(self):
+        other, _, _ = create_farm(blocks_per_set=1, sets=1)
+        pooled = forecast_ranches([self.ranch, other], self.day, trials=500)
+        cache.clear()
+        with override_settings(FORECAST_WORKERS=1):
+            self.assertEqual(forecast_ranches([self.ranch, other], self.day, trials=500), pooled)
+
+
+class TopologyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=2)
+
+    def test_index_answers_without_queries(self):
+        with self.assertNumQueries(4):
+            topology = get_topology(self.ranch.id)
+        with self.assertNumQueries(0):
+            topology = get_topology(self.ranch.id)
+            self.assertEqual([str(block) for block in topology.ordered_blocks()][0], 'Block 1-0 - Hass - Set 1')
+            self.assertEqual(str(topology.set_of(self.blocks[3].id)), 'Set 2 - North')
+            self.assertEqual(topology.well_of(self.blocks[0].id), self.well)
+            self.assertEqual(len(topology.blocks_by_well[self.well.id]), 4)
+            self.assertEqual(topology.connected_gpm[self.well.id], Decimal('400.00'))
+            self.assertEqual(topology.acreage, Decimal('40.00'))
+
+    def test_signals_replace_the_version(self):
+        before = get_topology(self.ranch.id)
+        Block.objects.create(name='New', set=before.set_of(self.blocks[0].id), variety='Hass', acreage=Decimal('2.00'),
+                             gpm=Decimal('25.00'), well=self.well)
+        after = get_topology(self.ranch.id)
+        self.assertNotEqual(after.version, before.version)
+        self.assertEqual(after.connected_gpm[self.well.id], Decimal('425.00'))
+
+        Well.objects.filter(id=self.well.id).update(gpm=Decimal('900.00'))  # no signal
+        self.assertIs(get_topology(self.ranch.id), after)
+        Ranch.objects.filter(id=self.ranch.id).first().save()
+        self.assertEqual(get_topology(self.ranch.id).wells[self.well.id].gpm, Decimal('900.00'))
+
+    def test_entries_expire_without_a_signal(self):
+        # Another worker's write never reaches a per-process cache; age catches it
+        topology = get_topology(self.ranch.id)
+        Well.objects.filter(id=self.well.id).update(gpm=Decimal('900.00'))
+        with override_settings(TOPOLOGY_MAX_AGE=0):
+            rebuilt = get_topology(self.ranch.id)
+        self.assertEqual(rebuilt.version, topology.version)
+        self.assertEqual(rebuilt.wells[self.well.id].gpm, Decimal('900.00'))
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ranch, self.well, self.blocks = create_farm(blocks_per_set=2, sets=2)
+        for block in self.blocks:
+            create_history(block, timezone.localdate())
+        WaterMeterReading.objects.create(ranch=self.ranch, well=self.well, date=timezone.localdate(),
+                                         gallons=Decimal('27154.00'), acre_feet=Decimal('1.0000'))
+        self.user = User.objects.create_user('grower', password='pw')
+        self.client.force_login(self.user)
+
+    def request(self, path='/'):
+        request = AsyncRequestFactory().get(path)
+        request.user = self.user
+
+        async def auser():
+            return self.user
+        request.auser = auser
+        return request
+
+    async def test_pages_match_the_sync_views(self):
+        pages = [
+            ('home', async_views.home, []),
+            ('ranch_detail', async_views.ranch_detail, [self.ranch.id]),
+            ('block_history', async_views.block_history, [self.blocks[0].id]),
+            ('ranch_allocation_status', async_views.ranch_allocation_status, [self.ranch.id]),
+            ('well_list', async_views.well_list, [self.ranch.id]),
+        ]
+        for name, view, args in pages:
+            expected = await sync_to_async(self.client.get)(reverse(name, args=args))
+            response = await view(self.request(), *args)
+            self.assertEqual(response.status_code, 200, name)
+            self.assertEqual(response.content.decode(), expected.content.decode(), name)
+
+        response = await async_views.ranch_report(self.request(), self.ranch.id)
+        self.assertContains(response, '1-0')
+
+    async def test_missing_objects_are_404(self):
+        with self.assertRaises(Http404):
+            await async_views.block_history(self.request(), 999)
+        with self.assertRaises(Http404):
+            await async_views.ranch_allocation_status(self.request(), 999)
+        response = await async_views.block_history(self.request('/?before=junk'), self.blocks[0].id)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_middleware_records_async_views(self):
+        registry.reset()
+
+        async def view(request):
+            return HttpResponse(str(await Block.objects.acount()))
+
+        middleware = MetricsMiddleware(view)
+        response = await middleware(self.request())
+        self.assertEqual(response.content, b'4')
+        self.assertEqual(registry.count['<unresolved>'], 1)
+        self.assertEqual(registry.queries['<unresolved>'], 1)
+
+class LoadTestCommandTests(LiveServerTestCase):
+    def test_reports_each_page(self):
+        create_farm(blocks_per_set=2, sets=1)
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            call_command('loadtest', '--target', f'live={self.live_server_url}', '--duration', '0.5',
+                         '--concurrency', '2', '--output', output.name, stdout=StringIO(), stderr=StringIO())
+            results = json.load(output)
+
+        live = results['targets']['live']
+        self.assertEqual(live['errors'], 0)
+        self.assertGreater(live['requests'], 0)
+        self.assertEqual(set(live['pages']), {'home', 'ranch_detail', 'block_history', 'ranch_allocation_status',
+                                              'well_list', 'ranch_report'})
+        self.assertFalse(User.objects.filter(username='loadtest').exists())
+        self.assertFalse(Session.objects.exists())
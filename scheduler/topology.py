@@ -0,0 +1,120 @@
+import threading
+import time
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+
+from .models import Block, IrrigationSet, Ranch, Well
+
+# In-process index of each ranch's layout: its sets, blocks and wells with the
+# relations between them already attached, so Block.set, Block.well and
+# IrrigationSet.ranch never hit the database. Each process keeps its own copy,
+# tagged with the ranch's version token from Django's cache; model signals
+# replace the token, and the next lookup notices the mismatch and rebuilds
+# (four queries). The token only reaches other processes when the default cache
+# is shared between them; with the per-process locmem cache a change made in
+# one worker is not seen by the others, so every entry is also rebuilt once it
+# is older than TOPOLOGY_MAX_AGE seconds. Bulk writes skip the signals and must
+# call invalidate_topology themselves.
+#
+# The indexed objects are shared across requests: read them, don't modify them.
+
+class Topology:
+    def __init__(self, ranch, sets, blocks, wells, version):
+        self.ranch = ranch
+        self.version = version
+        self.built_at = time.monotonic()
+        self.sets = {irrigation_set.id: irrigation_set for irrigation_set in sets}
+        self.blocks = {block.id: block for block in blocks}
+        self.wells = {well.id: well for well in wells}
+        self.blocks_by_set = defaultdict(list)
+        self.blocks_by_well = defaultdict(list)
+        self.connected_gpm = defaultdict(Decimal)  # well id -> gpm of the blocks it feeds
+        self.acreage_by_set = defaultdict(Decimal)
+        self.acreage_by_well = defaultdict(Decimal)
+        for block in blocks:
+            self.blocks_by_set[block.set_id].append(block)
+            self.acreage_by_set[block.set_id] += block.acreage
+            if block.well_id is not None:
+                self.blocks_by_well[block.well_id].append(block)
+                self.connected_gpm[block.well_id] += block.gpm
+                self.acreage_by_well[block.well_id] += block.acreage
+        self.acreage = sum(self.acreage_by_set.values(), Decimal('0'))
+
+    def ordered_blocks(self):
+        # In set order, then by name, like the irrigation plan
+        return [block for irrigation_set in self.sets.values() for block in self.blocks_by_set[irrigation_set.id]]
+
+    def set_of(self, block_id):
+        return self.sets[self.blocks[block_id].set_id]
+
+    def well_of(self, block_id):
+        return self.wells.get(self.blocks[block_id].well_id)
+
+def topology_key(ranch_id):
+    return f'scheduler:topology:{ranch_id}'
+
+def _version(ranch_id):
+    # Current token of a ranch; a missing one (never set or evicted) is replaced,
+    # which only costs a rebuild
+    key = topology_key(ranch_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+def build_topology(ranch, version=None):
+    sets = list(IrrigationSet.objects.filter(ranch=ranch).order_by('number', 'id'))
+    wells = list(Well.objects.filter(ranch=ranch).order_by('name', 'id'))
+    sets_by_id = {irrigation_set.id: irrigation_set for irrigation_set in sets}
+    wells_by_id = {well.id: well for well in wells}
+    for obj in sets + wells:
+        obj.ranch = ranch
+    blocks = list(Block.objects.filter(set__ranch=ranch).order_by('name', 'id'))
+    for block in blocks:
+        block.set = sets_by_id[block.set_id]
+        # A block may point at another ranch's well; that one is loaded on access
+        if block.well_id in wells_by_id:
+            block.well = wells_by_id[block.well_id]
+    return Topology(ranch, sets, blocks, wells, version)
+
+_index = {}
+_lock = threading.Lock()
+
+def _max_age():
+    return getattr(settings, 'TOPOLOGY_MAX_AGE', 60)
+
+def get_topology(ranch_id):
+    # Current topology of a ranch, rebuilt when its version has moved on or it
+    # has outlived TOPOLOGY_MAX_AGE. Raises Http404 for a ranch that does not exist.
+    version = _version(ranch_id)
+    with _lock:
+        topology = _index.get(ranch_id)
+    if topology is not None and topology.version == version and time.monotonic() - topology.built_at < _max_age():
+        return topology
+    ranch = Ranch.objects.filter(id=ranch_id).first()
+    if ranch is None:
+        raise Http404('Ranch not found')
+    topology = build_topology(ranch, version)
+    with _lock:
+        _index[ranch_id] = topology
+    return topology
+
+def invalidate_topology(ranch_ids):
+    # New version tokens now, and again once the surrounding transaction
+    # commits, so a rebuild racing the write cannot keep the old layout
+    keys = [topology_key(ranch_id) for ranch_id in set(ranch_ids) if ranch_id is not None]
+    if not keys:
+        return
+
+    def bump():
+        cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+    bump()
+    transaction.on_commit(bump)
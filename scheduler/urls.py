@@ -1,17 +1,32 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Read-only pages have async versions for ASGI deployments
+read_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('register/', views.register, name='register'),
     path('create/', views.create_ranch, name='create_ranch'),
-    path('ranch/<int:ranch_id>/', views.ranch_detail, name='ranch_detail'),
+    path('ranch/<int:ranch_id>/', read_views.ranch_detail, name='ranch_detail'),
     path('ranch/<int:ranch_id>/block/create/', views.create_block, name='create_block'),
     path('ranch/<int:ranch_id>/set/create/', views.create_irrigation_set, name='create_irrigation_set'),
     path('ranch/<int:ranch_id>/schedule/create/', views.create_irrigation_schedule, name='create_irrigation_schedule'),
-    path('block/<int:block_id>/history/', views.block_history, name='block_history'),
+    path('block/<int:block_id>/history/', read_views.block_history, name='block_history'),
+    path('block/<int:block_id>/history.json', views.block_history_json, name='block_history_json'),
     path('water-meter-reading/create/', views.create_water_meter_reading, name='create_water_meter_reading'),
-    path('ranch/<int:ranch_id>/allocation-status/', views.ranch_allocation_status, name='ranch_allocation_status'),
+    path('ranch/<int:ranch_id>/allocation-status/', read_views.ranch_allocation_status, name='ranch_allocation_status'),
     path('well/create/<int:ranch_id>/', views.create_well, name='create_well'),
-    path('well/<int:ranch_id>/', views.well_list, name='well_list'),
-    path('ranch/<int:ranch_id>/report/', views.ranch_report, name='ranch_report'),
+    path('well/<int:ranch_id>/', read_views.well_list, name='well_list'),
+    path('ranch/<int:ranch_id>/report/', read_views.ranch_report, name='ranch_report'),
+    path('ranch/<int:ranch_id>/plan/', views.irrigation_plan, name='irrigation_plan'),
+    path('ranch/<int:ranch_id>/plan.json', views.irrigation_plan_json, name='irrigation_plan_json'),
+    path('ranch/<int:ranch_id>/timetable/', views.set_timetable, name='set_timetable'),
+    path('weather/refresh/', views.refresh_eto, name='refresh_eto'),
+    path('ranch/<int:ranch_id>/report/export.<str:fmt>', views.export_ranch_report, name='export_ranch_report'),
+    path('ranch/<int:ranch_id>/report/download/', views.download_report, name='download_report'),
+    path('block/<int:block_id>/history/export.<str:fmt>', views.export_block_history, name='export_block_history'),
+    path('ranch/<int:ranch_id>/meter-readings/export.<str:fmt>', views.export_meter_readings, name='export_meter_readings'),
+    path('ranch/<int:ranch_id>/import/', views.import_data, name='import_data'),
+    path('telemetry/', views.ingest_telemetry, name='ingest_telemetry'),
 ]
@@ -1,21 +1,125 @@
-import requests
+from decimal import Decimal
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce, ExtractYear
 from django.utils import timezone
-from datetime import timedelta
-from .models import IrrigationHistory
+from datetime import date, timedelta
+from .models import DailyWaterUsage, IrrigationHistory
+from .weather import get_backend
+
+GALLONS_PER_ACRE_FOOT = 27154  # 1 acre-foot = 27154 gallons (as used throughout the app)
 
 def get_weather_data(api_key, location):
-    url = f"https://api.davissystems.com/weather?location={location}&key={api_key}"
-    response = requests.get(url)
-    return response.json()
+    return get_backend(api_key).fetch(location)
 
-def get_weekly_water_usage(block):
+def fill_volume(gallons, acre_feet):
+    # Derive whichever of gallons / acre-feet is missing from the other
+    if gallons and not acre_feet:
+        acre_feet = (gallons / GALLONS_PER_ACRE_FOOT).quantize(Decimal('0.0001'))
+    if acre_feet and not gallons:
+        gallons = (acre_feet * GALLONS_PER_ACRE_FOOT).quantize(Decimal('0.01'))
+    return gallons, acre_feet
+
+def _total(field):
+    return Coalesce(Sum(field), Value(Decimal('0')), output_field=DecimalField())
+
+def _usage_rows(ranch=None, well=None, block=None, from_date=None, to_date=None):
+    usage = DailyWaterUsage.objects.all()
+    if ranch is not None:
+        usage = usage.filter(ranch=ranch)
+    if well is not None:
+        usage = usage.filter(well=well)
+    if block is not None:
+        usage = usage.filter(block=block)
+    if from_date is not None:
+        usage = usage.filter(date__gte=from_date)
+    if to_date is not None:
+        usage = usage.filter(date__lte=to_date)
+    return usage
+
+def _applied_totals():
+    return {'gallons': _total('gallons'), 'acre_feet': _total('acre_feet'), 'minutes': _total('minutes')}
+
+def _metered_totals():
+    return {'gallons': _total('gallons'), 'acre_feet': _total('acre_feet')}
+
+def get_water_usage(ranch=None, well=None, block=None, from_date=None, to_date=None):
+    # Applied water (IrrigationHistory), summed from the daily rollup.
+    usage = _usage_rows(ranch, well, block, from_date, to_date).filter(block__isnull=False)
+    return usage.aggregate(**_applied_totals())
+
+async def aget_water_usage(ranch=None, well=None, block=None, from_date=None, to_date=None):
+    usage = _usage_rows(ranch, well, block, from_date, to_date).filter(block__isnull=False)
+    return await usage.aaggregate(**_applied_totals())
+
+def get_metered_usage(ranch=None, well=None, from_date=None, to_date=None):
+    # Metered water (WaterMeterReading), summed from the daily rollup.
+    usage = _usage_rows(ranch, well, None, from_date, to_date).filter(block__isnull=True)
+    return usage.aggregate(**_metered_totals())
+
+async def aget_metered_usage(ranch=None, well=None, from_date=None, to_date=None):
+    usage = _usage_rows(ranch, well, None, from_date, to_date).filter(block__isnull=True)
+    return await usage.aaggregate(**_metered_totals())
+
+def _this_week():
     today = timezone.now().date()
     start_of_week = today - timedelta(days=today.weekday())  # Monday of this week
     end_of_week = start_of_week + timedelta(days=6)  # Sunday of this week
+    return start_of_week, end_of_week
+
+def get_weekly_water_usage(block):
+    start_of_week, end_of_week = _this_week()
+    usage = get_water_usage(block=block, from_date=start_of_week, to_date=end_of_week)
+
+    return usage['gallons'], usage['acre_feet']
+
+async def aget_weekly_water_usage(block):
+    start_of_week, end_of_week = _this_week()
+    usage = await aget_water_usage(block=block, from_date=start_of_week, to_date=end_of_week)
+    return usage['gallons'], usage['acre_feet']
+
+
+HISTORY_PAGE_SIZE = 50
+
+def encode_history_cursor(history):
+    return f"{history.date.isoformat()}.{history.id}"
+
+def decode_history_cursor(cursor):
+    # Raises ValueError for a malformed cursor
+    day, history_id = cursor.split('.')
+    return date.fromisoformat(day), int(history_id)
+
+def _history_page_rows(block, cursor, page_size):
+    # Keyset pagination on (date, id), newest first. The (block, date) index keeps
+    # every page the same cost however much history the block has.
+    histories = IrrigationHistory.objects.filter(block=block).select_related('well').order_by('-date', '-id')
+    if cursor:
+        before_date, before_id = decode_history_cursor(cursor)
+        histories = histories.filter(Q(date__lt=before_date) | Q(date=before_date, id__lt=before_id))
+    return histories[:page_size + 1]
+
+def _split_page(page, page_size):
+    next_cursor = encode_history_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
+
+def get_history_page(block, cursor=None, page_size=HISTORY_PAGE_SIZE):
+    return _split_page(list(_history_page_rows(block, cursor, page_size)), page_size)
+
+async def aget_history_page(block, cursor=None, page_size=HISTORY_PAGE_SIZE):
+    page = [history async for history in _history_page_rows(block, cursor, page_size)]
+    return _split_page(page, page_size)
+
+def _season_rows(block):
+    # Per-season (calendar year) totals for a block, aggregated in the database from the daily rollup
+    return (
+        DailyWaterUsage.objects.filter(block=block)
+        .annotate(season=ExtractYear('date'))
+        .values('season')
+        .annotate(irrigation_days=Count('date', distinct=True), **_applied_totals())
+        .order_by('-season')
+    )
 
-    histories = IrrigationHistory.objects.filter(block=block, date__range=[start_of_week, end_of_week])
-    
-    total_gallons = sum(h.gallons_used for h in histories)
-    total_acre_feet = sum(h.acre_feet_used for h in histories)
+def get_season_summaries(block):
+    return list(_season_rows(block))
 
-    return total_gallons, total_acre_feet
\ No newline at end of file
+async def aget_season_summaries(block):
+    return [season async for season in _season_rows(block)]
@@ -1,9 +1,30 @@
-from django.shortcuts import render, redirect
+import io
+import json
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from .exports import EXPORT_FORMATS, block_history_rows, export_response, meter_reading_rows, ranch_report_rows
 from .forms import *
 from .models import *
 from .utils import *
+from .reports import build_ranch_report, request_report
+from .optimizer import optimize_ranch_sets
+from .energy import energy_schedule
+from .topology import get_topology
+from .scheduler import create_irrigation_schedules, generate_irrigation_schedule
+from .weather import arefresh_reference_et
+from .importers import IMPORTERS
+from .telemetry import get_buffer, parse_batch
+from .metrics import registry
+from .dashboard import get_dashboard, get_dashboards, get_ranch_index
+from .forecast import forecast_ranch
+
+RECENT_READINGS = 100
 
 def register(request):
     if request.method == 'POST':
@@ -18,8 +39,11 @@ def register(request):
 
 @login_required
 def home(request):
-    ranches = Ranch.objects.all()
-    return render(request, 'scheduler/home.html', {'ranches': ranches})
+    ranches = get_ranch_index()
+    dashboards = get_dashboards([ranch_id for ranch_id, _ in ranches])
+    return render(request, 'scheduler/home.html', {
+        'ranches': [dashboards[ranch_id] for ranch_id, _ in ranches if ranch_id in dashboards],
+    })
 
 @login_required
 def create_ranch(request):
@@ -34,83 +58,98 @@ def create_ranch(request):
 
 @login_required
 def ranch_detail(request, ranch_id):
-    ranch = Ranch.objects.get(id=ranch_id)
-    blocks = Block.objects.filter(set__ranch=ranch)
-    return render(request, 'scheduler/ranch_detail.html', {'ranch': ranch, 'blocks': blocks})
+    # Served from the cached dashboard summary; see scheduler/dashboard.py
+    ranch = get_dashboard(ranch_id)
+    if ranch is None:
+        raise Http404('Ranch not found')
+    return render(request, 'scheduler/ranch_detail.html', {'ranch': ranch, 'blocks': ranch['blocks']})
 
 @login_required
 def create_block(request, ranch_id):
-    ranch = Ranch.objects.get(id=ranch_id)
+    ranch = get_object_or_404(Ranch, id=ranch_id)
     if request.method == 'POST':
-        block_form = BlockForm(request.POST)
+        block_form = BlockForm(request.POST, ranch=ranch)
         if block_form.is_valid():
-            block = block_form.save(commit=False)
-            block.set = ranch.irrigation_sets.first()  # Or however you determine the set
-            block.save()
+            block_form.save()
             return redirect('ranch_detail', ranch_id=ranch.id)
     else:
-        block_form = BlockForm()
+        block_form = BlockForm(ranch=ranch)
     return render(request, 'scheduler/create_block.html', {'block_form': block_form, 'ranch': ranch})
 
 @login_required
 def create_irrigation_set(request, ranch_id):
-    ranch = Ranch.objects.get(id=ranch_id)
+    ranch = get_object_or_404(Ranch, id=ranch_id)
     if request.method == 'POST':
-        set_form = IrrigationSetForm(request.POST)
+        set_form = IrrigationSetForm(request.POST, ranch=ranch)
         if set_form.is_valid():
             set_form.save()
             return redirect('ranch_detail', ranch_id=ranch.id)
     else:
-        set_form = IrrigationSetForm(initial={'ranch': ranch})
+        set_form = IrrigationSetForm(initial={'ranch': ranch}, ranch=ranch)
     return render(request, 'scheduler/create_irrigation_set.html', {'set_form': set_form, 'ranch': ranch})
 
 @login_required
 def create_irrigation_schedule(request, ranch_id):
-    ranch = Ranch.objects.get(id=ranch_id)
-    blocks = Block.objects.filter(set__ranch=ranch)
+    ranch = get_object_or_404(Ranch, id=ranch_id)
+    blocks = Block.objects.for_ranch(ranch).with_relations()
 
     if request.method == 'POST':
-        schedule_form = IrrigationScheduleForm(request.POST)
+        schedule_form = IrrigationScheduleForm(request.POST, ranch=ranch)
         if schedule_form.is_valid():
-            for block in schedule_form.cleaned_data['blocks']:
-                schedule = schedule_form.save(commit=False)
-                schedule.block = block
-                if not schedule.minutes_needed:
-                    schedule.minutes_needed = schedule.calculate_irrigation_time()
-                schedule.hours_needed = schedule.minutes_needed / 60
-                schedule.save()
-
-                # Calculate gallons and acre-feet used
-                gallons_used = float(block.gpm) * float(schedule.minutes_needed)
-                acre_feet_used = gallons_used / 27154  # 1 acre-foot = 27154 gallons
-
-                # Save historical data
-                IrrigationHistory.objects.create(
-                    block=block,
-                    minutes_irrigated=schedule.minutes_needed,
-                    gallons_used=gallons_used,
-                    acre_feet_used=acre_feet_used,
-                    days_between_irrigations=block.days_between_irrigations if not block.has_crop_x else None,
-                    interval_between_irrigations=block.interval_between_irrigations if block.has_crop_x else None,
-                    well=schedule.well
-                )
+            create_irrigation_schedules(schedule_form.cleaned_data['blocks'], schedule_form.save(commit=False))
             return redirect('ranch_detail', ranch_id=ranch.id)
     else:
-        schedule_form = IrrigationScheduleForm()
+        schedule_form = IrrigationScheduleForm(ranch=ranch)
 
     return render(request, 'scheduler/create_irrigation_schedule.html', {'schedule_form': schedule_form, 'ranch': ranch, 'blocks': blocks})
 
 @login_required
 def block_history(request, block_id):
-    block = Block.objects.get(id=block_id)
-    histories = IrrigationHistory.objects.filter(block=block).order_by('-date')
+    block = get_object_or_404(Block.objects.with_relations(), id=block_id)
+    try:
+        histories, next_cursor = get_history_page(block, request.GET.get('before'))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
     weekly_gallons, weekly_acre_feet = get_weekly_water_usage(block)
+    # 'block' is reserved inside {% block %} tags, so the template gets 'irrigation_block'
     return render(request, 'scheduler/block_history.html', {
-        'block': block,
+        'irrigation_block': block,
         'histories': histories,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('before'),
+        'seasons': get_season_summaries(block),
         'weekly_gallons': weekly_gallons,
         'weekly_acre_feet': weekly_acre_feet
-    })    
+    })
+
+@login_required
+def block_history_json(request, block_id):
+    block = get_object_or_404(Block, id=block_id)
+    try:
+        histories, next_cursor = get_history_page(block, request.GET.get('before'))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    data = {
+        'block': block.id,
+        'histories': [
+            {
+                'id': history.id,
+                'date': history.date.isoformat(),
+                'minutes_irrigated': str(history.minutes_irrigated),
+                'gallons_used': str(history.gallons_used),
+                'acre_feet_used': str(history.acre_feet_used),
+                'well': history.well.name if history.well else None,
+            }
+            for history in histories
+        ],
+        'next': next_cursor,
+    }
+    if not request.GET.get('before'):
+        data['seasons'] = [
+            {key: str(value) if isinstance(value, Decimal) else value for key, value in season.items()}
+            for season in get_season_summaries(block)
+        ]
+    return JsonResponse(data)
 
 @login_required
 def create_water_meter_reading(request):
@@ -125,63 +164,233 @@ def create_water_meter_reading(request):
 
 @login_required
 def ranch_allocation_status(request, ranch_id):
-    ranch = Ranch.objects.get(id=ranch_id)
-    readings = WaterMeterReading.objects.filter(ranch=ranch).order_by('-date')
+    ranch = get_object_or_404(Ranch, id=ranch_id)
+    readings = WaterMeterReading.objects.for_ranch(ranch).with_relations().order_by('-date')[:RECENT_READINGS]
 
-    total_gallons = sum(r.gallons for r in readings if r.gallons is not None)
-    total_acre_feet = sum(r.acre_feet for r in readings if r.acre_feet is not None)
+    usage = get_metered_usage(ranch=ranch)
+    total_gallons = usage['gallons']
+    total_acre_feet = usage['acre_feet']
 
     return render(request, 'scheduler/ranch_allocation_status.html', {
         'ranch': ranch,
         'readings': readings,
         'total_gallons': total_gallons,
         'total_acre_feet': total_acre_feet,
-        'allocation_remaining': ranch.allocation - total_acre_feet
+        'allocation_remaining': ranch.allocation - total_acre_feet,
+        'forecast': forecast_ranch(ranch),
     })
 
 @login_required
 def create_well(request, ranch_id):
+    ranch = get_object_or_404(Ranch, id=ranch_id)
     if request.method == 'POST':
-        form = WellForm(request.POST)
+        form = WellForm(request.POST, ranch=ranch)
         if form.is_valid():
             form.save()
             return redirect('well_list', ranch_id=ranch_id)
     else:
-        initial = {'ranch': ranch_id} if ranch_id else {}
-        form = WellForm(initial=initial)
+        form = WellForm(initial={'ranch': ranch}, ranch=ranch)
     return render(request, 'scheduler/create_well.html', {'form': form})
 
 @login_required
 def well_list(request, ranch_id):
-    ranch = Ranch.objects.get(id=ranch_id)
-    wells = Well.objects.filter(ranch=ranch)
-    return render(request, 'scheduler/well_list.html', {'ranch': ranch, 'wells': wells})
+    topology = get_topology(ranch_id)
+    return render(request, 'scheduler/well_list.html', {'ranch': topology.ranch, 'wells': well_rows(topology)})
+
+def well_rows(topology):
+    return [{
+        'well': well,
+        'blocks': len(topology.blocks_by_well[well.id]),
+        'connected_gpm': topology.connected_gpm[well.id],
+        'acreage': topology.acreage_by_well[well.id],
+    } for well in topology.wells.values()]
 
 @login_required
 def ranch_report(request, ranch_id):
-    ranch = Ranch.objects.get(id=ranch_id)
+    ranch = get_object_or_404(Ranch, id=ranch_id)
+    from_date = timezone.now().date() - timedelta(days=7)
+    to_date = timezone.now().date()
     if request.method == 'POST':
         form = DateRangeForm(request.POST)
         if form.is_valid():
             from_date = form.cleaned_data['from_date']
             to_date = form.cleaned_data['to_date']
     else:
-        from_date = timezone.now().date() - timedelta(days=7)
-        to_date = timezone.now().date()
         form = DateRangeForm(initial={'from_date': from_date, 'to_date': to_date})
 
-    histories = IrrigationHistory.objects.filter(block__set__ranch=ranch, date__range=[from_date, to_date]).order_by('date', 'block__set', 'block')
+    report_data = build_ranch_report(ranch, from_date, to_date)
 
-    report_data = []
-    for date in (from_date + timedelta(days=n) for n in range((to_date - from_date).days + 1)):
-        day_histories = histories.filter(date=date)
-        if day_histories.exists():
-            day_data = {
-                'date': date,
-                'day': date.strftime('%A'),
-                'histories': day_histories
-            }
-            report_data.append(day_data)
+    return render(request, 'scheduler/ranch_report.html', {
+        'ranch': ranch, 'report_data': report_data, 'form': form, 'from_date': from_date, 'to_date': to_date,
+    })
+
+@login_required
+def irrigation_plan(request, ranch_id):
+    ranch = get_object_or_404(Ranch, id=ranch_id)
+    plan = generate_irrigation_schedule(ranch)
+    return render(request, 'scheduler/irrigation_plan.html', {'ranch': ranch, 'plan': plan})
+
+def _plan_row_json(row):
+    state = row['next_irrigation']
+    next_irrigation = None
+    if state is not None and state.next_irrigation_date:
+        next_irrigation = {
+            'date': state.next_irrigation_date.isoformat(),
+            'inches': float(state.next_irrigation_inches),
+            'minutes': float(state.next_irrigation_minutes) if state.next_irrigation_minutes is not None else None,
+            'depletion': float(state.depletion),
+        }
+    return {
+        'block_id': row['block'].id,
+        'block': row['block'].name,
+        'set': row['set_number'],
+        'well': row['well'].name if row['well'] else None,
+        'schedule_id': row['schedule'].id if row['schedule'] else None,
+        'minutes': float(row['irrigation_time']) if row['irrigation_time'] is not None else None,
+        'hours': row['hours'],
+        'gallons': row['gallons'],
+        'irrigations_per_week': row['irrigations_per_week'],
+        'weekly_gallons': row['weekly_gallons'],
+        'fertilization': row['fertilization'],
+        'next_irrigation': next_irrigation,
+    }
+
+@login_required
+def irrigation_plan_json(request, ranch_id):
+    ranch = get_object_or_404(Ranch, id=ranch_id)
+
+    def stream():
+        yield '{"ranch": %s, "plan": [' % json.dumps(ranch.name)
+        for i, row in enumerate(generate_irrigation_schedule(ranch)):
+            yield (',' if i else '') + json.dumps(_plan_row_json(row))
+        yield ']}'
+
+    return StreamingHttpResponse(stream(), content_type='application/json')
+
+@login_required
+def set_timetable(request, ranch_id):
+    ranch = get_topology(ranch_id).ranch
+    if request.GET.get('mode') == 'energy':
+        timetable = energy_schedule(ranch)
+        return render(request, 'scheduler/energy_timetable.html', {'ranch': ranch, 'timetable': timetable})
+    timetable = optimize_ranch_sets(ranch)
+    return render(request, 'scheduler/set_timetable.html', {'ranch': ranch, 'timetable': timetable})
+
+async def refresh_eto(request):
+    # Async: fetches every ranch location concurrently when served under ASGI
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    observations = await arefresh_reference_et()
+    return JsonResponse({'observations': [
+        {
+            'location': observation.location,
+            'date': observation.date.isoformat(),
+            'reference_evapotranspiration': str(observation.reference_evapotranspiration),
+            'rainfall': str(observation.rainfall),
+        }
+        for observation in observations
+    ]})
+
+def _export_dates(request):
+    # Date range from ?from_date=&to_date=, defaulting to the last week like ranch_report
+    form = DateRangeForm(request.GET)
+    if form.is_valid():
+        return form.cleaned_data['from_date'], form.cleaned_data['to_date']
+    return timezone.now().date() - timedelta(days=7), timezone.now().date()
+
+@login_required
+def export_ranch_report(request, ranch_id, fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise Http404('Unknown export format')
+    ranch = get_object_or_404(Ranch, id=ranch_id)
+    from_date, to_date = _export_dates(request)
+    return export_response(
+        ranch_report_rows(ranch, from_date, to_date), fmt,
+        f'ranch-{ranch.id}-report-{from_date}-{to_date}', f'Report for Ranch: {ranch.name} ({from_date} to {to_date})',
+    )
+
+@login_required
+def export_block_history(request, block_id, fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise Http404('Unknown export format')
+    block = get_object_or_404(Block, id=block_id)
+    return export_response(block_history_rows(block), fmt, f'block-{block.id}-history', f'History for Block: {block.name}')
+
+@login_required
+def export_meter_readings(request, ranch_id, fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise Http404('Unknown export format')
+    ranch = get_object_or_404(Ranch, id=ranch_id)
+    form = DateRangeForm(request.GET)
+    from_date, to_date = (form.cleaned_data['from_date'], form.cleaned_data['to_date']) if form.is_valid() else (None, None)
+    return export_response(
+        meter_reading_rows(ranch, from_date, to_date), fmt,
+        f'ranch-{ranch.id}-meter-readings', f'Meter Readings for {ranch.name}',
+    )
+
+@login_required
+def download_report(request, ranch_id):
+    # PDF report rendered in the background and reused until the ranch gets new history
+    ranch = get_object_or_404(Ranch, id=ranch_id)
+    from_date, to_date = _export_dates(request)
+    artifact = request_report(ranch, from_date, to_date)
+    if artifact.status != ReportArtifact.READY:
+        return render(request, 'scheduler/report_pending.html', {
+            'ranch': ranch, 'artifact': artifact, 'from_date': from_date, 'to_date': to_date,
+        }, status=202)
+    etag = f'"{artifact.content_hash}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponse(status=304)
+    response = HttpResponse(bytes(artifact.content), content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="ranch-{ranch.id}-report-{from_date}-{to_date}.pdf"'
+    response['ETag'] = etag
+    return response
+
+@login_required
+def import_data(request, ranch_id):
+    ranch = get_object_or_404(Ranch, id=ranch_id)
+    result = None
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = io.TextIOWrapper(form.cleaned_data['file'], encoding='utf-8-sig', newline='')
+            try:
+                result = IMPORTERS[form.cleaned_data['kind']](ranch, upload)
+            except (UnicodeDecodeError, ValueError) as e:
+                form.add_error('file', str(e))
+    else:
+        form = ImportForm()
+    return render(request, 'scheduler/import_data.html', {
+        'ranch': ranch, 'form': form, 'result': result,
+        'errors': result.errors[:100] if result else [],
+    })
+
+@csrf_exempt
+def ingest_telemetry(request):
+    # Batched flow meter samples, authenticated with "Authorization: Bearer <TELEMETRY_TOKEN>"
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    token = getattr(settings, 'TELEMETRY_TOKEN', '')
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not token or not constant_time_compare(supplied, token):
+        return JsonResponse({'error': 'Invalid token.'}, status=401)
+    try:
+        points, errors = parse_batch(json.loads(request.body))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    get_buffer().add(points)
+    return JsonResponse({'accepted': len(points), 'errors': errors[:100]}, status=202)
 
-    return render(request, 'scheduler/ranch_report.html', {'ranch': ranch, 'report_data': report_data, 'form': form})
-  
\ No newline at end of file
+def metrics(request):
+    # Prometheus scrape endpoint for staff users, or scrapers sending
+    # "Authorization: Bearer <METRICS_TOKEN>". The client address is not trusted:
+    # behind a reverse proxy every request arrives from the proxy.
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not request.user.is_staff and not (token and constant_time_compare(supplied, token)):
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
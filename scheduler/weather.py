@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Ranch, WeatherObservation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URL = 'https://api.davissystems.com/weather'
+
+class DavisBackend:
+    # Davis weather API over one pooled requests.Session with timeouts and retries.
+    def __init__(self, api_key='', url=DEFAULT_URL, timeout=5, retries=3, pool_size=10):
+        self.api_key = api_key
+        self.url = url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch(self, location, day=None):
+        params = {'location': location, 'key': self.api_key}
+        if day is not None:
+            params['date'] = day.isoformat()
+        response = self.session.get(self.url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch_many(self, locations, day=None):
+        # Fetch several locations at once over the shared connection pool
+        with ThreadPoolExecutor(max_workers=max(1, min(self.pool_size, len(locations)))) as pool:
+            return dict(zip(locations, pool.map(lambda location: self._fetch_or_error(location, day), locations)))
+
+    def _fetch_or_error(self, location, day):
+        try:
+            return self.fetch(location, day)
+        except (requests.RequestException, ValueError) as e:
+            return e
+
+class StubBackend:
+    # Offline backend for tests and local development. Returns fixed values, or
+    # per-location ones from `observations`, without touching the network.
+    # Connection options meant for a real backend (api_key, timeout, ...) are
+    # ignored, so switching WEATHER_BACKEND alone is enough.
+    def __init__(self, eto=0.2, rainfall=0.0, observations=None, **options):
+        self.eto = eto
+        self.rainfall = rainfall
+        self.observations = observations or {}
+        self.calls = []
+
+    def fetch(self, location, day=None):
+        self.calls.append((location, day))
+        payload = {'location': location, 'eto': self.eto, 'rainfall': self.rainfall}
+        payload.update(self.observations.get(location, {}))
+        return payload
+
+    def fetch_many(self, locations, day=None):
+        return {location: self.fetch(location, day) for location in locations}
+
+def _decimal(value):
+    if value is None:
+        return None
+    try:
+        return Decimal(str(value)).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return None
+
+def parse_observation(location, day, payload):
+    return WeatherObservation(
+        location=location,
+        date=day,
+        reference_evapotranspiration=_decimal(payload.get('eto', payload.get('et0'))),
+        rainfall=_decimal(payload.get('rainfall', payload.get('rain'))),
+        payload=payload,
+        fetched_at=timezone.now(),
+    )
+
+class WeatherClient:
+    # Daily weather by location with a two-level TTL cache: process memory first,
+    # then the WeatherObservation table, then the backend.
+    def __init__(self, backend, ttl=6 * 60 * 60):
+        self.backend = backend
+        self.ttl = ttl
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def get(self, location, day=None):
+        return self.get_many([location], day).get(location)
+
+    def get_many(self, locations, day=None):
+        day = day or timezone.localdate()
+        locations = list(dict.fromkeys(location for location in locations if location))
+        found = {}
+
+        now = time.monotonic()
+        with self._lock:
+            for location in locations:
+                cached = self._memory.get((location, day))
+                if cached is not None and cached[0] > now:
+                    found[location] = cached[1]
+
+        missing = [location for location in locations if location not in found]
+        if missing:
+            fresh_after = timezone.now() - timedelta(seconds=self.ttl)
+            for observation in WeatherObservation.objects.filter(
+                location__in=missing, date=day, fetched_at__gte=fresh_after,
+            ):
+                found[observation.location] = observation
+                self._remember(observation)
+
+        missing = [location for location in locations if location not in found]
+        if missing:
+            for observation in self.store(day, self.backend.fetch_many(missing, day)):
+                found[observation.location] = observation
+        return found
+
+    def store(self, day, payloads):
+        # Upsert fetched payloads in one statement; failed fetches are logged and skipped.
+        observations = []
+        for location, payload in payloads.items():
+            if isinstance(payload, Exception):
+                logger.warning('Weather fetch failed for %s on %s: %s', location, day, payload)
+                continue
+            observations.append(parse_observation(location, day, payload))
+        with transaction.atomic():
+            WeatherObservation.objects.bulk_create(
+                observations,
+                update_conflicts=True,
+                unique_fields=['location', 'date'],
+                update_fields=['reference_evapotranspiration', 'rainfall', 'payload', 'fetched_at'],
+            )
+        for observation in observations:
+            self._remember(observation)
+        return observations
+
+    def _remember(self, observation):
+        with self._lock:
+            self._memory[(observation.location, observation.date)] = (time.monotonic() + self.ttl, observation)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    # Shared client built from WEATHER_BACKEND / WEATHER_OPTIONS / WEATHER_CACHE_TTL
+    global _client
+    with _client_lock:
+        if _client is None:
+            backend_class = import_string(getattr(settings, 'WEATHER_BACKEND', 'scheduler.weather.DavisBackend'))
+            backend = backend_class(**getattr(settings, 'WEATHER_OPTIONS', {}))
+            _client = WeatherClient(backend, getattr(settings, 'WEATHER_CACHE_TTL', 6 * 60 * 60))
+        return _client
+
+def reset_client():
+    global _client
+    with _client_lock:
+        _client = None
+
+@receiver(setting_changed)
+def _reset_client_on_setting_change(setting, **kwargs):
+    if setting.startswith('WEATHER_'):
+        reset_client()
+
+_backends = {}
+
+def get_backend(api_key):
+    # One pooled DavisBackend per API key, for callers that pass their own key
+    with _client_lock:
+        if api_key not in _backends:
+            options = getattr(settings, 'WEATHER_OPTIONS', {})
+            _backends[api_key] = DavisBackend(api_key, **{
+                k: v for k, v in options.items() if k in ('url', 'timeout', 'retries', 'pool_size')
+            })
+        return _backends[api_key]
+
+def get_reference_et(ranches, day=None):
+    # ETo per ranch id for the ranches that have a location, fetched in one batch
+    observations = get_client().get_many([ranch.location for ranch in ranches], day)
+    return {
+        ranch.id: observations[ranch.location].reference_evapotranspiration
+        for ranch in ranches
+        if ranch.location in observations
+    }
+
+def station_key(location):
+    # Ranches that name the same station with different spacing or case share one fetch
+    return ' '.join(location.split()).lower()
+
+async def afetch_many(backend, locations, day=None, concurrency=10):
+    # Fetch every location concurrently, at most `concurrency` at a time. Backends
+    # are blocking (requests), so each fetch runs in a worker thread over the
+    # backend's pooled session.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(location):
+        async with semaphore:
+            try:
+                return location, await asyncio.to_thread(backend.fetch, location, day)
+            except (requests.RequestException, ValueError) as e:
+                return location, e
+
+    return dict(await asyncio.gather(*(fetch(location) for location in locations)))
+
+async def arefresh_reference_et(day=None, concurrency=None):
+    # Refresh today's weather for every ranch location: one fetch per station,
+    # then one bulk upsert for all of them. Returns the stored observations.
+    client = get_client()
+    day = day or timezone.localdate()
+    concurrency = concurrency or getattr(client.backend, 'pool_size', 10)
+
+    stations = {}
+    async for location in Ranch.objects.exclude(location='').values_list('location', flat=True).distinct():
+        stations.setdefault(station_key(location), []).append(location)
+
+    fetched = await afetch_many(client.backend, [locations[0] for locations in stations.values()], day, concurrency)
+    payloads = {}
+    for locations in stations.values():
+        for location in locations:
+            payloads[location] = fetched[locations[0]]
+    return await sync_to_async(client.store)(day, payloads)